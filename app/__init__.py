@@ -2,8 +2,6 @@ import logging
 import os
 from logging.handlers import SMTPHandler, RotatingFileHandler
 
-import rq
-from elasticsearch import Elasticsearch
 from flask import Flask, request, current_app
 from flask_babel import Babel
 from flask_babel import lazy_gettext
@@ -11,12 +9,24 @@ from flask_login import LoginManager
 from flask_mail_sendgrid import MailSendGrid
 from flask_migrate import Migrate
 from flask_moment import Moment
-from flask_sqlalchemy import SQLAlchemy
-from redis import Redis
 
+from app.assets import Assets
+from app.clients import LazyClient
+from app.compression import Compress
+from app.fragments import FragmentCache
+from app.graph import FollowGraph
+from app.passwords import PasswordHasher
+from app.profiling import SlowQueryLog, SQLProfiler
+from app.ratelimit import RateLimiter
+from app.resilience import CircuitBreakers, guard_redis
+from app.routing import RoutingSQLAlchemy
+from app.serialization import JSONProvider
+from app.telemetry import Metrics, instrument_redis
+from app.templating import TemplateCache
+from app.tracing import Tracer, trace_redis
 from config import Config
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 login = LoginManager()
 mail = MailSendGrid()
@@ -24,25 +34,54 @@ login.login_view = 'auth.login'
 login.login_message = lazy_gettext('Please log in to access this page.')
 moment = Moment()
 babel = Babel()
+sql_profiler = SQLProfiler()
+metrics = Metrics()
+fragment_cache = FragmentCache()
+follow_graph = FollowGraph()
+compress = Compress()
+json_provider = JSONProvider()
+limiter = RateLimiter()
+template_cache = TemplateCache()
+assets = Assets()
+tracer = Tracer()
+slow_query_log = SlowQueryLog(metrics)
+password_hasher = PasswordHasher(metrics)
+circuit_breakers = CircuitBreakers(metrics)
 
 
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
-    app.elasticsearch = Elasticsearch(
-        app.config.get('ELASTICSEARCH_URL', None),
-        basic_auth=(app.config.get('ELASTICSEARCH_NAME', None), app.config.get('ELASTICSEARCH_PASS', None)),
-        verify_certs=False,
-        ssl_show_warn=False) if app.config['ELASTICSEARCH_URL'] else None
-    app.redis = Redis.from_url(app.config['REDIS_URL'])
-    app.task_queue = rq.Queue('easyblogbd-tasks', connection=app.redis)
-
+    if app.config['ELASTICSEARCH_URL']:
+        app.elasticsearch = LazyClient(lambda: _elasticsearch(app.config))
+    elif app.config['SEARCH_BACKEND'] == 'local':
+        from app.search import LocalSearch
+        app.elasticsearch = LocalSearch()
+    else:
+        app.elasticsearch = None
+    app.redis = LazyClient(lambda: _redis(app))
+    app.task_queue = LazyClient(lambda: _task_queue(app))
+    app.translator = LazyClient(lambda: _translator(app.config))
+
+    circuit_breakers.init_app(app)
     db.init_app(app)
     migrate.init_app(app, db)
     login.init_app(app)
     mail.init_app(app)
     moment.init_app(app)
     babel.init_app(app)
+    sql_profiler.init_app(app)
+    metrics.init_app(app)
+    tracer.init_app(app)
+    slow_query_log.init_app(app)
+    password_hasher.init_app(app)
+    fragment_cache.init_app(app)
+    follow_graph.init_app(app)
+    compress.init_app(app)
+    json_provider.init_app(app)
+    limiter.init_app(app)
+    template_cache.init_app(app)
+    assets.init_app(app)
 
     from app.errors import bp as errors_bp
     app.register_blueprint(errors_bp)
@@ -56,6 +95,12 @@ def create_app(config_class=Config):
     from app.api import bp as api_bp
     app.register_blueprint(api_bp, url_prefix='/api')
 
+    from app.monitoring import bp as monitoring_bp
+    app.register_blueprint(monitoring_bp)
+
+    if app.config['TEMPLATE_WARMUP']:
+        template_cache.compile(app)
+
     if not app.debug and not app.testing:
         if app.config['MAIL_SERVER']:
             auth = None
@@ -89,6 +134,33 @@ def create_app(config_class=Config):
     return app
 
 
+def _elasticsearch(config):
+    from elasticsearch import Elasticsearch
+    return Elasticsearch(
+        config.get('ELASTICSEARCH_URL', None),
+        basic_auth=(config.get('ELASTICSEARCH_NAME', None), config.get('ELASTICSEARCH_PASS', None)),
+        verify_certs=False,
+        ssl_show_warn=False,
+        request_timeout=config['ELASTICSEARCH_TIMEOUT'])
+
+
+def _redis(app):
+    from redis import Redis
+    client = Redis.from_url(app.config['REDIS_URL'], socket_timeout=app.config['REDIS_SOCKET_TIMEOUT'],
+                            socket_connect_timeout=app.config['REDIS_SOCKET_TIMEOUT'])
+    return trace_redis(guard_redis(instrument_redis(client, metrics), app.extensions['circuit_breakers']['redis']))
+
+
+def _task_queue(app):
+    import rq
+    return rq.Queue('easyblogbd-tasks', connection=app.redis)
+
+
+def _translator(config):
+    from googletrans import Translator
+    return Translator(timeout=config['TRANSLATOR_TIMEOUT'])
+
+
 @babel.localeselector
 def get_locale():
     return request.accept_languages.best_match(current_app.config['LANGUAGES'])
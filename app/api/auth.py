@@ -1,5 +1,6 @@
 from flask_httpauth import HTTPBasicAuth, HTTPTokenAuth
 
+from app import db
 from app.api.errors import error_response
 from app.models import User
 
@@ -10,7 +11,10 @@ token_auth = HTTPTokenAuth()
 @basic_auth.verify_password
 def verify_password(username, password):
     user = User.query.filter_by(username=username).first()
-    return user if user and user.check_password(password) else None
+    if user is None or not user.check_password(password):
+        return None
+    db.session.commit()
+    return user
 
 
 @basic_auth.error_handler
@@ -13,3 +13,9 @@ def error_response(status_code, message=None):
 
 def bad_request(message):
     return error_response(400, message)
+
+
+def too_many_requests(retry_after):
+    response = error_response(429, f'Rate limit exceeded, retry in {retry_after} seconds')
+    response.headers['Retry-After'] = str(retry_after)
+    return response
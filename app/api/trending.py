@@ -0,0 +1,35 @@
+from flask import current_app, jsonify, request, url_for
+
+from app.api import bp
+from app.api.auth import token_auth
+from app.api.errors import bad_request
+from app.routing import read_only
+from app.trending import WINDOWS, trending
+
+
+@bp.route('/trending', methods=['GET'])
+@token_auth.login_required
+@read_only
+def get_trending():
+    window = request.args.get('window', 'hour')
+    if window not in WINDOWS:
+        return bad_request(f'window must be one of {", ".join(WINDOWS)}')
+    limit = min(request.args.get('limit', 10, type=int), current_app.config['TRENDING_TOP_K'])
+    snapshot = trending.snapshot(window, limit)
+    return jsonify({
+        'window': window,
+        'posts': [{
+            'id': post.id,
+            'body': post.body,
+            'timestamp': post.timestamp,
+            'score': score,
+            '_links': {'author': url_for('api.get_user', id=post.user_id)}
+        } for post, score in snapshot['posts']],
+        'authors': [{
+            'id': user.id,
+            'username': user.username,
+            'score': score,
+            '_links': {'self': url_for('api.get_user', id=user.id), 'avatar': user.avatar(128)}
+        } for user, score in snapshot['authors']],
+        'terms': [{'term': term, 'score': score} for term, score in snapshot['terms']]
+    })
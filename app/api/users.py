@@ -1,41 +1,73 @@
-from flask import jsonify, request, url_for, abort
+from flask import Response, current_app, jsonify, request, stream_with_context, url_for, abort
 
 from app import db
 from app.api import bp
 from app.api.auth import token_auth
 from app.api.errors import bad_request
+from app.helper import not_modified
 from app.models import User
+from app.readmodels import paginate_users
+from app.routing import read_only
 
 
 @bp.route('/users/<int:id>', methods=['GET'])
 @token_auth.login_required
+@read_only
 def get_user(id):
-    return jsonify(User.query.get_or_404(id).to_dict())
+    user = User.query.get_or_404(id)
+    response = not_modified(user.version, user.last_seen)
+    if response is not None:
+        return response
+    return jsonify(user.to_dict())
 
 
 @bp.route('/users', methods=['GET'])
 @token_auth.login_required
+@read_only
 def get_users():
     page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 10, type=int), 100)
-    data = User.to_collection_dict(User.query, page, per_page, 'api.get_users')
-    return jsonify(data), 200
+    response = not_modified(User.collection_stamp(User.query, page, per_page))
+    if response is not None:
+        return response
+    return _streamed_collection(User.query, page, per_page, 'api.get_users')
 
 
 @bp.route('/users/<int:id>/followers', methods=['GET'])
 @token_auth.login_required
+@read_only
 def get_followers(id):
     user, page, per_page = _user_page_per_page(id)
-    data = User.to_collection_dict(user.followers, page, per_page, 'api.get_followers', id=id)
-    return jsonify(data), 200
+    response = not_modified(User.collection_stamp(user.followers, page, per_page))
+    if response is not None:
+        return response
+    return _streamed_collection(user.followers, page, per_page, 'api.get_followers', id=id)
 
 
 @bp.route('/users/<int:id>/followed', methods=['GET'])
 @token_auth.login_required
+@read_only
 def get_followed(id):
     user, page, per_page = _user_page_per_page(id)
-    data = User.to_collection_dict(user.followed, page, per_page, 'api.get_followed', id=id)
-    return jsonify(data), 200
+    response = not_modified(User.collection_stamp(user.followed, page, per_page))
+    if response is not None:
+        return response
+    return _streamed_collection(user.followed, page, per_page, 'api.get_followed', id=id)
+
+
+@bp.route('/users/<int:id>/suggestions', methods=['GET'])
+@token_auth.login_required
+@read_only
+def get_suggestions(id):
+    if token_auth.current_user().id != id:
+        abort(403)
+    limit = min(request.args.get('limit', 10, type=int), current_app.config['SUGGESTIONS_PER_USER'])
+    return jsonify({'items': [{
+        'id': user.id,
+        'username': user.username,
+        'score': score,
+        '_links': {'self': url_for('api.get_user', id=user.id), 'avatar': user.avatar(128)}
+    } for user, score in token_auth.current_user().suggested_users(limit)]})
 
 
 @bp.route('/users', methods=['POST'])
@@ -80,3 +112,9 @@ def _user_page_per_page(id):
     page = request.args.get('page', 1, type=int)
     per_page = min(request.args.get('per_page', 10, type=int), 100)
     return user, page, per_page
+
+
+def _streamed_collection(query, page, per_page, endpoint, **kwargs):
+    resources = paginate_users(query, page, per_page)
+    return Response(stream_with_context(User.stream_collection(resources, endpoint, **kwargs)),
+                    mimetype='application/json')
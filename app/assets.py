@@ -0,0 +1,135 @@
+""" Static asset bundles with content hashed file names, served with far future cache headers. """
+import hashlib
+import json
+import os
+import tempfile
+from urllib.request import urlopen
+
+from flask import current_app, request, url_for
+
+DIST_DIR = 'dist'
+MANIFEST = os.path.join(DIST_DIR, 'manifest.json')
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Third party files by their path under the static folder, with the CDN copy pages link to until they are vendored.
+VENDOR = {
+    'vendor/moment-with-locales.min.js':
+        'https://cdnjs.cloudflare.com/ajax/libs/moment.js/2.29.1/moment-with-locales.min.js',
+    'vendor/popper.min.js': 'https://unpkg.com/@popperjs/core@2.11.5/dist/umd/popper.min.js',
+    'vendor/tippy-bundle.umd.min.js': 'https://unpkg.com/tippy.js@6.3.7/dist/tippy-bundle.umd.min.js',
+    'vendor/shift-away-subtle.css': 'https://unpkg.com/tippy.js@6.3.7/animations/shift-away-subtle.css',
+    'vendor/light.css': 'https://unpkg.com/tippy.js@6.3.7/themes/light.css',
+}
+
+# Bundle name to the files concatenated into it, in load order.
+BUNDLES = {
+    'vendor.css': ('vendor/shift-away-subtle.css', 'vendor/light.css'),
+    'vendor.js': ('vendor/moment-with-locales.min.js', 'vendor/popper.min.js', 'vendor/tippy-bundle.umd.min.js'),
+    'app.js': ('translate.js', 'popover.js'),
+}
+
+
+def minify(text, path):
+    """
+    Drops indentation, blank lines and whole line comments. Line breaks are kept, the app's scripts rely on automatic
+    semicolon insertion. Files already minified are returned as they are.
+    @param text: String
+    @param path: String
+    @return: String
+    """
+    if '.min.' in path:
+        return text.strip()
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+
+def _write_atomic(path, data):
+    fd, temporary = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(temporary, path)
+
+
+class Assets:
+    """
+    Resolves bundle names for templates through asset_urls(). Once `flask assets build` has written the manifest a
+    bundle is one file whose name carries a hash of its content, so it can be cached forever and a changed bundle
+    gets a new URL. Without a manifest, during development, every file is linked on its own and third party files
+    not vendored yet come from their CDN.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        try:
+            with open(os.path.join(app.static_folder, MANIFEST)) as f:
+                app.extensions['assets'] = json.load(f)
+        except FileNotFoundError:
+            app.extensions['assets'] = {}
+        app.add_template_global(self.urls, 'asset_urls')
+        app.after_request(self._cache_headers)
+
+    @staticmethod
+    def urls(bundle):
+        """
+        @param bundle: String, a key of BUNDLES
+        @return: List of URLs to load, in order
+        """
+        built = current_app.extensions['assets'].get(bundle)
+        if built is not None:
+            return [url_for('static', filename=built)]
+        return [url_for('static', filename=path) if os.path.exists(os.path.join(current_app.static_folder, path))
+                else VENDOR[path] for path in BUNDLES[bundle]]
+
+    @staticmethod
+    def _cache_headers(response):
+        if request.endpoint == 'static' and response.status_code == 200 and \
+                request.view_args['filename'].startswith(DIST_DIR + '/'):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+    @staticmethod
+    def build(app):
+        """
+        Concatenates and minifies every bundle whose files are all present into DIST_DIR and writes the manifest.
+        Files of earlier builds are kept for pages still referring to them.
+        @param app: Flask app
+        @return: Dictionary of bundle name to built path, bundles with missing files left out
+        """
+        os.makedirs(os.path.join(app.static_folder, DIST_DIR), exist_ok=True)
+        manifest = {}
+        for bundle, paths in BUNDLES.items():
+            files = [os.path.join(app.static_folder, path) for path in paths]
+            if not all(os.path.exists(file) for file in files):
+                continue
+            parts = []
+            for path, file in zip(paths, files):
+                with open(file, encoding='utf-8') as f:
+                    parts.append(minify(f.read(), path))
+            stem, extension = os.path.splitext(bundle)
+            data = ('\n;\n' if extension == '.js' else '\n').join(parts).encode('utf-8') + b'\n'
+            manifest[bundle] = f'{DIST_DIR}/{stem}.{hashlib.sha256(data).hexdigest()[:12]}{extension}'
+            _write_atomic(os.path.join(app.static_folder, manifest[bundle]), data)
+        _write_atomic(os.path.join(app.static_folder, MANIFEST), json.dumps(manifest, indent=4).encode('utf-8'))
+        app.extensions['assets'] = manifest
+        return manifest
+
+    @staticmethod
+    def vendor(app):
+        """
+        Downloads the third party files into the static folder.
+        @param app: Flask app
+        @return: List of the downloaded paths
+        """
+        for path, url in VENDOR.items():
+            with urlopen(url, timeout=30) as response:
+                data = response.read()
+            file = os.path.join(app.static_folder, path)
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            _write_atomic(file, data)
+        return list(VENDOR)
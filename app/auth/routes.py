@@ -38,6 +38,7 @@ def login():
         if user is None or not user.check_password(form.password.data):
             return flash_message_and_redirect(
                 message=gettext('Invalid username or password.'), endpoint='auth.login', category='warning')
+        db.session.commit()
         login_user(user, remember=form.remember_me.data)
         next_page = request.args.get('next')
         if not next_page or url_parse(next_page).netloc != '':
@@ -34,3 +34,182 @@ def register(app):
         """ Compile all languages. """
         if os.system('pybabel compile -d app/translations'):
             raise RuntimeError('compile command failed')
+
+    @app.cli.group('assets')
+    def assets_group():
+        """ Static asset commands. """
+        pass
+
+    @assets_group.command()
+    def build():
+        """ Bundle, minify and fingerprint the static assets. """
+        from flask import current_app
+
+        from app import assets
+
+        manifest = assets.build(current_app)
+        for bundle, path in manifest.items():
+            click.echo(f'{bundle} -> {path}')
+
+    @assets_group.command()
+    def vendor():
+        """ Download the third party scripts and stylesheets into the static folder. """
+        from flask import current_app
+
+        from app import assets
+
+        click.echo(f'Downloaded {len(assets.vendor(current_app))} files.')
+
+    @app.cli.group()
+    def templates():
+        """ Template commands. """
+        pass
+
+    @templates.command('compile')
+    def compile_templates():
+        """ Precompile all templates into the bytecode cache. """
+        from flask import current_app
+
+        from app import template_cache
+
+        if not current_app.config['TEMPLATE_CACHE_DIR']:
+            raise click.UsageError('TEMPLATE_CACHE_DIR is not set.')
+        click.echo(f'Compiled {template_cache.compile(current_app)} templates into '
+                   f'{current_app.config["TEMPLATE_CACHE_DIR"]}.')
+
+    @app.cli.group()
+    def suggestions():
+        """ Who-to-follow suggestion commands. """
+        pass
+
+    @suggestions.command()
+    @click.option('--enqueue', is_flag=True, help='Hand the computation to an RQ worker.')
+    def compute(enqueue):
+        """ Recompute every user's who-to-follow suggestions from the follow graph. """
+        from flask import current_app
+
+        from app import db
+        from app.recommendations import refresh_suggestions
+
+        if enqueue:
+            job = current_app.task_queue.enqueue('app.tasks.compute_suggestions', job_timeout=3600)
+            click.echo(f'Enqueued job {job.get_id()}.')
+        else:
+            written = refresh_suggestions(db.engine, current_app.config['SUGGESTIONS_PER_USER'])
+            click.echo(f'Wrote {written} suggestions.')
+
+    @app.cli.group()
+    def tasks():
+        """ Background task commands. """
+        pass
+
+    @tasks.command()
+    def requeue():
+        """ Enqueue the tasks left pending while Redis was unavailable. """
+        from app import db
+        from app.models import Task
+
+        count = Task.requeue_pending()
+        db.session.commit()
+        click.echo(f'Enqueued {count} pending tasks.')
+
+    @app.cli.group()
+    def traces():
+        """ Tracing commands. """
+        pass
+
+    @traces.command()
+    @click.option('--limit', default=10, show_default=True, help='Number of traces to show.')
+    def slowest(limit):
+        """ Summarize the slowest traces written to TRACE_DIR. """
+        from flask import current_app
+
+        from app.tracing import slowest_traces
+
+        if not current_app.config['TRACE_DIR']:
+            raise click.UsageError('TRACE_DIR is not set.')
+        for summary in slowest_traces(current_app.config['TRACE_DIR'], limit):
+            errors = f', {summary["errors"]} errors' if summary['errors'] else ''
+            click.echo(f'{summary["duration_ms"]:10.1f}ms  {summary["name"]}  trace {summary["trace_id"]}  '
+                       f'{summary["spans"]} spans{errors}')
+            parts = [f'{kind} {ms:.1f}ms' for kind, ms in summary['breakdown_ms'].items()]
+            if summary['queue_ms']:
+                parts.append(f'queued {summary["queue_ms"]:.1f}ms')
+            click.echo('              ' + ', '.join(parts))
+
+    @app.cli.group()
+    def queries():
+        """ Slow query log commands. """
+        pass
+
+    @queries.command('slowest')
+    @click.option('--limit', default=10, show_default=True, help='Number of statements to show.')
+    def slowest_queries(limit):
+        """ Summarize the slow queries written to SLOW_QUERY_DIR by statement fingerprint. """
+        from flask import current_app
+
+        from app.profiling import read_slow_queries, summarize_slow_queries
+
+        if not current_app.config['SLOW_QUERY_DIR']:
+            raise click.UsageError('SLOW_QUERY_DIR is not set.')
+        for summary in summarize_slow_queries(read_slow_queries(current_app.config['SLOW_QUERY_DIR']), limit):
+            scan = '  full scan' if summary['full_scan'] else ''
+            click.echo(f'{summary["total_ms"]:10.1f}ms  {summary["count"]}x  mean {summary["mean_ms"]:.1f}ms  '
+                       f'max {summary["max_ms"]:.1f}ms  {summary["fingerprint"]}{scan}')
+            click.echo(f'    {summary["statement"]}')
+            origins = ', '.join(f'{origin} {count}' for origin, count in summary['origins'].most_common())
+            click.echo(f'    from {origins}, slowest with {summary["slowest_parameters"]}')
+            for line in summary['plan'] or ():
+                click.echo(f'    | {line}')
+
+    @app.cli.group()
+    def graph():
+        """ Follow graph cache commands. """
+        pass
+
+    @graph.command()
+    def rebuild():
+        """ Recreate the Redis follow graph from the followers table. """
+        from app import db, follow_graph
+        from app.models import followers
+
+        edges = db.session.query(followers.c.follower_id, followers.c.followed_id).yield_per(10000)
+        click.echo(f'Cached {follow_graph.rebuild(edges)} follow edges.')
+
+    @app.cli.command()
+    @click.option('--users', default=1000, show_default=True, help='Number of users to create.')
+    @click.option('--mean-follows', default=20, show_default=True, help='Average number of users each user follows.')
+    @click.option('--posts-per-user', default=10, show_default=True)
+    @click.option('--messages-per-user', default=2, show_default=True)
+    @click.option('--workers', default=os.cpu_count(), show_default=True, help='Processes generating and writing rows.')
+    @click.option('--chunk-size', default=1000, show_default=True, help='Users per chunk handed to a worker.')
+    @click.option('--seed', 'random_seed', default=0, show_default=True, help='Random seed for reproducible data.')
+    @click.option('--index/--no-index', default=False, help='Bulk index the seeded posts into the search backend.')
+    def seed(users, mean_follows, posts_per_user, messages_per_user, workers, chunk_size, random_seed, index):
+        """ Bulk insert a synthetic social graph for load testing. """
+        from time import perf_counter
+
+        from app import db, follow_graph
+        from app.feed import explore_feed
+        from app.models import Post, User
+        from app.search import bulk_index
+        from app.seed import seed_graph
+
+        if User.query.first() is not None:
+            raise click.ClickException('The database already has users, seed an empty database.')
+        start = perf_counter()
+        chunks = -(-users // chunk_size)
+        with click.progressbar(length=chunks * 5, label='Seeding') as bar:
+            counts = seed_graph(
+                db.engine, users, mean_follows, posts_per_user, messages_per_user, random_seed, workers, chunk_size,
+                progress=lambda table, count: bar.update(1))
+        elapsed = perf_counter() - start
+        for table, count in counts.items():
+            click.echo(f'{table}: {count} rows')
+        click.echo(f'Seeded in {elapsed:.1f}s, {counts["post"] / elapsed * 60:.0f} posts per minute.')
+        explore_feed.reset()
+        follow_graph.invalidate()
+        if index:
+            documents = ((id, {'body': body})
+                         for id, body in Post.query.with_entities(Post.id, Post.body).yield_per(5000))
+            click.echo(f'Indexed {bulk_index(Post.__tablename__, documents)} posts.')
@@ -0,0 +1,37 @@
+""" Clients of external services created on first use, keeping their imports and connections out of app startup. """
+import threading
+
+
+class LazyClient:
+    """
+    Stands in for the client its factory returns, calling the factory the first time an attribute is read. A lock
+    makes sure concurrent first requests share one client.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._client is not None
+
+    def _get_client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self._get_client(), name)
+
+    def __bool__(self):
+        return True
+
+    def __len__(self):
+        return len(self._get_client())
+
+    def __repr__(self):
+        return f'<LazyClient {self._client!r}>' if self.loaded else '<LazyClient not loaded>'
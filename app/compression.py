@@ -0,0 +1,87 @@
+""" Response compression negotiated on Accept-Encoding, gzip always and brotli when the package is installed. """
+import zlib
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = frozenset((
+    'application/javascript', 'application/json', 'text/css', 'text/csv', 'text/html', 'text/plain', 'text/xml'))
+
+
+def _gzip_compressor(level):
+    return zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+
+
+class _BrotliCompressor:
+    """ Gives brotli.Compressor the compress/flush interface of zlib compress objects. """
+
+    def __init__(self, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self, mode=None):
+        return self._compressor.flush() if mode is not None else self._compressor.finish()
+
+
+def _stream(chunks, compressor):
+    """
+    Compresses a streamed body chunk by chunk, flushing after every chunk so the client receives data as it is made.
+    @param chunks: Iterable of bytes
+    @param compressor: zlib compress object or _BrotliCompressor
+    @return: Generator of bytes
+    """
+    for chunk in chunks:
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+class Compress:
+    """
+    Compresses responses of COMPRESS_MIN_SIZE bytes or more and every streamed response. Files sent with send_file
+    are left alone so range requests keep working.
+    """
+
+    def __init__(self, app=None):
+        self.encodings = ()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['COMPRESS_ENABLED']:
+            return
+        self.encodings = ('br', 'gzip') if brotli is not None else ('gzip',)
+        app.after_request(self._compress)
+
+    def _compressor(self, encoding, config):
+        if encoding == 'br':
+            return _BrotliCompressor(config['COMPRESS_BROTLI_QUALITY'])
+        return _gzip_compressor(config['COMPRESS_LEVEL'])
+
+    def _compress(self, response):
+        response.vary.add('Accept-Encoding')
+        if response.status_code < 200 or response.status_code in (204, 304) or 'Content-Encoding' in response.headers \
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES or response.direct_passthrough \
+                or request.method == 'HEAD':
+            return response
+        encoding = request.accept_encodings.best_match(self.encodings)
+        if encoding is None:
+            return response
+        compressor = self._compressor(encoding, current_app.config)
+        if response.is_streamed:
+            response.response = _stream(response.iter_encoded(), compressor)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+                return response
+            response.set_data(compressor.compress(data) + compressor.flush())
+        response.headers['Content-Encoding'] = encoding
+        return response
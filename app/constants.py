@@ -2,10 +2,13 @@ from flask_babel import lazy_gettext
 
 ABOUT_ME_LENGTH = 200
 EMAIL_LENGTH = 80
+MAX_POPUPS_PER_REQUEST = 50
 MESSAGE_LENGTH = 500
 NAME_LENGTH = 128
+PASSWORD_HASH_LENGTH = 256
 PASSWORD_LENGTH = 128
 POST_LENGTH = 1200
+SNIPPET_LENGTH = 100
 USERNAME_LENGTH = 64
 
 ABOUT_ME_MESSAGE = lazy_gettext('About me can not exceed 200 characters.')
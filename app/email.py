@@ -1,14 +1,15 @@
+from contextvars import copy_context
 from threading import Thread
 
 from flask import current_app
 from flask_mail import Message
 
-from app import mail
+from app.tracing import CLIENT, span
 
 
 def send_async_email(app, message):
-    with app.app_context():
-        mail.send(message)
+    with app.app_context(), span('mail send', CLIENT):
+        app.extensions['mail'].send(message)
 
 
 def send_email(subject, sender, recipients, text_body, html_body, attachments=None, sync=False):
@@ -18,6 +19,11 @@ def send_email(subject, sender, recipients, text_body, html_body, attachments=No
     if attachments:
         for attachment in attachments:
             message.attach(*attachment)
+    if current_app.config['MAIL_SUPPRESS_SEND']:
+        return
     if sync:
-        mail.send(message)
-    Thread(target=send_async_email, args=(current_app._get_current_object(), message)).start()
+        with span('mail send', CLIENT):
+            current_app.extensions['mail'].send(message)
+    else:
+        Thread(target=copy_context().run,
+               args=(send_async_email, current_app._get_current_object(), message)).start()
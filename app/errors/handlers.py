@@ -1,7 +1,7 @@
 from flask import render_template, request
 
 from app import db
-from app.api.errors import error_response as api_error_response
+from app.api.errors import error_response as api_error_response, too_many_requests
 from app.errors import bp
 
 
@@ -21,6 +21,14 @@ def not_found_error(error):
     return render_template('errors/405.html', title='405'), 405
 
 
+@bp.app_errorhandler(429)
+def too_many_requests_error(error):
+    if request.blueprint == 'api' or wants_json_response():
+        return too_many_requests(error.retry_after)
+    return render_template('errors/429.html', title='429', retry_after=error.retry_after), 429, {
+        'Retry-After': str(error.retry_after)}
+
+
 @bp.app_errorhandler(500)
 def internal_error(error):
     db.session.rollback()
@@ -0,0 +1,228 @@
+""" Explore feed served from a Redis ring buffer of the newest posts, with keyset SQL behind it. """
+import json
+from datetime import datetime
+
+from flask import current_app
+from flask_sqlalchemy import Pagination
+from redis.exceptions import RedisError
+
+from app import db
+from app.models import PROFILE_FIELDS, Post, User
+from app.readmodels import AuthorRow, PostRow, latest_posts
+
+IDS_KEY = 'explore:ids'
+POSTS_KEY = 'explore:posts'
+AUTHORS_KEY = 'explore:authors'
+TOTAL_KEY = 'explore:total'
+GENERATION_KEY = 'explore:generation'
+REBUILD_LOCK_KEY = 'explore:rebuilding'
+
+
+class FeedPost(PostRow):
+    """ Buffered post, read back from its JSON summary. """
+    __slots__ = ()
+
+    def __init__(self, id, body, timestamp, language, user_id):
+        super().__init__(id, body, datetime.fromisoformat(timestamp), language, user_id)
+
+
+def post_summary(post):
+    return json.dumps({'id': post.id, 'body': post.body, 'timestamp': post.timestamp.isoformat(),
+                       'language': post.language, 'user_id': post.user_id})
+
+
+def author_summary(user):
+    return json.dumps({'id': user.id, 'username': user.username, 'profile_version': user.profile_version,
+                       'digest': user.email_digest()})
+
+
+class ExploreFeed:
+    """
+    Keeps the ids of the newest EXPLORE_FEED_SIZE posts in a sorted set, their bodies and their authors in two hashes
+    and the number of posts in a counter, all maintained from the session hooks. Pages lying inside the buffer are
+    rendered without touching the database. A missing counter means the buffer has to be rebuilt from SQL. A
+    generation counter moves on whenever an author changes or the buffer is rebuilt, so ETags built from the counters
+    also cover the names and avatars shown next to the posts.
+    """
+
+    @staticmethod
+    def enabled():
+        return current_app.config['EXPLORE_FEED_SIZE'] > 0
+
+    def stamp(self, page=1, per_page=25, before=None):
+        """
+        Returns the newest post id, the number of posts and the feed generation from the buffer's counters, or
+        Post.feed_stamp when the buffer is unavailable.
+        @param page: Integer
+        @param per_page: Integer
+        @param before: Integer
+        @return: Tuple
+        """
+        if self.enabled():
+            try:
+                newest, total, generation = self._read_stamp()
+                if total is None and self.rebuild():
+                    newest, total, generation = self._read_stamp()
+                if total is not None:
+                    return (int(newest[0]) if newest else None), int(total), int(generation or 0)
+            except RedisError:
+                pass
+        return Post.feed_stamp(page, per_page, before)
+
+    @staticmethod
+    def _read_stamp():
+        return current_app.redis.pipeline().zrevrange(IDS_KEY, 0, 0).get(TOTAL_KEY).get(GENERATION_KEY).execute()
+
+    def paginate(self, page, per_page, total, before=None):
+        """
+        Returns a page of the feed from the buffer when the whole page is inside it, from SQL otherwise. Deeper pages
+        reached through the next link carry the id of the last post already shown and use a keyset query.
+        @param page: Integer
+        @param per_page: Integer
+        @param total: Integer
+        @param before: Integer
+        @return: Pagination
+        """
+        items = self._buffered_page(page, per_page, total) if self.enabled() else None
+        if items is None:
+            items = latest_posts(per_page, (page - 1) * per_page, before)
+        return Pagination(None, page, per_page, total, items)
+
+    def _buffered_page(self, page, per_page, total):
+        start = (page - 1) * per_page
+        try:
+            buffered, ids = current_app.redis.pipeline().zcard(IDS_KEY).zrevrange(
+                IDS_KEY, start, start + per_page - 1).execute()
+            if min(page * per_page, total) > buffered:
+                return None
+            rows = current_app.redis.hmget(POSTS_KEY, ids) if ids else []
+            if None in rows:
+                return None
+            posts = [FeedPost(**json.loads(row)) for row in rows]
+            user_ids = sorted({post.user_id for post in posts})
+            authors = dict(zip(user_ids, current_app.redis.hmget(AUTHORS_KEY, user_ids) if user_ids else []))
+        except RedisError:
+            return None
+        if None in authors.values():
+            return None
+        try:
+            for post in posts:
+                post.author = AuthorRow(**json.loads(authors[post.user_id]))
+        except TypeError:
+            # Summaries written with other fields than AuthorRow has now, rebuilt on the next request.
+            self.reset()
+            return None
+        return posts
+
+    def rebuild(self):
+        """
+        Fills the buffer from the database. Only one process rebuilds at a time, the others keep reading from SQL.
+        @return: Boolean, whether the buffer was rebuilt
+        """
+        if not self.enabled():
+            return False
+        try:
+            if not current_app.redis.set(REBUILD_LOCK_KEY, 1, ex=30, nx=True):
+                return False
+            posts = Post.query.options(db.joinedload(Post.author)).order_by(Post.id.desc()).limit(
+                current_app.config['EXPLORE_FEED_SIZE']).all()
+            pipeline = current_app.redis.pipeline()
+            pipeline.delete(IDS_KEY, POSTS_KEY, AUTHORS_KEY)
+            if posts:
+                pipeline.zadd(IDS_KEY, {post.id: post.id for post in posts})
+                pipeline.hset(POSTS_KEY, mapping={post.id: post_summary(post) for post in posts})
+                pipeline.hset(AUTHORS_KEY, mapping={post.author.id: author_summary(post.author) for post in posts})
+            pipeline.set(TOTAL_KEY, Post.query.count())
+            pipeline.incr(GENERATION_KEY)
+            pipeline.delete(REBUILD_LOCK_KEY)
+            pipeline.execute()
+        except RedisError:
+            return False
+        return True
+
+    @staticmethod
+    def reset():
+        """
+        Drops the buffer so the next request rebuilds it, after posts were written behind the ORM's back.
+        @return: None
+        """
+        try:
+            current_app.redis.delete(TOTAL_KEY)
+        except RedisError:
+            pass
+
+    def apply(self, added, deleted, authors):
+        """
+        Applies committed changes to the buffer, trimming it back to EXPLORE_FEED_SIZE posts.
+        @param added: Dictionary of post id to (post summary, author id, author summary)
+        @param deleted: Set of post ids
+        @param authors: Dictionary of user id to author summary, refreshed only for authors already buffered
+        @return: None
+        """
+        size = current_app.config['EXPLORE_FEED_SIZE']
+        redis = current_app.redis
+        try:
+            if authors:
+                redis.incr(GENERATION_KEY)
+            if redis.get(TOTAL_KEY) is None:
+                return
+            pipeline = redis.pipeline()
+            for id, (summary, author_id, author) in added.items():
+                pipeline.zadd(IDS_KEY, {id: id}).hset(POSTS_KEY, id, summary).hset(AUTHORS_KEY, author_id, author)
+                pipeline.incr(TOTAL_KEY)
+            for id in deleted:
+                pipeline.zrem(IDS_KEY, id).hdel(POSTS_KEY, id).decr(TOTAL_KEY)
+            for user_id in authors:
+                pipeline.hexists(AUTHORS_KEY, user_id)
+            pipeline.zrange(IDS_KEY, 0, -size - 1)
+            *results, trimmed = pipeline.execute()
+            buffered_authors = results[len(results) - len(authors):] if authors else []
+            pipeline = redis.pipeline()
+            for (user_id, author), buffered in zip(authors.items(), buffered_authors):
+                if buffered:
+                    pipeline.hset(AUTHORS_KEY, user_id, author)
+            if trimmed:
+                pipeline.zremrangebyrank(IDS_KEY, 0, -size - 1).hdel(POSTS_KEY, *trimmed)
+            pipeline.execute()
+        except RedisError:
+            self.reset()
+
+
+explore_feed = ExploreFeed()
+
+
+def collect_feed_changes(session, flush_context):
+    """
+    Serializes flushed posts and changed authors while their state is loaded, for apply_feed_changes.
+    @param session: Sqlalchemy session object
+    @return: None
+    """
+    if not explore_feed.enabled():
+        return
+    changes = session.info.setdefault('explore_feed', {'added': {}, 'deleted': set(), 'authors': {}})
+    for obj in session.new:
+        if isinstance(obj, Post) and obj.author is not None:
+            changes['added'][obj.id] = (post_summary(obj), obj.author.id, author_summary(obj.author))
+    for obj in session.deleted:
+        if isinstance(obj, Post):
+            changes['added'].pop(obj.id, None)
+            changes['deleted'].add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, User) and any(
+                db.inspect(obj).attrs[field].history.has_changes() for field in PROFILE_FIELDS):
+            changes['authors'][obj.id] = author_summary(obj)
+
+
+def apply_feed_changes(session):
+    changes = session.info.pop('explore_feed', None)
+    if changes is not None and any(changes.values()):
+        explore_feed.apply(changes['added'], changes['deleted'], changes['authors'])
+
+
+def forget_feed_changes(session):
+    session.info.pop('explore_feed', None)
+
+
+db.event.listen(db.session, 'after_flush', collect_feed_changes)
+db.event.listen(db.session, 'after_commit', apply_feed_changes)
+db.event.listen(db.session, 'after_rollback', forget_feed_changes)
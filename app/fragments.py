@@ -0,0 +1,106 @@
+""" Rendered template fragment cache with an in-process LRU in front of Redis. """
+import threading
+from collections import OrderedDict
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from redis.exceptions import RedisError
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Adds a {% cache part, part, ... %}...{% endcache %} tag caching the rendered body under a key built from the parts.
+    """
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(self.call_method('_cache', [nodes.List(parts)]), [], [], body).set_lineno(lineno)
+
+    @staticmethod
+    def _cache(parts, caller):
+        if not current_app.config.get('FRAGMENT_CACHE_ENABLED'):
+            return caller()
+        return current_app.extensions['fragment_cache'].get_or_render(fragment_key(*parts), caller)
+
+
+def fragment_key(*parts):
+    return 'fragment:' + ':'.join(str(part) for part in parts)
+
+
+class FragmentCache:
+    """ Two level cache of rendered fragments, a bounded LRU per process backed by Redis shared by all processes. """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+        self.size = 0
+        self.ttl = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.size = app.config['FRAGMENT_CACHE_SIZE']
+        self.ttl = app.config['FRAGMENT_CACHE_TTL']
+        app.extensions['fragment_cache'] = self
+        self.clear()
+        app.jinja_env.add_extension(FragmentCacheExtension)
+
+    def get_or_render(self, key, render):
+        """
+        Returns the cached fragment for key, rendering and storing it on a miss.
+        @param key: String
+        @param render: Callable returning the rendered fragment
+        @return: Markup
+        """
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return Markup(self._lru[key])
+        try:
+            cached = current_app.redis.get(key)
+        except RedisError:
+            cached = None
+        if cached is not None:
+            fragment = cached.decode('utf-8')
+        else:
+            fragment = str(render())
+            try:
+                current_app.redis.setex(key, self.ttl, fragment)
+            except RedisError:
+                pass
+        self._remember(key, fragment)
+        return Markup(fragment)
+
+    def _remember(self, key, fragment):
+        with self._lock:
+            self._lru[key] = fragment
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.size:
+                self._lru.popitem(last=False)
+
+    def invalidate(self, keys):
+        """
+        Drops fragments from this process's LRU and from Redis.
+        @param keys: List of strings
+        @return: None
+        """
+        if not keys or not current_app.config.get('FRAGMENT_CACHE_ENABLED'):
+            return
+        with self._lock:
+            for key in keys:
+                self._lru.pop(key, None)
+        try:
+            current_app.redis.delete(*keys)
+        except RedisError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
@@ -0,0 +1,180 @@
+""" Follow graph mirrored in Redis sets, one set of followed ids and one of follower ids per user. """
+from flask import current_app
+from redis.exceptions import RedisError, ResponseError
+
+BUILT_KEY = 'follows:built'
+REBUILDING_KEY = 'follows:rebuilding'
+CHANGES_KEY = 'follows:changes'
+KEY_PATTERN = 'follows:*'
+# Seconds after which the marker of a rebuild that died is dropped, ending the journal of changes.
+REBUILD_TIMEOUT = 3600
+
+
+def followed_key(user_id):
+    return f'follows:{user_id}:followed'
+
+
+def followers_key(user_id):
+    return f'follows:{user_id}:followers'
+
+
+class FollowGraph:
+    """
+    Answers follow lookups from Redis. The sets only count as complete once a rebuild has set BUILT_KEY, until then
+    and whenever Redis fails every lookup returns None and the caller falls back to SQL. Follows and unfollows are
+    recorded on the session and written in one MULTI/EXEC once the transaction changing the followers table commits.
+    While a rebuild runs they are also journaled, and replayed once the copy is done so an unfollow committed during
+    the copy cannot be undone by it. Servers older than Redis 6.2 lack SMISMEMBER and get pipelined SISMEMBER.
+    """
+
+    def __init__(self, app=None):
+        self._smismember = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['follow_graph'] = self
+
+    @staticmethod
+    def enabled():
+        return current_app.config['FOLLOW_GRAPH_CACHE_ENABLED']
+
+    @staticmethod
+    def _ready(pipeline):
+        """
+        Executes a pipeline started by _pipeline and returns its results after the BUILT_KEY check, or None when the
+        cache is incomplete or Redis fails.
+        @param pipeline: Redis pipeline
+        @return: List or None
+        """
+        try:
+            built, *results = pipeline.execute()
+        except RedisError:
+            return None
+        return results if built else None
+
+    @staticmethod
+    def _pipeline():
+        return current_app.redis.pipeline(transaction=False).exists(BUILT_KEY)
+
+    def is_following(self, follower_id, followed_id):
+        """
+        @param follower_id: Integer
+        @param followed_id: Integer
+        @return: Boolean or None when the cache can not answer
+        """
+        if not self.enabled() or follower_id is None or followed_id is None:
+            return None
+        results = self._ready(self._pipeline().sismember(followed_key(follower_id), followed_id))
+        return bool(results[0]) if results is not None else None
+
+    def followed_among(self, follower_id, ids):
+        """
+        Checks a whole page of users in one round trip.
+        @param follower_id: Integer
+        @param ids: List of integers
+        @return: Set of the followed ids or None when the cache can not answer
+        """
+        if not self.enabled() or follower_id is None or not ids:
+            return None
+        if self._smismember:
+            try:
+                built, members = self._pipeline().smismember(followed_key(follower_id), ids).execute()
+                return {id for id, member in zip(ids, members) if member} if built else None
+            except ResponseError as error:
+                if 'unknown command' not in str(error).lower():
+                    return None
+                self._smismember = False
+            except RedisError:
+                return None
+        pipeline = self._pipeline()
+        for id in ids:
+            pipeline.sismember(followed_key(follower_id), id)
+        results = self._ready(pipeline)
+        return {id for id, member in zip(ids, results) if member} if results is not None else None
+
+    def counts(self, ids):
+        """
+        @param ids: List of integers
+        @return: Dictionary of user id to (followers, followed) tuple or None when the cache can not answer
+        """
+        if not self.enabled() or not ids:
+            return None
+        pipeline = self._pipeline()
+        for id in ids:
+            pipeline.scard(followers_key(id)).scard(followed_key(id))
+        results = self._ready(pipeline)
+        if results is None:
+            return None
+        return {id: (results[2 * i], results[2 * i + 1]) for i, id in enumerate(ids)}
+
+    def apply(self, changes):
+        """
+        Writes committed follows and unfollows atomically. A failed write drops BUILT_KEY, sending lookups back to
+        SQL until the next rebuild.
+        @param changes: List of (added, follower id, followed id) tuples in the order they happened
+        @return: None
+        """
+        if not self.enabled() or not changes:
+            return
+        try:
+            rebuilding = current_app.redis.exists(REBUILDING_KEY)
+            pipeline = current_app.redis.pipeline()
+            self._write(pipeline, changes)
+            if rebuilding:
+                pipeline.rpush(CHANGES_KEY, *(f'{int(added)}:{follower_id}:{followed_id}'
+                                              for added, follower_id, followed_id in changes))
+                pipeline.expire(CHANGES_KEY, REBUILD_TIMEOUT)
+            pipeline.execute()
+        except RedisError:
+            self.invalidate()
+
+    @staticmethod
+    def _write(pipeline, changes):
+        for added, follower_id, followed_id in changes:
+            if added:
+                pipeline.sadd(followed_key(follower_id), followed_id).sadd(followers_key(followed_id), follower_id)
+            else:
+                pipeline.srem(followed_key(follower_id), followed_id).srem(followers_key(followed_id), follower_id)
+
+    @staticmethod
+    def invalidate():
+        try:
+            current_app.redis.delete(BUILT_KEY)
+        except RedisError:
+            pass
+
+    def rebuild(self, edges, batch_size=10000):
+        """
+        Recreates every set from the followers table. Lookups use SQL while it runs. Changes committed meanwhile are
+        journaled by apply and replayed after the copy, in the same transaction that marks the cache built, retried
+        whenever another change lands in the journal first.
+        @param edges: Iterable of (follower id, followed id) tuples, queried only once the rebuild has started
+        @param batch_size: Integer
+        @return: Integer, the number of edges written
+        """
+        redis = current_app.redis
+        redis.pipeline().set(REBUILDING_KEY, 1, ex=REBUILD_TIMEOUT).delete(BUILT_KEY, CHANGES_KEY).execute()
+        journal = {REBUILDING_KEY, CHANGES_KEY, REBUILDING_KEY.encode(), CHANGES_KEY.encode()}
+        stale = [key for key in redis.scan_iter(KEY_PATTERN, count=batch_size) if key not in journal]
+        for start in range(0, len(stale), batch_size):
+            redis.delete(*stale[start:start + batch_size])
+        count = 0
+        pipeline = redis.pipeline(transaction=False)
+        for follower_id, followed_id in edges:
+            pipeline.sadd(followed_key(follower_id), followed_id).sadd(followers_key(followed_id), follower_id)
+            count += 1
+            if count % batch_size == 0:
+                pipeline.execute()
+        pipeline.execute()
+
+        def replay(transaction):
+            journal = transaction.lrange(CHANGES_KEY, 0, -1)
+            transaction.multi()
+            self._write(transaction, [
+                (added == '1', follower_id, followed_id)
+                for added, follower_id, followed_id in (entry.decode().split(':') for entry in journal)])
+            transaction.set(BUILT_KEY, 1).delete(REBUILDING_KEY, CHANGES_KEY)
+
+        redis.transaction(replay, CHANGES_KEY)
+        return count
@@ -1,5 +1,8 @@
-from flask import flash, redirect, url_for
-from flask_babel import lazy_gettext
+import hashlib
+from time import time
+
+from flask import after_this_request, current_app, flash, redirect, request, session, url_for
+from flask_babel import get_locale, lazy_gettext
 from flask_login import current_user
 from wtforms import ValidationError
 
@@ -17,3 +20,35 @@ def flash_message_and_redirect(*, message: str, endpoint: str, category: str = '
     if endpoint == 'main.profile':
         return redirect(url_for(endpoint, username=username))
     return redirect(url_for(endpoint))
+
+
+def not_modified(*stamps, max_age=0):
+    """
+    Answers a conditional GET with 304 Not Modified before the view runs its expensive queries and rendering.
+    The weak ETag covers the given version stamps, the URL, the viewer, the locale, the viewer's tasks in progress
+    and the CSRF token lifetime, so a cached page never carries an expired token. Returns None when the view has to
+    render, after arranging for the ETag to be sent with its response.
+    @param stamps: Cheap values that change whenever the rendered resource changes
+    @param max_age: Integer, seconds the browser may reuse the response without revalidating
+    @return: Response or None
+    """
+    if '_flashes' in session:
+        return None
+    parts = [request.full_path, current_user.get_id(), str(get_locale()), stamps]
+    if current_user.is_authenticated:
+        parts.append(tuple(task.id for task in current_user.get_tasks_in_progress()))
+    csrf_time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    if current_app.config.get('WTF_CSRF_ENABLED', True) and csrf_time_limit:
+        parts.append(int(time() // (csrf_time_limit / 2)))
+    etag = hashlib.sha1(repr(parts).encode('utf-8')).hexdigest()
+
+    @after_this_request
+    def add_etag(response):
+        if response.status_code in (200, 304):
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = f'private, max-age={max_age}' if max_age else 'private, no-cache'
+        return response
+
+    if request.if_none_match.contains_weak(etag):
+        return current_app.response_class(status=304)
+    return None
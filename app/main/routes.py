@@ -1,18 +1,23 @@
 from datetime import datetime
 
-from elastic_transport import ConnectionError
+from elastic_transport import TransportError
 from flask import (current_app, flash, g, jsonify, redirect, render_template, request, url_for)
 from flask_babel import get_locale, gettext
 from flask_login import current_user, login_required
-from googletrans import Translator
-from redis.exceptions import ConnectionError
 
 from app import db
-from app.exceptions import LangDetectException
-from app.helper import flash_message_and_redirect
+from app.api.errors import bad_request
+from app.constants import MAX_POPUPS_PER_REQUEST
+from app.feed import explore_feed
+from app.helper import flash_message_and_redirect, not_modified
 from app.main import bp
 from app.main.forms import EditProfileForm, EmptyForm, MessageForm, PostForm, SearchForm
-from app.models import Message, Notification, Post, User
+from app.models import Conversation, Notification, Post, User
+from app.readmodels import conversation_messages, inbox, timeline, user_posts
+from app.resilience import circuit
+from app.tracing import CLIENT, span
+from app.routing import read_only
+from app.trending import WINDOWS, trending
 
 
 @bp.before_request
@@ -32,26 +37,32 @@ def index():
     form = PostForm()
     if form.validate_on_submit():
         try:
-            language = Translator().detect(form.post.data).lang
-        except LangDetectException:
+            with span('translator detect', CLIENT):
+                with circuit('translator'):
+                    detected = current_app.translator.detect(form.post.data)
+                language = detected.lang
+        except Exception:  # The translator raises whatever its HTTP client or its response parsing does.
             language = ''
         post = Post(body=form.post.data, author=current_user, language=language)
         db.session.add(post)
         db.session.commit()
         return flash_message_and_redirect(
             message=gettext('Your post is successful!'), endpoint=endpoint, category='success')
-    pagination = current_user.followed_posts().paginate(
-        request.args.get('page', 1, type=int), current_app.config['POSTS_PER_PAGE'], False)
+    pagination = timeline(current_user.id, request.args.get('page', 1, type=int), current_app.config['POSTS_PER_PAGE'])
     return _render_template_with_pagination(
-        endpoint=endpoint, pagination=pagination, template_name='index.html', title=gettext('Home'), form=form)
+        endpoint=endpoint, pagination=pagination, template_name='index.html', title=gettext('Home'), form=form,
+        suggestions=current_user.suggested_users(current_app.config['SUGGESTIONS_SHOWN']))
 
 
 @bp.route('/profile/<username>')
 @login_required
+@read_only
 def profile(username):
     user = User.query.filter_by(username=username).first_or_404()
-    pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
-        request.args.get('page', 1, type=int), current_app.config['POSTS_PER_PAGE'], False)
+    response = not_modified(user.id, user.version, user.last_seen)
+    if response is not None:
+        return response
+    pagination = user_posts(user.id, request.args.get('page', 1, type=int), current_app.config['POSTS_PER_PAGE'])
     return _render_template_with_pagination(
         endpoint='main.profile', pagination=pagination, template_name='profile.html', title=gettext('Profile'),
         form=EmptyForm(), user=user)
@@ -59,10 +70,32 @@ def profile(username):
 
 @bp.route('/profile/<username>/popup')
 @login_required
+@read_only
 def profile_popup(username):
     user = User.query.filter_by(username=username).first_or_404()
+    response = not_modified(user.id, user.version, user.last_seen)
+    if response is not None:
+        return response
     form = EmptyForm()
-    return render_template('profile_popup.html', user=user, form=form)
+    return render_template('profile_popup.html', user=user, form=form, following=current_user.is_following(user))
+
+
+@bp.route('/popups')
+@login_required
+@read_only
+def profile_popups():
+    usernames = request.args.getlist('username')[:MAX_POPUPS_PER_REQUEST]
+    users = User.query.filter(User.username.in_(usernames)).order_by(User.id).all() if usernames else []
+    max_age = current_app.config['POPUP_MAX_AGE']
+    response = not_modified(*[(user.id, user.version, user.last_seen) for user in users], max_age=max_age)
+    if response is not None:
+        return response
+    form = EmptyForm()
+    following = current_user.followed_among(users)
+    follow_counts = User.follow_counts(users)
+    return jsonify({user.username: render_template(
+        'profile_popup.html', user=user, form=form, following=user.id in following, follow_counts=follow_counts)
+        for user in users})
 
 
 @bp.route('/edit_profile', methods=['GET', 'POST'])
@@ -128,19 +161,47 @@ def unfollow(username):
 
 @bp.route('/explore')
 @login_required
+@read_only
 def explore():
-    pagination = Post.query.order_by(Post.timestamp.desc()).paginate(
-        request.args.get('page', 1, type=int), current_app.config['POSTS_PER_PAGE'], False)
+    page, per_page, before = (request.args.get('page', 1, type=int), current_app.config['POSTS_PER_PAGE'],
+                              request.args.get('before', type=int))
+    stamp = explore_feed.stamp(page, per_page, before)
+    response = not_modified(*stamp)
+    if response is not None:
+        return response
+    pagination = explore_feed.paginate(page, per_page, stamp[1], before)
     return _render_template_with_pagination(
-        endpoint='main.explore', pagination=pagination, template_name='explore.html', title=gettext('Explore'))
+        endpoint='main.explore', pagination=pagination, template_name='explore.html', title=gettext('Explore'),
+        cursor=pagination.items[-1].id if pagination.items else None)
+
+
+@bp.route('/trending')
+@login_required
+@read_only
+def trending_now():
+    window = request.args.get('window')
+    window = window if window in WINDOWS else 'hour'
+    return render_template('trending.html', title=gettext('Trending'), window=window, windows=WINDOWS,
+                           **trending.snapshot(window))
 
 
 @bp.route('/translate', methods=['POST'])
 @login_required
 def translate_text():
-    return jsonify({
-        'text': Translator().translate(
-            request.json['text'], request.json['dest_language'], request.json['source_language']).text})
+    payload = request.get_json(silent=True)
+    fields = ('text', 'dest_language', 'source_language')
+    if not isinstance(payload, dict) or not all(isinstance(payload.get(field), str) and payload[field]
+                                                for field in fields):
+        return bad_request('text, dest_language and source_language must be non-empty strings.')
+    text, dest_language, source_language = (payload[field] for field in fields)
+    try:
+        with span('translator translate', CLIENT):
+            with circuit('translator'):
+                result = current_app.translator.translate(text, dest_language, source_language)
+            translated = result.text
+    except Exception:  # The translator raises whatever its HTTP client or its response parsing does.
+        return jsonify({'text': text, 'translated': False})
+    return jsonify({'text': translated, 'translated': True})
 
 
 @bp.route('/search')
@@ -150,11 +211,15 @@ def search():
         return redirect(url_for('main.explore'))
     text_to_search = g.search_form.q.data
     page = request.args.get('page', 1, type=int)
-    # Catching the ConnectionError here not in search.py to show user a message.
+    # Catching the TransportError here not in search.py to show user a message.
     try:
         posts, total_number_of_posts = Post.search(text_to_search, page, current_app.config['POSTS_PER_PAGE'])
-    except ConnectionError:
-        return render_template('errors/503.html', title='503')
+    except TransportError:
+        return render_template('search.html', title='Search', posts=[], prev_url=None, next_url=None,
+                               total_number_of_posts=0, text_to_search=text_to_search, search_unavailable=True)
+    if page == 1:
+        posts = posts.all()
+        trending.record_search(text_to_search, [post.id for post in posts])
     next_url = url_for(
         'main.search', q=text_to_search, page=page + 1) if total_number_of_posts > page * current_app.config[
         'POSTS_PER_PAGE'] else None
@@ -169,9 +234,8 @@ def send_message(receiver):
     user = User.query.filter_by(username=receiver).first_or_404()
     form = MessageForm()
     if form.validate_on_submit():
-        message = Message(author=current_user, receiver=user, body=form.message.data)
+        current_user.send_message(user, form.message.data)
         user.add_notification('unread_message_count', user.count_new_messages())
-        db.session.add(message)
         db.session.commit()
         return flash_message_and_redirect(
             message=gettext('Your message has been sent.'), category='success', endpoint='main.profile',
@@ -186,11 +250,30 @@ def messages():
     current_user.last_message_read_time = datetime.utcnow()
     current_user.add_notification('unread_message_count', 0)
     db.session.commit()
-    pagination = current_user.messages_received.order_by(
-        Message.timestamp.desc()).paginate(
-        request.args.get('page', 1, type=int), current_app.config['POSTS_PER_PAGE'], False)
-    return _render_template_with_pagination(
-        endpoint='main.messages', pagination=pagination, template_name='messages.html', title=gettext('Messages'))
+    before = request.args.get('before', type=int)
+    conversations, cursor = inbox(current_user.id, current_app.config['POSTS_PER_PAGE'], before)
+    return render_template(
+        'messages.html', title=gettext('Messages'), conversations=conversations,
+        first_url=url_for('main.messages') if before is not None else None,
+        next_url=url_for('main.messages', before=cursor) if cursor is not None else None)
+
+
+@bp.route('/messages/<username>')
+@login_required
+def conversation(username):
+    user = User.query.filter_by(username=username).first_or_404()
+    conversation = Conversation.between(current_user.id, user.id)
+    before = request.args.get('before', type=int)
+    messages, cursor = [], None
+    if conversation is not None:
+        if conversation.unread_for(current_user.id):
+            conversation.mark_read(current_user.id)
+            db.session.commit()
+        messages, cursor = conversation_messages(conversation.id, current_app.config['POSTS_PER_PAGE'], before)
+    return render_template(
+        'conversation.html', title=gettext('Messages with %(username)s', username=user.username), user=user,
+        posts=messages, first_url=url_for('main.conversation', username=username) if before is not None else None,
+        next_url=url_for('main.conversation', username=username, before=cursor) if cursor is not None else None)
 
 
 @bp.route('/notifications')
@@ -201,7 +284,7 @@ def notifications():
         Notification.timestamp > since).order_by(Notification.timestamp)
     return jsonify([{
         'name': notification.name,
-        'data': notification.get_data(),
+        'data': notification.raw_data(),
         'timestamp': notification.timestamp
     } for notification in notifications])
 
@@ -209,21 +292,26 @@ def notifications():
 @bp.route('/export_posts')
 @login_required
 def export_posts():
-    try:
-        if current_user.get_task_in_progress('export_posts'):
-            flash(gettext('An export task is currently in progress'))
-        current_user.launch_task('export_posts', gettext('Exporting posts...'))
-        db.session.commit()
-        return redirect(url_for('main.profile', username=current_user.username))
-    except ConnectionError:
-        return render_template('errors/503.html', title='503')
+    task = current_user.get_task_in_progress('export_posts')
+    if task is None:
+        task = current_user.launch_task('export_posts', gettext('Exporting posts...'))
+    elif task.queued:
+        flash(gettext('An export task is currently in progress'))
+    else:
+        task.enqueue()
+    db.session.commit()
+    if not task.queued:
+        flash(gettext('The export will start as soon as the task queue is reachable again.'))
+    return redirect(url_for('main.profile', username=current_user.username))
 
 
-def _render_template_with_pagination(*, endpoint, pagination, template_name, title, form=None, user=None):
+def _render_template_with_pagination(*, endpoint, pagination, template_name, title, form=None, user=None,
+                                     cursor=None, **context):
     next_url = url_for(
-        endpoint, page=pagination.next_num, username=user.username if user else None) if pagination.has_next else None
+        endpoint, page=pagination.next_num, username=user.username if user else None,
+        before=cursor) if pagination.has_next else None
     prev_url = url_for(
         endpoint, page=pagination.prev_num, username=user.username if user else None) if pagination.has_prev else None
     return render_template(
         template_name, title=title, posts=pagination.items, next_url=next_url,
-        prev_url=prev_url, form=form, user=user, pagination=pagination)
+        prev_url=prev_url, form=form, user=user, pagination=pagination, **context)
@@ -1,24 +1,68 @@
 # pylint: disable=no-member
 import base64
-import json
 import os
 from datetime import datetime, timedelta
 from hashlib import md5
 from time import time
+from uuid import uuid4
 
 import jwt
-from flask import current_app, url_for
+from flask import current_app, json, url_for
 from flask_login import UserMixin
 from jwt import DecodeError, ExpiredSignatureError
 from redis.exceptions import RedisError
-from rq.exceptions import NoSuchJobError
-from rq.job import Job
-from werkzeug.security import check_password_hash, generate_password_hash
+from sqlalchemy import case, func, select, update
+from sqlalchemy.exc import IntegrityError
 
-from app import db, login
+from app import db, follow_graph, fragment_cache, login, metrics, password_hasher
 from app.constants import (
-    ABOUT_ME_LENGTH, EMAIL_LENGTH, PASSWORD_LENGTH, USERNAME_LENGTH, POST_LENGTH, MESSAGE_LENGTH, NAME_LENGTH)
-from app.search import add_to_index, query_index, remove_from_index
+    ABOUT_ME_LENGTH, EMAIL_LENGTH, PASSWORD_HASH_LENGTH, USERNAME_LENGTH, POST_LENGTH, MESSAGE_LENGTH, NAME_LENGTH,
+    SNIPPET_LENGTH)
+from app.fragments import fragment_key
+from app.search import add_to_index, bulk_index, query_index, remove_from_index
+from app.serialization import RawJSON
+from app.tracing import PRODUCER, span, traceparent
+
+
+def gravatar(digest, size):
+    """
+    Returns the gravatar link of an email digest.
+    @param digest: String
+    @param size: Integer
+    @return: String
+    """
+    return f'https://www.gravatar.com/avatar/{digest}?d=retro&s={size}'
+
+
+def email_digest(email):
+    return md5(email.lower().encode('utf-8')).hexdigest()
+
+
+def user_resource(user, post_count, follower_count, followed_count):
+    """
+    Returns the API representation of a user.
+    @param user: User or UserRow
+    @param post_count: Integer
+    @param follower_count: Integer
+    @param followed_count: Integer
+    @return: Dictionary
+    """
+    return {
+        'id': user.id,
+        'username': user.username,
+        'last_seen': user.last_seen,
+        'about_me': user.about_me,
+        'post_count': post_count,
+        'follower_count': follower_count,
+        'followed_count': followed_count,
+        '_links': {
+            'self': url_for('api.get_user', id=user.id),
+            'followers': url_for('api.get_followers', id=user.id),
+            'followed': url_for('api.get_followed', id=user.id),
+            'avatar': user.avatar(128)
+        }
+    }
+
 
 followers = db.Table('followers', db.Column('follower_id', db.Integer, db.ForeignKey(
     'user.id')), db.Column('followed_id', db.Integer, db.ForeignKey('user.id')))
@@ -39,27 +83,66 @@ class PaginatedAPIMixin(object):
         resources = query.paginate(page, per_page, False)
         data = {
             'items': [item.to_dict() for item in resources.items],
-            '_meta': {
-                'page': page,
-                'per_page': per_page,
-                'total_pages': resources.pages,
-                'total_items': resources.total
-            },
-            '_links': {
-                'self': url_for(endpoint, page=page, per_page=per_page, **kwargs),
-                'next': url_for(endpoint, page=page + 1, per_page=per_page, **kwargs) if resources.has_next else None,
-                'prev': url_for(endpoint, page=page - 1, per_page=per_page, **kwargs) if resources.has_prev else None
-            }
+            '_meta': PaginatedAPIMixin._collection_meta(resources),
+            '_links': PaginatedAPIMixin._collection_links(resources, endpoint, **kwargs)
         }
         return data
 
+    @staticmethod
+    def stream_collection(resources, endpoint, **kwargs):
+        """
+        Yields the JSON document of to_collection_dict piece by piece, serializing one item at a time instead of
+        building the whole collection in memory first.
+        @param resources: Pagination of items with a to_dict method
+        @param endpoint: String
+        @param kwargs: kwargs
+        @return: Generator of strings
+        """
+        yield '{"_links": ' + json.dumps(PaginatedAPIMixin._collection_links(resources, endpoint, **kwargs))
+        yield ', "_meta": ' + json.dumps(PaginatedAPIMixin._collection_meta(resources))
+        yield ', "items": ['
+        for i, item in enumerate(resources.items):
+            yield (', ' if i else '') + json.dumps(item.to_dict())
+        yield ']}'
+
+    @staticmethod
+    def _collection_meta(resources):
+        return {
+            'page': resources.page,
+            'per_page': resources.per_page,
+            'total_pages': resources.pages,
+            'total_items': resources.total
+        }
+
+    @staticmethod
+    def _collection_links(resources, endpoint, **kwargs):
+        page, per_page = resources.page, resources.per_page
+        return {
+            'self': url_for(endpoint, page=page, per_page=per_page, **kwargs),
+            'next': url_for(endpoint, page=page + 1, per_page=per_page, **kwargs) if resources.has_next else None,
+            'prev': url_for(endpoint, page=page - 1, per_page=per_page, **kwargs) if resources.has_prev else None
+        }
+
+    @classmethod
+    def collection_stamp(cls, query, page, per_page):
+        """
+        Returns a cheap version stamp of a collection page, the ids and versions of its items plus the total count.
+        @param query: Query
+        @param page: Integer
+        @param per_page: Integer
+        @return: Tuple
+        """
+        rows = query.with_entities(cls.id, cls.version, cls.last_seen).order_by(cls.id).limit(per_page).offset(
+            (page - 1) * per_page)
+        return query.order_by(None).count(), tuple(tuple(row) for row in rows)
+
 
 class User(PaginatedAPIMixin, UserMixin, db.Model):
     """ Model class for representing the user table. """
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(USERNAME_LENGTH), index=True, unique=True)
     email = db.Column(db.String(EMAIL_LENGTH), index=True, unique=True)
-    password_hash = db.Column(db.String(PASSWORD_LENGTH))
+    password_hash = db.Column(db.String(PASSWORD_HASH_LENGTH))
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     about_me = db.Column(db.String(ABOUT_ME_LENGTH))
     last_seen = db.Column(db.DateTime, default=datetime.utcnow)
@@ -68,6 +151,8 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     tasks = db.relationship('Task', backref='user', lazy='dynamic')
     token = db.Column(db.String(32), index=True, unique=True)
     token_expiration = db.Column(db.DateTime)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    profile_version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
     followed = db.relationship(
         'User',
         secondary=followers,
@@ -91,15 +176,19 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         @param password: String
         @return: None
         """
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
 
     def check_password(self, password):
         """
-        Checks password against the password hash.
+        Checks password against the password hash, upgrading a hash generated with old parameters when it matches.
+        The caller commits the upgrade.
         @param password: String
         @return: Boolean
         """
-        return check_password_hash(self.password_hash, password)
+        matches, password_hash = password_hasher.verify(self.password_hash, password)
+        if password_hash is not None:
+            self.password_hash = password_hash
+        return matches
 
     def avatar(self, size):
         """
@@ -107,8 +196,10 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         @param size: Integer
         @return: String
         """
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return f'https://www.gravatar.com/avatar/{digest}?d=retro&s={size}'
+        return gravatar(self.email_digest(), size)
+
+    def email_digest(self):
+        return email_digest(self.email)
 
     def follow(self, user):
         """
@@ -118,6 +209,9 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         """
         if not self.is_following(user):
             self.followed.append(user)
+            self.touch()
+            user.touch()
+            db.session.info.setdefault('follow_changes', []).append((True, self, user))
 
     def unfollow(self, user):
         """
@@ -127,6 +221,16 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         """
         if self.is_following(user):
             self.followed.remove(user)
+            self.touch()
+            user.touch()
+            db.session.info.setdefault('follow_changes', []).append((False, self, user))
+
+    def touch(self):
+        """
+        Bumps the version stamp used for conditional requests and cache keys.
+        @return: None
+        """
+        self.version = (self.version or 1) + 1
 
     def is_following(self, user):
         """
@@ -134,8 +238,71 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         @param user: User
         @return: Boolean
         """
+        pending = self._pending_follows()
+        if user in pending:
+            return pending[user]
+        cached = follow_graph.is_following(self.id, user.id)
+        if cached is not None:
+            return cached
         return self.followed.filter(followers.c.followed_id == user.id).count() > 0
 
+    def followed_among(self, users):
+        """
+        Returns the ids of the given users this user follows, with a single query or Redis round trip.
+        @param users: List of User
+        @return: Set of integers
+        """
+        ids = [user.id for user in users]
+        if not ids:
+            return set()
+        followed = follow_graph.followed_among(self.id, ids)
+        if followed is None:
+            followed = {followed_id for followed_id, in db.session.query(followers.c.followed_id).filter(
+                followers.c.follower_id == self.id, followers.c.followed_id.in_(ids))}
+        for user, added in self._pending_follows().items():
+            if user.id in ids:
+                followed = followed | {user.id} if added else followed - {user.id}
+        return followed
+
+    def _pending_follows(self):
+        """
+        Returns the follows and unfollows made by this user in the current transaction, which the Redis copy of the
+        follow graph only learns about after commit.
+        @return: Dictionary of User to Boolean
+        """
+        return {followed: added for added, follower, followed in db.session.info.get('follow_changes', ())
+                if follower is self}
+
+    @staticmethod
+    def follow_counts(users):
+        """
+        Returns the follower and followed counts of the given users with two grouped queries or one Redis round trip.
+        @param users: List of User
+        @return: Dictionary of user id to (followers, followed) tuple
+        """
+        ids = [user.id for user in users]
+        cached = follow_graph.counts(ids)
+        if cached is not None:
+            return cached
+        counts = {id: [0, 0] for id in ids}
+        if ids:
+            for position, column in enumerate((followers.c.followed_id, followers.c.follower_id)):
+                for id, count in db.session.query(column, db.func.count()).filter(column.in_(ids)).group_by(column):
+                    counts[id][position] = count
+        return {id: tuple(count) for id, count in counts.items()}
+
+    def suggested_users(self, limit):
+        """
+        Returns the precomputed who-to-follow picks the user does not follow yet, with one query.
+        @param limit: Integer
+        @return: List of (User, score) tuples
+        """
+        already_followed = db.session.query(followers.c.followed_id).filter(followers.c.follower_id == self.id)
+        return db.session.query(User, Suggestion.score) \
+            .join(Suggestion, Suggestion.suggested_id == User.id) \
+            .filter(Suggestion.user_id == self.id, User.id.notin_(already_followed)) \
+            .order_by(Suggestion.rank).limit(limit).all()
+
     def followed_posts(self):
         """
         Query all the followed posts of the user.
@@ -183,6 +350,20 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
             .filter_by(receiver=self) \
             .filter(Message.timestamp > (self.last_message_read_time or datetime(1900, 1, 1))).count()
 
+    def send_message(self, receiver, body):
+        """
+        Adds a message to the session and records it in the summary of the conversation with the receiver.
+        @param receiver: User
+        @param body: String
+        @return: Message object
+        """
+        message = Message(author=self, receiver=receiver, body=body,
+                          conversation_id=Conversation.get_or_create_id(self.id, receiver.id))
+        db.session.add(message)
+        db.session.flush()
+        Conversation.record(message)
+        return message
+
     def add_notification(self, name, data):
         """
         Removes any previous notification and adds notification to the session.
@@ -197,14 +378,16 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
 
     def launch_task(self, name, description, *args, **kwargs):
         """
-        Creates a job and returns the task.
+        Creates a task and enqueues its job. While Redis is unavailable the task is kept pending, to be enqueued
+        again by Task.requeue_pending.
         @param name: String
         @param description: String
         @return: Task object
         """
-        rq_job = current_app.task_queue.enqueue('app.tasks.' + name, self.id, *args, **kwargs)
-        task = Task(id=rq_job.get_id(), name=name, description=description, user=self)
+        task = Task(id=str(uuid4()), name=name, description=description, user=self, queued=False,
+                    arguments_json=json.dumps({'args': args, 'kwargs': kwargs}))
         db.session.add(task)
+        task.enqueue()
         return task
 
     def get_tasks_in_progress(self):
@@ -228,21 +411,7 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
         @param include_email: Boolean
         @return: Dictionary
         """
-        data = {
-            'id': self.id,
-            'username': self.username,
-            'last_seen': self.last_seen.isoformat() + 'Z',
-            'about_me': self.about_me,
-            'post_count': self.posts.count(),
-            'follower_count': self.followers.count(),
-            'followed_count': self.followed.count(),
-            '_links': {
-                'self': url_for('api.get_user', id=self.id),
-                'followers': url_for('api.get_followers', id=self.id),
-                'followed': url_for('api.get_followed', id=self.id),
-                'avatar': self.avatar(128)
-            }
-        }
+        data = user_resource(self, self.posts.count(), self.followers.count(), self.followed.count())
         if include_email:
             data['email'] = self.email
         return data
@@ -353,8 +522,8 @@ class SearchableMixin:
         Adds data to elasticsearch index.
         @return: None
         """
-        for obj in cls.query:
-            add_to_index(cls.__tablename__, obj)
+        bulk_index(cls.__tablename__, ((obj.id, {field: getattr(obj, field) for field in cls.__searchable__})
+                                       for obj in cls.query.yield_per(1000)))
 
 
 class Post(SearchableMixin, db.Model):
@@ -363,9 +532,31 @@ class Post(SearchableMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     body = db.Column(db.String(POST_LENGTH))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), index=True)
     language = db.Column(db.String(5))
 
+    @staticmethod
+    def feed_stamp(page=1, per_page=25, before=None):
+        """
+        Returns the version stamp of an explore page from SQL: the newest post id, the number of posts and the ids of
+        the page's posts with their authors' profile versions, so renamed authors change it too. It counts the whole
+        table, and only stands in for ExploreFeed.stamp while the feed buffer is unavailable.
+        @param page: Integer
+        @param per_page: Integer
+        @param before: Integer, only posts with a lower id, as on keyset pages
+        @return: Tuple
+        """
+        newest = select(func.max(Post.id)).scalar_subquery()
+        total = select(func.count(Post.id)).scalar_subquery()
+        statement = select(newest, total, Post.id, User.profile_version).join(
+            User, User.id == Post.user_id).order_by(Post.id.desc()).limit(per_page)
+        statement = statement.where(Post.id < before) if before is not None else statement.offset(
+            (page - 1) * per_page)
+        rows = db.session.execute(statement).all()
+        if not rows:
+            return tuple(db.session.execute(select(newest, total)).one()) + ((),)
+        return rows[0][0], rows[0][1], tuple((id, version) for _, _, id, version in rows)
+
     def __repr__(self):
         """
         String representation of Post class.
@@ -381,6 +572,8 @@ class Message(db.Model):
     receiver_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     body = db.Column(db.String(MESSAGE_LENGTH))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'))
+    __table_args__ = (db.Index('ix_message_conversation_id_id', 'conversation_id', 'id'),)
 
     def __repr__(self):
         """
@@ -390,6 +583,144 @@ class Message(db.Model):
         return f'<Message {self.body}>'
 
 
+class Conversation(db.Model):
+    """
+    Model class for representing the conversation table, a summary of the messages between two users kept up to date
+    by User.send_message. The participants are stored lowest id first as user_a and user_b, and each side has its own
+    unread count. Message ids only grow, so the newest conversations are the ones with the highest last_message_id.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_a_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    user_b_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_id = db.Column(db.Integer)
+    last_snippet = db.Column(db.String(SNIPPET_LENGTH))
+    last_timestamp = db.Column(db.DateTime)
+    unread_a = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    unread_b = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    __table_args__ = (
+        db.UniqueConstraint('user_a_id', 'user_b_id'),
+        db.Index('ix_conversation_user_a_id_last_message_id', 'user_a_id', 'last_message_id'),
+        db.Index('ix_conversation_user_b_id_last_message_id', 'user_b_id', 'last_message_id'),
+    )
+
+    @staticmethod
+    def participants(user_id, other_id):
+        """
+        @param user_id: Integer
+        @param other_id: Integer
+        @return: Tuple of the user_a_id and user_b_id of their conversation
+        """
+        return min(user_id, other_id), max(user_id, other_id)
+
+    @classmethod
+    def between(cls, user_id, other_id):
+        """
+        @param user_id: Integer
+        @param other_id: Integer
+        @return: Conversation or None
+        """
+        user_a_id, user_b_id = cls.participants(user_id, other_id)
+        return cls.query.filter_by(user_a_id=user_a_id, user_b_id=user_b_id).first()
+
+    @classmethod
+    def get_or_create_id(cls, user_id, other_id):
+        """
+        Returns the id of the conversation between two users, creating it in a savepoint when there is none. A
+        concurrent request creating the same conversation makes the insert fail on the unique constraint, the row it
+        created is used then.
+        @param user_id: Integer
+        @param other_id: Integer
+        @return: Integer
+        """
+        user_a_id, user_b_id = cls.participants(user_id, other_id)
+        lookup = db.session.query(cls.id).filter_by(user_a_id=user_a_id, user_b_id=user_b_id)
+        id = lookup.scalar()
+        if id is None:
+            try:
+                with db.session.begin_nested():
+                    conversation = cls(user_a_id=user_a_id, user_b_id=user_b_id)
+                    db.session.add(conversation)
+                id = conversation.id
+            except IntegrityError:
+                id = lookup.scalar()
+        return id
+
+    @classmethod
+    def record(cls, message):
+        """
+        Moves the summary of the message's conversation to the flushed message with one atomic update and counts it as
+        unread for the receiver. A message older than the one already summarized, committed late by a concurrent
+        request, only adds to the unread count.
+        @param message: Message, flushed
+        @return: None
+        """
+        newer = func.coalesce(cls.last_message_id, 0) < message.id
+        unread = 'unread_a' if message.receiver_id == min(message.sender_id, message.receiver_id) else 'unread_b'
+        db.session.execute(update(cls).where(cls.id == message.conversation_id).values({
+            cls.last_message_id: case((newer, message.id), else_=cls.last_message_id),
+            cls.last_snippet: case((newer, message.body[:SNIPPET_LENGTH]), else_=cls.last_snippet),
+            cls.last_timestamp: case((newer, message.timestamp), else_=cls.last_timestamp),
+            getattr(cls, unread): getattr(cls, unread) + 1,
+        }).execution_options(synchronize_session=False))
+
+    def unread_for(self, user_id):
+        """
+        @param user_id: Integer, one of the participants
+        @return: Integer
+        """
+        return self.unread_a if user_id == self.user_a_id else self.unread_b
+
+    def mark_read(self, user_id):
+        """
+        Clears the unread count of one side.
+        @param user_id: Integer, one of the participants
+        @return: None
+        """
+        if user_id == self.user_a_id:
+            self.unread_a = 0
+        if user_id == self.user_b_id:
+            self.unread_b = 0
+
+    @classmethod
+    def rebuild(cls, connection):
+        """
+        Rebuilds every conversation summary from the message table, for messages written without User.send_message
+        such as seeded ones. Messages received after the receiver last opened the inbox count as unread.
+        @param connection: Sqlalchemy connection
+        @return: Integer, the number of conversations
+        """
+        user_a_id = case((Message.sender_id < Message.receiver_id, Message.sender_id), else_=Message.receiver_id)
+        user_b_id = case((Message.sender_id < Message.receiver_id, Message.receiver_id), else_=Message.sender_id)
+        connection.execute(update(Message).values(conversation_id=None))
+        connection.execute(db.delete(cls))
+        connection.execute(db.insert(cls).from_select(
+            ['user_a_id', 'user_b_id', 'last_message_id'],
+            select(user_a_id, user_b_id, func.max(Message.id)).group_by(user_a_id, user_b_id)))
+        last_message = Message.id == cls.last_message_id
+
+        def unread(receiver_id, sender_id):
+            return select(func.count(Message.id)).join(User, User.id == Message.receiver_id).where(
+                Message.receiver_id == receiver_id, Message.sender_id == sender_id,
+                Message.timestamp > func.coalesce(User.last_message_read_time, datetime(1900, 1, 1))).scalar_subquery()
+
+        connection.execute(update(cls).values(
+            last_snippet=select(func.substr(Message.body, 1, SNIPPET_LENGTH)).where(last_message).scalar_subquery(),
+            last_timestamp=select(Message.timestamp).where(last_message).scalar_subquery(),
+            unread_a=unread(cls.user_a_id, cls.user_b_id),
+            unread_b=case((cls.user_a_id == cls.user_b_id, 0), else_=unread(cls.user_b_id, cls.user_a_id))))
+        connection.execute(update(Message).values(conversation_id=select(cls.id).where(
+            cls.user_a_id == user_a_id, cls.user_b_id == user_b_id).scalar_subquery()))
+        return connection.execute(select(func.count(cls.id))).scalar()
+
+
+class Suggestion(db.Model):
+    """ Model class for representing the suggestion table, the precomputed top who-to-follow picks of each user. """
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    suggested_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    score = db.Column(db.Float)
+
+
 class Notification(db.Model):
     """ Model class for representing the notification table. """
     id = db.Column(db.Integer, primary_key=True)
@@ -403,7 +734,14 @@ class Notification(db.Model):
         Deserializes the payload_json to python object.
         @return: Python object
         """
-        return json.loads(str(self.payload_json))
+        return json.loads(self.payload_json)
+
+    def raw_data(self):
+        """
+        Returns the payload_json for embedding in a JSON response without decoding it.
+        @return: RawJSON
+        """
+        return RawJSON(self.payload_json)
 
     def __repr__(self):
         """
@@ -420,12 +758,47 @@ class Task(db.Model):
     description = db.Column(db.String(128))
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     complete = db.Column(db.Boolean, default=False)
+    queued = db.Column(db.Boolean, nullable=False, default=True, server_default=db.true())
+    arguments_json = db.Column(db.Text)
+
+    def enqueue(self):
+        """
+        Enqueues the task's job under the task id, leaving the task pending when Redis is unavailable. The job's meta
+        carries the trace context, so the job continues the trace of the request enqueueing it.
+        @return: Boolean, whether the job was enqueued
+        """
+        arguments = json.loads(self.arguments_json or '{}')
+        try:
+            with span(f'rq enqueue {self.name}', PRODUCER):
+                current_app.task_queue.enqueue(
+                    'app.tasks.' + self.name, self.user_id, *arguments.get('args', ()), job_id=self.id,
+                    meta={'traceparent': traceparent(), 'enqueued_at': time()}, **arguments.get('kwargs', {}))
+        except RedisError:
+            metrics.inc('task_enqueue_failures_total', task=self.name)
+            return False
+        self.queued = True
+        return True
+
+    @classmethod
+    def requeue_pending(cls):
+        """
+        Enqueues the pending tasks, stopping at the first failure.
+        @return: Integer, the number of tasks enqueued
+        """
+        count = 0
+        for task in cls.query.filter_by(queued=False, complete=False):
+            if not task.enqueue():
+                break
+            count += 1
+        return count
 
     def get_rq_job(self):
         """
         Fetches rq job instance according to the task id.
         @return: Job instance or None
         """
+        from rq.exceptions import NoSuchJobError
+        from rq.job import Job
         try:
             rq_job = Job.fetch(self.id, connection=current_app.redis)
         except (RedisError, NoSuchJobError):
@@ -437,9 +810,93 @@ class Task(db.Model):
         Returns the job progress percentage.
         @return: Integer
         """
+        if not self.queued:
+            return 0
         job = self.get_rq_job()
         return job.meta.get('progress', 0) if job is not None else 100
 
 
+PROFILE_FIELDS = ('username', 'email', 'about_me')
+
+
+def bump_versions(session, flush_context, instances):
+    """
+    Bumps the version of users whose profile changed and of authors gaining or losing a post. The profile version,
+    keying the author's post cards, only moves on with the profile.
+    @param session: Sqlalchemy session object
+    @return: None
+    """
+    for obj in list(session.new) + list(session.deleted):
+        if isinstance(obj, Post) and obj.author is not None:
+            obj.author.touch()
+    for obj in session.dirty:
+        if not isinstance(obj, User) or not any(
+                db.inspect(obj).attrs[field].history.has_changes() for field in PROFILE_FIELDS):
+            continue
+        if not db.inspect(obj).attrs.version.history.has_changes():
+            obj.touch()
+        if not db.inspect(obj).attrs.profile_version.history.has_changes():
+            obj.profile_version = (obj.profile_version or 1) + 1
+
+
+def collect_stale_fragments(session, flush_context):
+    """
+    Remembers the cached fragments of flushed users whose version moved on, the post cards of users whose profile
+    changed and the cards of deleted posts, so they can be dropped once the transaction commits.
+    @param session: Sqlalchemy session object
+    @return: None
+    """
+    stale = session.info.setdefault('stale_fragments', set())
+    locales = current_app.config['LANGUAGES']
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            for version in db.inspect(obj).attrs.version.history.deleted:
+                stale.update(fragment_key('popup', obj.id, version, locale) for locale in locales)
+            profile_versions = db.inspect(obj).attrs.profile_version.history.deleted
+            if profile_versions:
+                post_ids = [post_id for post_id, in obj.posts.with_entities(Post.id)]
+                stale.update(fragment_key('post', post_id, version, locale)
+                             for post_id in post_ids for version in profile_versions for locale in locales)
+    for obj in session.deleted:
+        if isinstance(obj, Post) and obj.author is not None:
+            versions = db.inspect(obj.author).attrs.profile_version.history.deleted or [obj.author.profile_version]
+            stale.update(fragment_key('post', obj.id, version, locale) for version in versions for locale in locales)
+
+
+def drop_stale_fragments(session):
+    """
+    Drops the fragments collected by collect_stale_fragments after a commit.
+    @param session: Sqlalchemy session object
+    @return: None
+    """
+    fragment_cache.invalidate(sorted(session.info.pop('stale_fragments', ())))
+
+
+def forget_stale_fragments(session):
+    session.info.pop('stale_fragments', None)
+
+
+def apply_follow_changes(session):
+    """
+    Mirrors the committed follows and unfollows into the Redis follow graph.
+    @param session: Sqlalchemy session object
+    @return: None
+    """
+    changes = session.info.pop('follow_changes', None)
+    if changes:
+        follow_graph.apply([(added, db.inspect(follower).identity[0], db.inspect(followed).identity[0])
+                            for added, follower, followed in changes])
+
+
+def forget_follow_changes(session):
+    session.info.pop('follow_changes', None)
+
+
+db.event.listen(db.session, 'before_flush', bump_versions)
+db.event.listen(db.session, 'after_flush', collect_stale_fragments)
+db.event.listen(db.session, 'after_commit', drop_stale_fragments)
+db.event.listen(db.session, 'after_rollback', forget_stale_fragments)
+db.event.listen(db.session, 'after_commit', apply_follow_changes)
+db.event.listen(db.session, 'after_rollback', forget_follow_changes)
 db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
@@ -0,0 +1,5 @@
+from flask import Blueprint
+
+bp = Blueprint('monitoring', __name__)
+
+from app.monitoring import routes
@@ -0,0 +1,44 @@
+import hmac
+from ipaddress import ip_address, ip_network
+
+from flask import Response, abort, current_app, request
+from redis.exceptions import RedisError
+
+from app import metrics
+from app.monitoring import bp
+
+
+@bp.before_request
+def restrict_access():
+    """
+    Lets through scrapers sending METRICS_TOKEN as a bearer token or calling from METRICS_ALLOWED_NETWORKS, loopback
+    by default. Requests relayed by a proxy, carrying X-Forwarded-For, need the token, since the address seen is the
+    proxy's. Anyone else gets a 403.
+    @return: None
+    """
+    token = current_app.config['METRICS_TOKEN']
+    header = request.headers.get('Authorization', '')
+    if token and header.startswith('Bearer ') and hmac.compare_digest(header[7:].encode(), token.encode()):
+        return
+    if 'X-Forwarded-For' in request.headers:
+        abort(403)
+    try:
+        address = ip_address(request.remote_addr or '')
+    except ValueError:
+        abort(403)
+    if not any(address in ip_network(network, strict=False)
+               for network in current_app.config['METRICS_ALLOWED_NETWORKS']):
+        abort(403)
+
+
+@bp.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(extra_gauges=_queue_gauges()), mimetype='text/plain; version=0.0.4')
+
+
+def _queue_gauges():
+    try:
+        depth = len(current_app.task_queue)
+    except RedisError:
+        return []
+    return [('rq_queue_depth', {'queue': current_app.task_queue.name}, depth)]
@@ -0,0 +1,134 @@
+""" Password hashing with configurable parameters, run in a bounded pool within each process. """
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from flask import current_app, has_app_context
+from werkzeug.exceptions import TooManyRequests
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+DEFAULT_METHOD = f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}'
+DEFAULT_SALT_LENGTH = 16
+
+
+def normalize_method(method):
+    """
+    Spells out the iterations werkzeug uses when a pbkdf2 method leaves them out, so methods compare equal to the
+    prefix of the hashes they generate.
+    @param method: String, like 'pbkdf2:sha256' or 'pbkdf2:sha512:600000'
+    @return: String
+    """
+    parts = method.split(':')
+    if parts[0] == 'pbkdf2':
+        if len(parts) == 1:
+            parts.append('sha256')
+        if len(parts) == 2:
+            parts.append(str(DEFAULT_PBKDF2_ITERATIONS))
+    return ':'.join(parts)
+
+
+def needs_rehash(password_hash, method=DEFAULT_METHOD, salt_length=DEFAULT_SALT_LENGTH):
+    """
+    Tells whether a stored hash was generated with other parameters than the given ones.
+    @param password_hash: String
+    @param method: String
+    @param salt_length: Integer
+    @return: Boolean
+    """
+    if password_hash.count('$') < 2:
+        return True
+    stored_method, salt, _ = password_hash.split('$', 2)
+    return stored_method != normalize_method(method) or len(salt) != salt_length
+
+
+class PasswordHasher:
+    """
+    Hashes with PASSWORD_HASH_METHOD and PASSWORD_HASH_SALT_LENGTH and verifies on a pool of PASSWORD_HASH_WORKERS
+    threads, hashlib releasing the GIL while it derives keys. At most PASSWORD_HASH_QUEUE more calls wait for the
+    pool; beyond that a call fails at once with a 429. Durations are observed in password_hash_seconds per operation.
+
+    The pool and its slots are per process, so they only bound concurrent hashing under threaded workers. Sync
+    workers serve one request at a time and block on the result like on an inline hash. Nothing caps hashing for the
+    whole deployment: the RATE_LIMITS and RATE_LIMITS_PER_ADDRESS buckets of auth.login, auth.register and
+    api.get_token only hold back how often each address can make the app hash.
+    """
+
+    def __init__(self, registry=None, app=None):
+        self._registry = registry
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        workers = app.config['PASSWORD_HASH_WORKERS'] or os.cpu_count()
+        app.extensions['password_hasher'] = {
+            'executor': ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash'),
+            'slots': threading.BoundedSemaphore(workers + app.config['PASSWORD_HASH_QUEUE']),
+        }
+
+    def _run(self, operation, func, *args):
+        if not has_app_context() or 'password_hasher' not in current_app.extensions:
+            return func(*args)
+        pool = current_app.extensions['password_hasher']
+        if not pool['slots'].acquire(blocking=False):
+            if self._registry is not None:
+                self._registry.inc('password_hash_rejections_total', operation=operation)
+            raise TooManyRequests(retry_after=1)
+        try:
+            if self._registry is None:
+                return pool['executor'].submit(func, *args).result()
+            with self._registry.timed('password_hash_seconds', operation=operation):
+                return pool['executor'].submit(func, *args).result()
+        finally:
+            pool['slots'].release()
+
+    @contextmanager
+    def hold_slots(self):
+        """
+        Takes every free slot of the current app's pool until the block exits, as a burst of concurrent calls would.
+        @return: Context manager yielding the number of slots taken
+        """
+        slots = current_app.extensions['password_hasher']['slots']
+        taken = 0
+        while slots.acquire(blocking=False):
+            taken += 1
+        try:
+            yield taken
+        finally:
+            for _ in range(taken):
+                slots.release()
+
+    @staticmethod
+    def _parameters():
+        if not has_app_context():
+            return DEFAULT_METHOD, DEFAULT_SALT_LENGTH
+        return current_app.config['PASSWORD_HASH_METHOD'], current_app.config['PASSWORD_HASH_SALT_LENGTH']
+
+    def hash(self, password):
+        """
+        @param password: String
+        @return: String, the hash with the current parameters
+        """
+        method, salt_length = self._parameters()
+        return self._run('hash', generate_password_hash, password, method, salt_length)
+
+    def verify(self, password_hash, password):
+        """
+        Checks a password and, when it matches a hash generated with old parameters, hashes it again with the
+        current ones.
+        @param password_hash: String
+        @param password: String
+        @return: Tuple of whether the password matches and the new hash, None when the stored one is current
+        """
+        if not password_hash:
+            return False, None
+        method, salt_length = self._parameters()
+        return self._run('verify', self._verify, password_hash, password, method, salt_length)
+
+    @staticmethod
+    def _verify(password_hash, password, method, salt_length):
+        if not check_password_hash(password_hash, password):
+            return False, None
+        if needs_rehash(password_hash, method, salt_length):
+            return True, generate_password_hash(password, method, salt_length)
+        return True, None
@@ -0,0 +1,418 @@
+""" Per-request SQL profiling and the slow-query log, built on SQLAlchemy engine events. """
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from time import perf_counter, time
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import StaticPool
+
+_local = threading.local()
+# Seconds a captured plan is reused for before the statement is explained again.
+EXPLAIN_INTERVAL = 3600
+PARAMETER_LENGTH = 100
+PLAN_CACHE_SIZE = 1000
+_FINGERPRINT_RULES = (
+    (re.compile(r'--[^\n]*|/\*.*?\*/', re.S), ' '),
+    (re.compile(r"'(?:[^']|'')*'"), '?'),
+    (re.compile(r'%\(\w+\)s|%s|:\w+|\$\d+|\b\d+(?:\.\d+)?\b'), '?'),
+    (re.compile(r'\s+'), ' '),
+    (re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)'), '(...)'),
+    (re.compile(r'(\(\.\.\.\))(?:\s*,\s*\(\.\.\.\))+'), r'\1'),
+)
+# The numbering SQLAlchemy appends to the names of bound parameters, as in token_1 or id_1_2.
+_BIND_SUFFIX = re.compile(r'(?:_\d+)+$')
+_READ = re.compile(r'\s*(?:SELECT|WITH)\b', re.I)
+# Plan lines reading a whole table, the usual sign of a missing index.
+_FULL_SCAN = re.compile(r'^\s*(?:SCAN (?:TABLE )?\w+(?!.*USING (?:COVERING )?INDEX)|.*Seq Scan on)', re.M)
+
+
+class QueryProfile:
+    """ Collects the statements executed while the profile is active. """
+
+    def __init__(self, label=None):
+        self.label = label
+        self.statements = []
+
+    def record(self, statement, duration):
+        """
+        Records an executed statement with its duration in seconds.
+        @param statement: String
+        @param duration: Float
+        @return: None
+        """
+        self.statements.append((statement, duration))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def total_time(self):
+        return sum(duration for _, duration in self.statements)
+
+    def slowest(self, limit=5):
+        """
+        Returns the slowest statements, slowest first.
+        @param limit: Integer
+        @return: List of (statement, duration) tuples
+        """
+        return sorted(self.statements, key=lambda item: item[1], reverse=True)[:limit]
+
+    def repeated(self, threshold=3):
+        """
+        Returns statements executed at least threshold times, the usual sign of an N+1 query pattern.
+        @param threshold: Integer
+        @return: Dictionary of statement to count
+        """
+        counts = Counter(statement for statement, _ in self.statements)
+        return {statement: count for statement, count in counts.items() if count >= threshold}
+
+    def server_timing(self):
+        """
+        Returns the profile formatted as a Server-Timing header value.
+        @return: String
+        """
+        return f'db;desc="{self.count} queries";dur={self.total_time * 1000:.2f}'
+
+    def __repr__(self):
+        return f'<QueryProfile {self.label} {self.count} queries {self.total_time * 1000:.2f}ms>'
+
+
+def _active_profiles():
+    if not hasattr(_local, 'profiles'):
+        _local.profiles = []
+    return _local.profiles
+
+
+def start_profile(label=None):
+    """
+    Starts recording the statements executed in the current thread.
+    @param label: String
+    @return: QueryProfile
+    """
+    profile = QueryProfile(label)
+    _active_profiles().append(profile)
+    return profile
+
+
+def stop_profile(profile):
+    """
+    Stops recording into the given profile.
+    @param profile: QueryProfile
+    @return: None
+    """
+    if profile in _active_profiles():
+        _active_profiles().remove(profile)
+
+
+@contextmanager
+def profile_queries(label=None):
+    """
+    Records every statement executed in the current thread inside the with block.
+    @param label: String
+    @return: QueryProfile
+    """
+    profile = start_profile(label)
+    try:
+        yield profile
+    finally:
+        stop_profile(profile)
+
+
+def _slow_query_log():
+    if not has_app_context():
+        return None
+    return current_app.extensions.get('slow_query_log')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active_profiles() or _slow_query_log() is not None:
+        conn.info.setdefault('query_start_time', []).append(perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_times = conn.info.get('query_start_time')
+    if not start_times:
+        return
+    duration = perf_counter() - start_times.pop()
+    for profile in _active_profiles():
+        profile.record(statement, duration)
+    slow_query_log = _slow_query_log()
+    if slow_query_log is not None and duration * 1000 >= current_app.config['SLOW_QUERY_THRESHOLD_MS']:
+        slow_query_log.record(conn, statement, parameters[0] if executemany else parameters, duration, context)
+
+
+def fingerprint(statement):
+    """
+    Normalizes a statement so that executions differing only in literals, bound parameters, the length of IN lists
+    or the number of VALUES rows share one text.
+    @param statement: String
+    @return: String
+    """
+    for pattern, replacement in _FINGERPRINT_RULES:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+def fingerprint_id(normalized):
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:12]
+
+
+def _loggable(value):
+    if isinstance(value, (list, tuple)):
+        return [_loggable(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    text = str(value)
+    return text if len(text) <= PARAMETER_LENGTH else text[:PARAMETER_LENGTH] + '...'
+
+
+def _redacted(value):
+    if value is None:
+        return None
+    if isinstance(value, (str, bytes)):
+        return f'<redacted {type(value).__name__} of length {len(value)}>'
+    return f'<redacted {type(value).__name__}>'
+
+
+def _parameter_names(context, parameters):
+    """
+    Names the bound parameters after the columns they were bound for, like token_1 for `User.token == value`.
+    @param context: Sqlalchemy execution context
+    @param parameters: Tuple or dictionary, as passed to the driver
+    @return: List of names in the order of positional parameters, None when they cannot be told
+    """
+    if isinstance(parameters, dict):
+        return list(parameters)
+    compiled = getattr(context, 'compiled', None)
+    if compiled is None or not getattr(compiled, 'positiontup', None):
+        return None if parameters else []
+    expanded = getattr(context, '_expanded_parameters', None) or {}
+    names = [name for key in compiled.positiontup for name in expanded.get(key, [key])]
+    return names if len(names) == len(parameters) else None
+
+
+def loggable_parameters(parameters, context=None, redacted_columns=()):
+    """
+    Makes bound parameters fit for a log: long values are truncated and values bound for redacted_columns are
+    replaced by their type and length. Parameters whose names cannot be told are all redacted.
+    @param parameters: Tuple or dictionary, as passed to the driver
+    @param context: Sqlalchemy execution context
+    @param redacted_columns: Collection of column names
+    @return: Tuple of the loggable parameters, a list or dictionary, and the list of redacted strings
+    """
+    names = _parameter_names(context, parameters)
+    values = list(parameters.values() if isinstance(parameters, dict) else parameters)
+    redacted = [names is None or _BIND_SUFFIX.sub('', name) in redacted_columns for name in names or values]
+    loggable = [_redacted(value) if secret else _loggable(value) for value, secret in zip(values, redacted)]
+    secrets = [str(value) for value, secret in zip(values, redacted) if secret and value not in (None, '')]
+    return (dict(zip(names, loggable)) if isinstance(parameters, dict) else loggable), secrets
+
+
+def query_origin():
+    """
+    Names what issued the current statement: the RQ job, the view of the request or, failing both, the command.
+    @return: String
+    """
+    if has_app_context() and g.get('job_name'):
+        return f'job:{g.job_name}'
+    if has_request_context():
+        return f'view:{request.endpoint}'
+    return 'command'
+
+
+class SlowQueryLog:
+    """
+    Logs every statement slower than SLOW_QUERY_THRESHOLD_MS with its bound parameters, the view or job that issued
+    it and, for reads, the plan the database chooses for it. Parameters are truncated to PARAMETER_LENGTH characters,
+    and those bound for SLOW_QUERY_REDACTED_COLUMNS are reduced to their type and length. Plans are captured with
+    EXPLAIN, or EXPLAIN QUERY PLAN on SQLite, on a separate connection, and reused per statement fingerprint for
+    EXPLAIN_INTERVAL seconds. Events also go to slow-queries-<pid>.jsonl in SLOW_QUERY_DIR when it is set, where
+    `flask queries slowest` aggregates them by fingerprint across processes.
+    """
+
+    def __init__(self, registry=None, app=None):
+        self._registry = registry
+        self._plans = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.config['SLOW_QUERY_THRESHOLD_MS'] is None:
+            return
+        if app.config['SLOW_QUERY_DIR']:
+            os.makedirs(app.config['SLOW_QUERY_DIR'], exist_ok=True)
+        app.extensions['slow_query_log'] = self
+
+    def record(self, connection, statement, parameters, duration, context=None):
+        """
+        @param connection: Sqlalchemy connection the statement ran on
+        @param statement: String
+        @param parameters: Tuple or dictionary
+        @param duration: Float, seconds
+        @param context: Sqlalchemy execution context, naming the parameters
+        @return: Dictionary, the logged event
+        """
+        normalized = fingerprint(statement)
+        parameters_logged, secrets = loggable_parameters(parameters, context,
+                                                         current_app.config['SLOW_QUERY_REDACTED_COLUMNS'])
+        entry = {
+            'time': time(),
+            'fingerprint': fingerprint_id(normalized),
+            'statement': normalized,
+            'duration_ms': round(duration * 1000, 3),
+            'parameters': parameters_logged,
+            'origin': query_origin(),
+            'plan': self.plan(connection.engine, statement, parameters, connection, normalized, secrets)
+            if current_app.config['SLOW_QUERY_EXPLAIN'] else None,
+        }
+        current_app.logger.warning('Slow query %s, %.1fms in %s: %s parameters=%s plan=%s', entry['fingerprint'],
+                                   entry['duration_ms'], entry['origin'], normalized,
+                                   entry['parameters'], entry['plan'])
+        if self._registry is not None:
+            self._registry.inc('sql_slow_queries_total', fingerprint=entry['fingerprint'])
+        directory = current_app.config['SLOW_QUERY_DIR']
+        if directory:
+            with self._lock, open(os.path.join(directory, f'slow-queries-{os.getpid()}.jsonl'), 'a') as f:
+                f.write(json.dumps(entry) + '\n')
+        return entry
+
+    def plan(self, engine, statement, parameters, connection=None, key=None, secrets=()):
+        """
+        Explains a read on a DBAPI connection of its own, so the statement's transaction is left alone and the
+        EXPLAIN is not itself profiled. Engines with a single shared connection, like in-memory SQLite, explain on
+        the given connection instead.
+        @param engine: Sqlalchemy engine
+        @param statement: String
+        @param parameters: Tuple or dictionary, as passed to the driver
+        @param connection: Sqlalchemy connection the statement ran on
+        @param key: String, the statement's fingerprint
+        @param secrets: List of strings, redacted parameters replaced by ? where the plan shows them
+        @return: List of plan lines, None for statements that are not reads
+        """
+        if not _READ.match(statement):
+            return None
+        key = key or fingerprint(statement)
+        with self._lock:
+            cached = self._plans.get(key)
+        if cached is not None and time() - cached[0] < EXPLAIN_INTERVAL:
+            return cached[1]
+        prefix = 'EXPLAIN QUERY PLAN ' if engine.dialect.name == 'sqlite' else 'EXPLAIN '
+        shared = connection is not None and isinstance(engine.pool, StaticPool)
+        dbapi_connection = connection.connection if shared else engine.raw_connection()
+        try:
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute(prefix + statement, parameters)
+                plan = [str(row[-1]) for row in cursor.fetchall()]
+                for secret in secrets:
+                    plan = [line.replace(secret, '?') for line in plan]
+            finally:
+                cursor.close()
+        except engine.dialect.dbapi.Error as error:
+            return [f'EXPLAIN failed: {error}']
+        finally:
+            if not shared:
+                dbapi_connection.close()
+        with self._lock:
+            self._plans[key] = (time(), plan)
+            while len(self._plans) > PLAN_CACHE_SIZE:
+                self._plans.popitem(last=False)
+        return plan
+
+
+def read_slow_queries(directory):
+    """
+    @param directory: String, SLOW_QUERY_DIR
+    @return: List of the logged events of every process
+    """
+    entries = []
+    for path in sorted(glob.glob(os.path.join(directory, 'slow-queries-*.jsonl'))):
+        with open(path) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    return entries
+
+
+def summarize_slow_queries(entries, limit=10):
+    """
+    Aggregates slow query events by fingerprint, the statements costing the most time in total first.
+    @param entries: List of events from read_slow_queries
+    @param limit: Integer
+    @return: List of dictionaries
+    """
+    groups = {}
+    for entry in entries:
+        group = groups.setdefault(entry['fingerprint'], {
+            'fingerprint': entry['fingerprint'], 'statement': entry['statement'], 'count': 0, 'total_ms': 0.0,
+            'max_ms': 0.0, 'origins': Counter(), 'slowest_parameters': None, 'plan': None, 'plan_time': 0})
+        group['count'] += 1
+        group['total_ms'] += entry['duration_ms']
+        group['origins'][entry['origin']] += 1
+        if entry['duration_ms'] >= group['max_ms']:
+            group['max_ms'] = entry['duration_ms']
+            group['slowest_parameters'] = entry['parameters']
+        if entry['plan'] and entry['time'] >= group['plan_time']:
+            group['plan'], group['plan_time'] = entry['plan'], entry['time']
+    summaries = sorted(groups.values(), key=lambda group: group['total_ms'], reverse=True)[:limit]
+    for group in summaries:
+        del group['plan_time']
+        group['mean_ms'] = group['total_ms'] / group['count']
+        group['full_scan'] = bool(group['plan'] and _FULL_SCAN.search('\n'.join(group['plan'])))
+    return summaries
+
+
+class SQLProfiler:
+    """ Opt-in request instrumentation logging query counts, DB time and N+1 suspects. """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config.get('SQL_PROFILING'):
+            return
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    @staticmethod
+    def _start():
+        g.sql_profile = start_profile(request.endpoint)
+
+    @staticmethod
+    def _finish(response):
+        profile = g.pop('sql_profile', None)
+        if profile is None:
+            return response
+        stop_profile(profile)
+        config = current_app.config
+        response.headers.add('Server-Timing', profile.server_timing())
+        current_app.logger.info('%s %s: %d queries in %.2fms', request.method, request.path, profile.count,
+                                profile.total_time * 1000)
+        for statement, duration in profile.slowest(config['SQL_PROFILING_SLOWEST']):
+            current_app.logger.info('  %.2fms %s', duration * 1000, ' '.join(statement.split()))
+        for statement, count in profile.repeated(config['SQL_PROFILING_REPEAT_THRESHOLD']).items():
+            current_app.logger.warning('Possible N+1 query in %s, executed %d times: %s', request.endpoint, count,
+                                       ' '.join(statement.split()))
+        return response
+
+    @staticmethod
+    def _teardown(exception=None):
+        profile = g.pop('sql_profile', None)
+        if profile is not None:
+            stop_profile(profile)
@@ -0,0 +1,161 @@
+""" Token bucket rate limits per endpoint and client, kept in Redis with an in-process fallback. """
+import threading
+from collections import OrderedDict
+from math import ceil
+from time import time
+
+from flask import current_app, request
+from flask_login import current_user
+from redis.exceptions import RedisError
+from werkzeug.exceptions import TooManyRequests
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+# Endpoints checking a password, limited per address and claimed user name.
+CREDENTIAL_ENDPOINTS = frozenset(('api.get_token', 'auth.login'))
+
+# Refills the bucket for the time passed since the last call and takes a token when there is one. Returns whether
+# the call is allowed and, as a string since Lua numbers come back truncated to integers, the seconds until a token.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(wait)}
+"""
+
+
+def parse_limit(limit):
+    """
+    Parses a limit like '10/minute' into the bucket capacity and its refill rate.
+    @param limit: String
+    @return: Tuple of (capacity, tokens per second)
+    """
+    try:
+        count, period = limit.split('/')
+        capacity = int(count)
+        return capacity, capacity / PERIODS[period.strip()]
+    except (KeyError, ValueError):
+        raise ValueError(f'Rate limit {limit!r} is not of the form <count>/<{"|".join(PERIODS)}>') from None
+
+
+def take_token(tokens, updated, now, capacity, rate):
+    """
+    The in-process twin of TOKEN_BUCKET_SCRIPT.
+    @param tokens: Float, tokens left after the last call or None for a new bucket
+    @param updated: Float, time of the last call
+    @param now: Float
+    @param capacity: Integer
+    @param rate: Float, tokens per second
+    @return: Tuple of (allowed, seconds until a token, tokens left)
+    """
+    tokens = capacity if tokens is None else min(capacity, tokens + max(0.0, now - updated) * rate)
+    if tokens >= 1:
+        return True, 0.0, tokens - 1
+    return False, (1 - tokens) / rate, tokens
+
+
+def client_identity():
+    """
+    Identifies the caller by verified identity only: the logged in user, the owner of a valid API token or, failing
+    both, the address. Endpoints checking credentials are keyed on the address and the claimed user name together, so
+    nobody can use up the bucket of another user. Trying other user names gets fresh buckets here, which the address
+    buckets of RATE_LIMITS_PER_ADDRESS hold back.
+    @return: String
+    """
+    address = f'ip:{request.remote_addr}'
+    if request.endpoint in CREDENTIAL_ENDPOINTS:
+        auth = request.authorization
+        username = auth.username if auth is not None and auth.type == 'basic' else request.form.get('username')
+        return f'{address}:user:{username}' if username else address
+    if current_user.is_authenticated:
+        return f'user:{current_user.id}'
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer ') and header[7:]:
+        from app.models import User
+
+        user = User.check_token(header[7:])
+        if user is not None:
+            return f'user:{user.id}'
+    return address
+
+
+class RateLimiter:
+    """
+    Enforces RATE_LIMITS, a mapping of endpoint to limit, before the view runs, so a rejected call never reaches a
+    password check or a query. Every endpoint and client pair gets a token bucket holding up to the limit's count
+    and refilled evenly over its period, so bursts are allowed up to the count and sustained traffic is held to the
+    rate. Endpoints in RATE_LIMITS_PER_ADDRESS are also charged to a bucket of the address alone, and a call is
+    rejected when either bucket is empty. Buckets live in Redis and are updated by one Lua script call, atomic across
+    all workers. While Redis is unavailable each process enforces the limits on its own buckets.
+    """
+
+    def __init__(self, app=None):
+        self._script = None
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if not app.config['RATE_LIMIT_ENABLED']:
+            return
+        app.extensions['rate_limits'] = {
+            endpoint: parse_limit(limit) for endpoint, limit in app.config['RATE_LIMITS'].items()}
+        app.extensions['rate_limits_per_address'] = {
+            endpoint: parse_limit(limit) for endpoint, limit in app.config['RATE_LIMITS_PER_ADDRESS'].items()}
+        app.before_request(self._check)
+
+    def _check(self):
+        buckets = []
+        limit = current_app.extensions['rate_limits'].get(request.endpoint)
+        if limit is not None:
+            buckets.append((f'ratelimit:{request.endpoint}:{client_identity()}', limit))
+        limit = current_app.extensions['rate_limits_per_address'].get(request.endpoint)
+        if limit is not None:
+            buckets.append((f'ratelimit:{request.endpoint}:address:{request.remote_addr}', limit))
+        waits = [wait for allowed, wait in (self.hit(key, *limit) for key, limit in buckets) if not allowed]
+        if waits:
+            raise TooManyRequests(retry_after=max(1, ceil(max(waits))))
+
+    def hit(self, key, capacity, rate, now=None):
+        """
+        Takes a token from the bucket.
+        @param key: String
+        @param capacity: Integer
+        @param rate: Float, tokens per second
+        @param now: Float
+        @return: Tuple of (allowed, seconds until the next token)
+        """
+        now = time() if now is None else now
+        try:
+            # Kept with app.redis itself, as the script's registered_client is the client behind the LazyClient.
+            redis = current_app.redis
+            cached = self._script
+            if cached is None or cached[0] is not redis:
+                cached = self._script = (redis, redis.register_script(TOKEN_BUCKET_SCRIPT))
+            allowed, wait = cached[1](keys=[key], args=[capacity, rate, now])
+            return bool(allowed), float(wait)
+        except RedisError:
+            return self._local_hit(key, capacity, rate, now)
+
+    def _local_hit(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, updated = self._local.pop(key, (None, now))
+            allowed, wait, tokens = take_token(tokens, updated, now, capacity, rate)
+            self._local[key] = (tokens, now)
+            while len(self._local) > current_app.config['RATE_LIMIT_LOCAL_BUCKETS']:
+                self._local.popitem(last=False)
+        return allowed, wait
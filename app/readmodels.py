@@ -0,0 +1,261 @@
+""" Read models for list pages, Core selects returning slotted rows with only the columns templates and to_dict use. """
+from flask_sqlalchemy import Pagination
+from sqlalchemy import func, or_, select, union_all
+
+from app import db
+from app.models import Conversation, Message, Post, User, email_digest, followers, gravatar, user_resource
+
+
+class AuthorRow:
+    """ Author of a listed post or message, duck typed as a User for _post.html. """
+    __slots__ = ('id', 'username', 'profile_version', 'digest')
+
+    def __init__(self, id, username, profile_version, digest):
+        self.id = id
+        self.username = username
+        self.profile_version = profile_version
+        self.digest = digest
+
+    def avatar(self, size):
+        return gravatar(self.digest, size)
+
+
+class PostRow:
+    """ Listed post, duck typed as a Post for _post.html. """
+    __tablename__ = Post.__tablename__
+    __slots__ = ('id', 'body', 'timestamp', 'language', 'user_id', 'author')
+
+    def __init__(self, id, body, timestamp, language, user_id, author=None):
+        self.id = id
+        self.body = body
+        self.timestamp = timestamp
+        self.language = language
+        self.user_id = user_id
+        self.author = author
+
+
+class MessageRow:
+    """ Received message, duck typed as a Post for _post.html. """
+    __tablename__ = Message.__tablename__
+    __slots__ = ('id', 'body', 'timestamp', 'sender_id', 'author')
+    language = None
+
+    def __init__(self, id, body, timestamp, sender_id, author):
+        self.id = id
+        self.body = body
+        self.timestamp = timestamp
+        self.sender_id = sender_id
+        self.author = author
+
+
+class ConversationRow:
+    """ Inbox entry, the summary of a conversation seen from one side. """
+    __slots__ = ('id', 'last_message_id', 'last_snippet', 'last_timestamp', 'unread', 'other_id', 'other')
+
+    def __init__(self, id, last_message_id, last_snippet, last_timestamp, unread, other_id, other):
+        self.id = id
+        self.last_message_id = last_message_id
+        self.last_snippet = last_snippet
+        self.last_timestamp = last_timestamp
+        self.unread = unread
+        self.other_id = other_id
+        self.other = other
+
+
+class UserRow:
+    """ User with its counts, serialized by to_dict exactly like User.to_dict. """
+    __slots__ = ('id', 'username', 'last_seen', 'about_me', 'post_count', 'follower_count', 'followed_count', 'digest')
+
+    def __init__(self, id, username, last_seen, about_me, post_count, follower_count, followed_count, digest):
+        self.id = id
+        self.username = username
+        self.last_seen = last_seen
+        self.about_me = about_me
+        self.post_count = post_count
+        self.follower_count = follower_count
+        self.followed_count = followed_count
+        self.digest = digest
+
+    def avatar(self, size):
+        return gravatar(self.digest, size)
+
+    def to_dict(self):
+        return user_resource(self, self.post_count, self.follower_count, self.followed_count)
+
+
+def _with_authors(statement, make_row):
+    """
+    Runs a select whose last three columns are the author's username, profile version and email, sharing one
+    AuthorRow between the rows of the same author.
+    @param statement: Select
+    @param make_row: Function taking the leading columns and the AuthorRow
+    @return: List
+    """
+    authors = {}
+    rows = []
+    for *columns, user_id, username, profile_version, email in db.session.execute(statement):
+        author = authors.get(user_id)
+        if author is None:
+            author = authors[user_id] = AuthorRow(user_id, username, profile_version, email_digest(email))
+        rows.append(make_row(*columns, user_id, author))
+    return rows
+
+
+def _paginate(statement, page, per_page, load):
+    """
+    Pages a select like Query.paginate does, counting the rows only when the first page is full.
+    @param statement: Select, ordered
+    @param page: Integer
+    @param per_page: Integer
+    @param load: Function running a select
+    @return: Pagination
+    """
+    page = max(page, 1)
+    items = load(statement.limit(per_page).offset((page - 1) * per_page))
+    if page == 1 and len(items) < per_page:
+        total = len(items)
+    else:
+        total = db.session.execute(select(func.count()).select_from(statement.order_by(None).subquery())).scalar()
+    return Pagination(None, page, per_page, total, items)
+
+
+def _post_select(*criteria):
+    return select(Post.id, Post.body, Post.timestamp, Post.language, Post.user_id, User.username, User.profile_version,
+                  User.email).join(User, User.id == Post.user_id).where(*criteria)
+
+
+def _posts(statement):
+    return _with_authors(statement, PostRow)
+
+
+def timeline(user_id, page, per_page):
+    """
+    The posts of the users user_id follows and its own, newest first.
+    @param user_id: Integer
+    @param page: Integer
+    @param per_page: Integer
+    @return: Pagination of PostRow
+    """
+    followed = select(followers.c.followed_id).where(followers.c.follower_id == user_id)
+    criteria = or_(Post.user_id.in_(followed), Post.user_id == user_id)
+    return _paginate(_post_select(criteria).order_by(Post.timestamp.desc(), Post.id.desc()), page, per_page, _posts)
+
+
+def user_posts(user_id, page, per_page):
+    """
+    @param user_id: Integer
+    @param page: Integer
+    @param per_page: Integer
+    @return: Pagination of PostRow, newest first
+    """
+    return _paginate(_post_select(Post.user_id == user_id).order_by(Post.timestamp.desc(), Post.id.desc()), page,
+                     per_page, _posts)
+
+
+def latest_posts(limit, offset=0, before=None):
+    """
+    @param limit: Integer
+    @param offset: Integer, ignored when before is given
+    @param before: Integer, only posts with a lower id
+    @return: List of PostRow, highest id first
+    """
+    statement = _post_select().order_by(Post.id.desc()).limit(limit)
+    if before is not None:
+        statement = statement.where(Post.id < before)
+    else:
+        statement = statement.offset(offset)
+    return _posts(statement)
+
+
+def _keyset(statement, key, per_page, before, load):
+    """
+    Loads one page of a select ordered by key descending, starting below the cursor before.
+    @param statement: Select, unordered
+    @param key: Column, unique
+    @param per_page: Integer
+    @param before: Integer or None for the first page
+    @param load: Function running a select
+    @return: Tuple of the items and the cursor of the next page, None on the last page
+    """
+    if before is not None:
+        statement = statement.where(key < before)
+    items = load(statement.order_by(key.desc()).limit(per_page + 1))
+    if len(items) > per_page:
+        return items[:per_page], getattr(items[per_page - 1], key.key)
+    return items, None
+
+
+def conversation_messages(conversation_id, per_page, before=None):
+    """
+    The messages of a conversation, newest first.
+    @param conversation_id: Integer
+    @param per_page: Integer
+    @param before: Integer, message id cursor
+    @return: Tuple of a list of MessageRow and the next cursor
+    """
+    statement = select(Message.id, Message.body, Message.timestamp, Message.sender_id, User.username,
+                       User.profile_version, User.email).join(User, User.id == Message.sender_id).where(
+        Message.conversation_id == conversation_id)
+    return _keyset(statement, Message.id, per_page, before,
+                   lambda statement: _with_authors(statement, MessageRow))
+
+
+def inbox(user_id, per_page, before=None):
+    """
+    The conversations of a user, the one with the newest message first. Each side of the conversation table is read
+    through its own index in a branch of a UNION ALL, so a page costs the same whatever the number of messages.
+    @param user_id: Integer
+    @param per_page: Integer
+    @param before: Integer, last_message_id cursor
+    @return: Tuple of a list of ConversationRow and the next cursor
+    """
+    def side(user_column, other_column, unread_column, *criteria):
+        statement = select(Conversation.id, Conversation.last_message_id, Conversation.last_snippet,
+                           Conversation.last_timestamp, unread_column.label('unread'), User.id.label('other_id'),
+                           User.username, User.profile_version, User.email).join(User, User.id == other_column).where(
+            user_column == user_id, *criteria)
+        if before is not None:
+            statement = statement.where(Conversation.last_message_id < before)
+        return select(statement.order_by(Conversation.last_message_id.desc()).limit(per_page + 1).subquery())
+
+    conversations = union_all(
+        side(Conversation.user_a_id, Conversation.user_b_id, Conversation.unread_a),
+        side(Conversation.user_b_id, Conversation.user_a_id, Conversation.unread_b,
+             Conversation.user_a_id != user_id)).subquery()
+    items = _with_authors(select(conversations).order_by(conversations.c.last_message_id.desc()).limit(per_page + 1),
+                          ConversationRow)
+    if len(items) > per_page:
+        return items[:per_page], items[per_page - 1].last_message_id
+    return items, None
+
+
+def user_rows(ids):
+    """
+    Loads users with their post, follower and followed counts in one query.
+    @param ids: List of integers
+    @return: List of UserRow in the order of ids
+    """
+    if not ids:
+        return []
+    post_count = select(func.count(Post.id)).where(Post.user_id == User.id).scalar_subquery()
+    follower_count = select(func.count()).select_from(followers).where(
+        followers.c.followed_id == User.id).scalar_subquery()
+    followed_count = select(func.count()).select_from(followers).where(
+        followers.c.follower_id == User.id).scalar_subquery()
+    statement = select(User.id, User.username, User.last_seen, User.about_me, post_count, follower_count,
+                       followed_count, User.email).where(User.id.in_(ids))
+    rows = {row[0]: UserRow(*row[:-1], email_digest(row[-1])) for row in db.session.execute(statement)}
+    return [rows[id] for id in ids if id in rows]
+
+
+def paginate_users(query, page, per_page):
+    """
+    Pages a user query in id order, loading only the ids through it and the page's users through user_rows.
+    @param query: Query of User
+    @param page: Integer
+    @param per_page: Integer
+    @return: Pagination of UserRow
+    """
+    pagination = query.with_entities(User.id).order_by(User.id).paginate(page, per_page, False)
+    pagination.items = user_rows([id for id, in pagination.items])
+    return pagination
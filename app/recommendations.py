@@ -0,0 +1,107 @@
+""" Who-to-follow suggestions scored offline from the follow graph. """
+import heapq
+from array import array
+from math import log1p
+
+from sqlalchemy import func, select
+
+from app.models import Suggestion, User, followers
+from app.seed import insert_rows
+
+POPULARITY_WEIGHT = 0.1
+
+
+def build_csr(edges, size):
+    """
+    Packs follow edges into compressed sparse row arrays, so user u follows indices[indptr[u]:indptr[u + 1]].
+    Two flat integer arrays keep a million edge graph in a few megabytes where lists of Python ints would take tens.
+    @param edges: Iterable of (follower id, followed id) tuples sorted by follower id
+    @param size: Integer, greater than the largest user id
+    @return: Tuple of (indptr, indices) arrays
+    """
+    indptr = array('q', bytes(8 * (size + 1)))
+    indices = array('i')
+    for follower_id, followed_id in edges:
+        indices.append(followed_id)
+        indptr[follower_id + 1] += 1
+    for node in range(size):
+        indptr[node + 1] += indptr[node]
+    return indptr, indices
+
+
+def in_degrees(indices, size):
+    """
+    Returns the number of followers of every user.
+    @param indices: Array
+    @param size: Integer
+    @return: Array
+    """
+    degrees = array('i', bytes(4 * size))
+    for followed_id in indices:
+        degrees[followed_id] += 1
+    return degrees
+
+
+def suggest(indptr, indices, degrees, user_id, k, popular=()):
+    """
+    Scores the users followed by the users user_id follows, friends of friends, by how many of those paths lead to
+    them plus a small popularity bonus. Users with too few candidates are topped up from the popular users.
+    @param indptr: Array
+    @param indices: Array
+    @param degrees: Array
+    @param user_id: Integer
+    @param k: Integer
+    @param popular: Sequence of user ids, most followed first
+    @return: List of (user id, score) tuples, best first
+    """
+    followed = indices[indptr[user_id]:indptr[user_id + 1]]
+    excluded = set(followed)
+    excluded.add(user_id)
+    paths = {}
+    for friend in followed:
+        for candidate in indices[indptr[friend]:indptr[friend + 1]]:
+            if candidate not in excluded:
+                paths[candidate] = paths.get(candidate, 0) + 1
+    scores = {candidate: count + POPULARITY_WEIGHT * log1p(degrees[candidate]) for candidate, count in paths.items()}
+    ranked = heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+    for candidate in popular:
+        if len(ranked) >= k:
+            break
+        if candidate not in excluded and candidate not in scores:
+            ranked.append((candidate, POPULARITY_WEIGHT * log1p(degrees[candidate])))
+    return ranked
+
+
+def suggestion_rows(indptr, indices, user_ids, k):
+    """
+    Yields the top k suggestions of every user as rows of the suggestion table.
+    @param indptr: Array
+    @param indices: Array
+    @param user_ids: Iterable of integers
+    @param k: Integer
+    @return: Generator of dictionaries
+    """
+    size = len(indptr) - 1
+    degrees = in_degrees(indices, size)
+    popular = [id for id in heapq.nlargest(k * 2, range(size), key=degrees.__getitem__) if degrees[id]]
+    for user_id in user_ids:
+        for rank, (suggested_id, score) in enumerate(suggest(indptr, indices, degrees, user_id, k, popular)):
+            yield {'user_id': user_id, 'rank': rank, 'suggested_id': suggested_id, 'score': score}
+
+
+def refresh_suggestions(engine, k):
+    """
+    Recomputes the suggestions of every user and swaps them in within a single transaction.
+    @param engine: Sqlalchemy engine
+    @param k: Integer, suggestions kept per user
+    @return: Integer, the number of rows written
+    """
+    with engine.connect() as connection:
+        size = (connection.execute(select(func.max(User.id))).scalar() or 0) + 1
+        user_ids = array('i', connection.execute(select(User.id).order_by(User.id)).scalars())
+        indptr, indices = build_csr(connection.execution_options(stream_results=True).execute(
+            select(followers.c.follower_id, followers.c.followed_id).order_by(
+                followers.c.follower_id, followers.c.followed_id)), size)
+    with engine.begin() as connection:
+        connection.execute(Suggestion.__table__.delete())
+        return insert_rows(connection, Suggestion.__table__, suggestion_rows(indptr, indices, user_ids, k))
@@ -0,0 +1,239 @@
+""" Circuit breakers around Elasticsearch, Redis and the translator, so an outage fails fast instead of hanging. """
+import threading
+from contextlib import contextmanager
+from time import time
+
+from elastic_transport import ConnectionError as SearchConnectionError, TransportError
+from flask import current_app
+from redis.exceptions import ConnectionError as RedisConnectionError, RedisError, TimeoutError as RedisTimeoutError
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+# How often a closed breaker looks for a trip recorded by another process when SHARED is on.
+SHARED_CHECK_INTERVAL = 1.0
+SHARED_KEY = 'circuit:{}'
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of calling a dependency whose circuit is open. """
+
+
+class SearchCircuitOpenError(CircuitOpenError, SearchConnectionError):
+    """ An open Elasticsearch circuit, caught wherever an Elasticsearch connection error is. """
+
+
+class RedisCircuitOpenError(CircuitOpenError, RedisConnectionError):
+    """ An open Redis circuit, caught wherever a Redis connection error is. """
+
+
+def translator_errors():
+    """
+    The errors of the translator's HTTP client, imported with googletrans when the translator is first used rather
+    than at startup. Errors from bad input, like an unknown language, are not the translator failing.
+    @return: Tuple of exception classes
+    """
+    import httpx
+    # httpx 0.13 re-exports the timeout and network errors of httpcore, which do not derive from its HTTPError.
+    return (httpx.HTTPError, httpx.ConnectTimeout, httpx.ReadTimeout, httpx.WriteTimeout, httpx.PoolTimeout,
+            httpx.NetworkError, httpx.ProtocolError, httpx.ProxyError, OSError)
+
+
+# Dependency name to the exceptions counted as its failures and the error raised while its circuit is open. Other
+# exceptions, like a 404 from Elasticsearch, mean the dependency answered. A function stands for exceptions that are
+# looked up when the dependency first raises.
+DEPENDENCIES = {
+    'elasticsearch': ((TransportError,), SearchCircuitOpenError),
+    'redis': ((RedisConnectionError, RedisTimeoutError), RedisCircuitOpenError),
+    'translator': (translator_errors, CircuitOpenError),
+}
+
+
+class CircuitBreaker:
+    """
+    Counts the consecutive failures of one dependency. After `failures` of them the circuit opens and every call
+    fails at once with open_error for reset_timeout seconds. The circuit is half open then: one trial call goes
+    through, closing the circuit when it succeeds and opening it again when it fails, while other calls keep failing
+    fast. With a shared Redis client a trip is also written to Redis, so the other processes open their circuit
+    without paying for the failures themselves.
+    """
+
+    def __init__(self, name, failures=5, reset_timeout=30, exceptions=(Exception,), open_error=CircuitOpenError,
+                 registry=None, shared=None):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self._exceptions = exceptions
+        self.open_error = open_error
+        self._registry = registry
+        self._shared = shared
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failure_count = 0
+        self._opened_at = 0.0
+        self._trial_running = False
+        self._shared_checked_at = 0.0
+
+    @property
+    def exceptions(self):
+        """
+        @return: Tuple of the exceptions counted as failures
+        """
+        if not isinstance(self._exceptions, tuple):
+            self._exceptions = self._exceptions()
+        return self._exceptions
+
+    @property
+    def state(self):
+        """
+        @return: String, CLOSED, OPEN or HALF_OPEN
+        """
+        with self._lock:
+            if self._state == OPEN and time() - self._opened_at >= self.reset_timeout:
+                return HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """
+        Decides whether a call may go to the dependency, letting one trial call through once the circuit has been
+        open for reset_timeout.
+        @return: Boolean
+        """
+        now = time()
+        if self._state == CLOSED and self._shared is not None \
+                and now - self._shared_checked_at >= SHARED_CHECK_INTERVAL:
+            self._check_shared(now)
+        with self._lock:
+            if self._state == CLOSED:
+                return True
+            if self._state == OPEN and now - self._opened_at >= self.reset_timeout:
+                self._state = HALF_OPEN
+                self._trial_running = False
+            if self._state == HALF_OPEN and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = CLOSED
+            self._failure_count = 0
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failure_count += 1
+            if self._state == HALF_OPEN or (self._state == CLOSED and self._failure_count >= self.failures):
+                self._trip(time())
+                tripped = True
+            else:
+                tripped = False
+        if tripped:
+            self._inc('circuit_breaker_trips_total')
+            self._share_trip()
+
+    @contextmanager
+    def guard(self):
+        """
+        Runs the with block as a call to the dependency, failing at once while the circuit is open.
+        @return: None
+        """
+        if not self.allow():
+            self._inc('circuit_breaker_short_circuits_total')
+            raise self.open_error(f'{self.name} circuit is open')
+        try:
+            yield
+        except self.exceptions:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.record_success()
+            raise
+        self.record_success()
+
+    def _trip(self, opened_at):
+        self._state = OPEN
+        self._opened_at = opened_at
+        self._trial_running = False
+
+    def _inc(self, name):
+        if self._registry is not None:
+            self._registry.inc(name, dependency=self.name)
+
+    def _share_trip(self):
+        if self._shared is None:
+            return
+        try:
+            self._shared().set(SHARED_KEY.format(self.name), time(), ex=max(1, int(self.reset_timeout)))
+        except RedisError:
+            pass
+
+    def _check_shared(self, now):
+        self._shared_checked_at = now
+        try:
+            opened_at = self._shared().get(SHARED_KEY.format(self.name))
+        except RedisError:
+            return
+        if opened_at is not None:
+            with self._lock:
+                if self._state == CLOSED:
+                    self._trip(float(opened_at))
+
+
+class CircuitBreakers:
+    """
+    Creates one CircuitBreaker per dependency in CIRCUIT_BREAKERS for every app, counting trips and short circuits in
+    the given metrics registry. With CIRCUIT_BREAKER_SHARED the breakers other than Redis's own share their trips
+    through the app's Redis.
+    """
+
+    def __init__(self, registry=None, app=None):
+        self._registry = registry
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        shared = (lambda: app.redis) if app.config['CIRCUIT_BREAKER_SHARED'] else None
+        app.extensions['circuit_breakers'] = {
+            name: CircuitBreaker(name, exceptions=DEPENDENCIES[name][0], open_error=DEPENDENCIES[name][1],
+                                 registry=self._registry, shared=shared if name != 'redis' else None, **settings)
+            for name, settings in app.config['CIRCUIT_BREAKERS'].items()}
+
+
+def circuit(name):
+    """
+    Guards a call to a dependency of the current app with its circuit breaker.
+    @param name: String, a key of CIRCUIT_BREAKERS
+    @return: Context manager
+    """
+    return current_app.extensions['circuit_breakers'][name].guard()
+
+
+def guard_redis(client, breaker):
+    """
+    Sends every command and pipeline of the given Redis client through the breaker.
+    @param client: Redis
+    @param breaker: CircuitBreaker
+    @return: Redis
+    """
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def guarded_execute_command(*args, **options):
+        with breaker.guard():
+            return execute_command(*args, **options)
+
+    def guarded_pipeline(*args, **kwargs):
+        guarded = pipeline(*args, **kwargs)
+        execute = guarded.execute
+
+        def guarded_execute(*execute_args, **execute_kwargs):
+            with breaker.guard():
+                return execute(*execute_args, **execute_kwargs)
+
+        guarded.execute = guarded_execute
+        return guarded
+
+    client.execute_command = guarded_execute_command
+    client.pipeline = guarded_pipeline
+    return client
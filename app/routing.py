@@ -0,0 +1,127 @@
+""" Read replica routing for read-only views. """
+import threading
+from functools import wraps
+from itertools import cycle
+from time import time
+
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import event, orm, text
+from sqlalchemy.exc import SQLAlchemyError
+
+PRIMARY_UNTIL_KEY = '_read_primary_until'
+
+
+def read_only(view):
+    """
+    Marks a view as read-only so its queries may be served by a replica.
+    @param view: Function
+    @return: Function
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.read_only = True
+        try:
+            return view(*args, **kwargs)
+        finally:
+            g.read_only = False
+    return wrapper
+
+
+def _reads_from_replica():
+    return has_request_context() and g.get('read_only', False) and session.get(PRIMARY_UNTIL_KEY, 0) < time()
+
+
+class ReplicaRouter:
+    """ Picks a replica engine round-robin or by the lowest replication lag. """
+
+    def __init__(self, db, app):
+        self._engines = [db.get_engine(app, bind=bind) for bind in sorted(app.config['SQLALCHEMY_BINDS'])
+                         if bind.startswith('replica_')]
+        self._cycle = cycle(self._engines)
+        self._lock = threading.Lock()
+        self._lags = {}
+        self.strategy = app.config['REPLICA_STRATEGY']
+        self.max_lag = app.config['REPLICA_MAX_LAG']
+        self.lag_check_interval = app.config['REPLICA_LAG_CHECK_INTERVAL']
+
+    def choose(self):
+        """
+        Returns the replica engine for the next read, or None to fall back to the primary.
+        @return: Sqlalchemy engine or None
+        """
+        if self.strategy == 'lag':
+            candidates = [engine for engine in self._engines if self.lag(engine) <= self.max_lag]
+            return min(candidates, key=self.lag) if candidates else None
+        with self._lock:
+            return next(self._cycle)
+
+    def lag(self, engine):
+        """
+        Returns the replication lag of a replica in seconds, refreshed at most every lag_check_interval seconds.
+        Unreachable replicas report an infinite lag.
+        @param engine: Sqlalchemy engine
+        @return: Float
+        """
+        checked_at, lag = self._lags.get(engine, (0, 0.0))
+        if time() - checked_at < self.lag_check_interval:
+            return lag
+        try:
+            if engine.dialect.name == 'postgresql':
+                with engine.connect() as connection:
+                    lag = connection.execute(text(
+                        'SELECT COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)')).scalar()
+            else:
+                lag = 0.0
+        except SQLAlchemyError:
+            lag = float('inf')
+        self._lags[engine] = (time(), float(lag))
+        return float(lag)
+
+
+class RoutingSession(SignallingSession):
+    """ Session sending reads in read-only requests to a replica and everything else to the primary. """
+
+    def get_bind(self, mapper=None, clause=None):
+        router = self.app.extensions.get('replica_router')
+        if router is not None and not self._flushing and not getattr(clause, 'is_dml', False) \
+                and _reads_from_replica():
+            engine = router.choose()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper, clause)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _record_write(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _stick_to_primary(db_session):
+    """
+    After a request changes data, keeps that client's reads on the primary for REPLICA_READ_YOUR_WRITES_WINDOW seconds
+    so it sees its own writes even when replicas lag behind. Writes made while serving GET requests, like last_seen,
+    do not count.
+    """
+    wrote = db_session.info.pop('wrote', False)
+    if wrote and has_request_context() and request.method not in ('GET', 'HEAD') \
+            and 'replica_router' in db_session.app.extensions:
+        session[PRIMARY_UNTIL_KEY] = time() + db_session.app.config['REPLICA_READ_YOUR_WRITES_WINDOW']
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """ SQLAlchemy extension registering replica binds and using the RoutingSession. """
+
+    def init_app(self, app):
+        replicas = app.config.get('SQLALCHEMY_REPLICA_URIS') or []
+        if replicas:
+            binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+            binds.update({f'replica_{i}': uri for i, uri in enumerate(replicas)})
+            app.config['SQLALCHEMY_BINDS'] = binds
+        super().init_app(app)
+        if replicas:
+            app.extensions['replica_router'] = ReplicaRouter(self, app)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
@@ -1,6 +1,13 @@
-from elastic_transport import ConnectionError
+import re
+import threading
+
+from elastic_transport import TransportError
 from flask import current_app
 
+from app import metrics
+from app.resilience import circuit
+from app.tracing import CLIENT, span
+
 
 def add_to_index(index, model):
     if not current_app.elasticsearch:
@@ -9,8 +16,10 @@ def add_to_index(index, model):
     for field in model.__searchable__:
         payload[field] = getattr(model, field)
     try:
-        current_app.elasticsearch.index(index=index, id=model.id, body=payload)
-    except ConnectionError:
+        with span('elasticsearch index', CLIENT), circuit('elasticsearch'), \
+                metrics.timed('elasticsearch_request_duration_seconds', operation='index'):
+            current_app.elasticsearch.index(index=index, id=model.id, body=payload)
+    except TransportError:
         return
 
 
@@ -18,25 +27,121 @@ def remove_from_index(index, model):
     if not current_app.elasticsearch:
         return
     try:
-        current_app.elasticsearch.delete(index=index, id=model.id)
-    except ConnectionError:
+        with span('elasticsearch delete', CLIENT), circuit('elasticsearch'), \
+                metrics.timed('elasticsearch_request_duration_seconds', operation='delete'):
+            current_app.elasticsearch.delete(index=index, id=model.id)
+    except TransportError:
         return
 
 
+def bulk_index(index, documents, chunk_size=500):
+    """
+    Indexes (id, payload) pairs in bulk requests instead of one request per document.
+    @param index: String
+    @param documents: Iterable of (id, dictionary) tuples
+    @param chunk_size: Integer
+    @return: Integer
+    """
+    if not current_app.elasticsearch:
+        return 0
+    if isinstance(current_app.elasticsearch, LocalSearch):
+        count = 0
+        for id, payload in documents:
+            current_app.elasticsearch.index(index=index, id=id, body=payload)
+            count += 1
+        return count
+    from elasticsearch.helpers import bulk
+    actions = ({'_index': index, '_id': id, '_source': payload} for id, payload in documents)
+    with span('elasticsearch bulk', CLIENT), circuit('elasticsearch'), \
+            metrics.timed('elasticsearch_request_duration_seconds', operation='bulk'):
+        count, _ = bulk(current_app.elasticsearch, actions, chunk_size=chunk_size)
+    return count
+
+
 def query_index(index, text_to_search, page, per_page):
+    """
+    Searches an index, raising TransportError when Elasticsearch fails or its circuit is open.
+    @param index: String
+    @param text_to_search: String
+    @param page: Integer
+    @param per_page: Integer
+    @return: Tuple of the ids found and the total number of hits
+    """
     if not current_app.elasticsearch:
         return [], 0
-    search = current_app.elasticsearch.search(
-        index=index,
-        body={
-            'query': {
-                'multi_match': {
-                    'query': text_to_search,
-                    'fields': ['*']
-                }
-            },
-            'from': (page - 1) * per_page, 'size': per_page
-        })
+    with span('elasticsearch search', CLIENT), circuit('elasticsearch'), \
+            metrics.timed('elasticsearch_request_duration_seconds', operation='search'):
+        search = current_app.elasticsearch.search(
+            index=index,
+            body={
+                'query': {
+                    'multi_match': {
+                        'query': text_to_search,
+                        'fields': ['*']
+                    }
+                },
+                'from': (page - 1) * per_page, 'size': per_page
+            })
     list_of_ids = [int(hit['_id']) for hit in search['hits']['hits']]
     total_number_of_posts = search['hits']['total']['value']
     return list_of_ids, total_number_of_posts
+
+
+class LocalSearch:
+    """ In-process stand-in for the subset of the Elasticsearch client used by this module. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents = {}
+        self._postings = {}
+
+    @staticmethod
+    def _terms(text):
+        return re.findall(r'\w+', str(text).lower())
+
+    def index(self, index, id, body):
+        """
+        Adds or replaces a document in the index.
+        @param index: String
+        @param id: Integer
+        @param body: Dictionary
+        @return: None
+        """
+        self.delete(index, id)
+        terms = [term for value in body.values() for term in self._terms(value)]
+        with self._lock:
+            self._documents.setdefault(index, {})[id] = terms
+            postings = self._postings.setdefault(index, {})
+            for term in terms:
+                postings.setdefault(term, {})
+                postings[term][id] = postings[term].get(id, 0) + 1
+
+    def delete(self, index, id):
+        """
+        Removes a document from the index.
+        @param index: String
+        @param id: Integer
+        @return: None
+        """
+        with self._lock:
+            terms = self._documents.get(index, {}).pop(id, None)
+            for term in set(terms or ()):
+                self._postings[index][term].pop(id, None)
+
+    def search(self, index, body):
+        """
+        Scores documents by query term frequency and returns an Elasticsearch shaped response.
+        @param index: String
+        @param body: Dictionary
+        @return: Dictionary
+        """
+        scores = {}
+        with self._lock:
+            postings = self._postings.get(index, {})
+            for term in self._terms(body['query']['multi_match']['query']):
+                for id, frequency in postings.get(term, {}).items():
+                    scores[id] = scores.get(id, 0) + frequency
+        ranked = sorted(scores, key=lambda id: (scores[id], id), reverse=True)
+        start = body.get('from', 0)
+        hits = [{'_id': str(id), '_score': scores[id]} for id in ranked[start:start + body.get('size', 10)]]
+        return {'hits': {'hits': hits, 'total': {'value': len(ranked)}}}
@@ -0,0 +1,269 @@
+""" Deterministic synthetic social graph generation for benchmarks and load tests. """
+import csv
+import io
+import json
+import random
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from time import time
+
+from sqlalchemy import create_engine, func, select
+from werkzeug.security import generate_password_hash
+
+from app.models import Conversation, Message, Notification, Post, User, followers
+
+SEED_PASSWORD = 'password'
+EPOCH = datetime(2022, 1, 1)
+
+
+def _rng(seed, table, start):
+    return random.Random(f'{seed}:{table}:{start}')
+
+
+def _popular_user(rng, number_of_users):
+    """
+    Picks a user id skewed towards low ids, so a few users collect most of the followers and messages.
+    @param rng: Random
+    @param number_of_users: Integer
+    @return: Integer
+    """
+    return int(number_of_users * rng.random() ** 3) + 1
+
+
+def user_rows(start, stop, password_hash):
+    """
+    Yields user rows with ids in [start, stop).
+    @param start: Integer
+    @param stop: Integer
+    @param password_hash: String
+    @return: Generator of dictionaries
+    """
+    for id in range(start, stop):
+        yield {'id': id, 'username': f'user{id}', 'email': f'user{id}@example.com', 'password_hash': password_hash,
+               'about_me': f'I am synthetic user number {id}.', 'last_seen': EPOCH + timedelta(minutes=id)}
+
+
+def follow_rows(start, stop, number_of_users, mean_follows, seed=0):
+    """
+    Yields follow edges for followers with ids in [start, stop). Fan-out is Pareto distributed around mean_follows
+    and followed users are picked with a power law popularity.
+    @param start: Integer
+    @param stop: Integer
+    @param number_of_users: Integer
+    @param mean_follows: Integer
+    @param seed: Integer
+    @return: Generator of dictionaries
+    """
+    rng = _rng(seed, 'followers', start)
+    for follower_id in range(start, stop):
+        fan_out = min(int(rng.paretovariate(2) * mean_follows / 2), number_of_users - 1)
+        followed = set()
+        for _ in range(fan_out * 4):
+            if len(followed) == fan_out:
+                break
+            followed_id = _popular_user(rng, number_of_users)
+            if followed_id != follower_id:
+                followed.add(followed_id)
+        for followed_id in sorted(followed):
+            yield {'follower_id': follower_id, 'followed_id': followed_id}
+
+
+def post_rows(start, stop, posts_per_user, seed=0):
+    """
+    Yields posts for authors with ids in [start, stop). Post ids are derived from the author id so chunks never overlap.
+    @param start: Integer
+    @param stop: Integer
+    @param posts_per_user: Integer
+    @param seed: Integer
+    @return: Generator of dictionaries
+    """
+    rng = _rng(seed, 'post', start)
+    words = ('blog', 'dhaka', 'python', 'flask', 'rain', 'cricket', 'tea', 'river', 'music', 'travel', 'food', 'code')
+    for user_id in range(start, stop):
+        for i in range(posts_per_user):
+            id = (user_id - 1) * posts_per_user + i + 1
+            yield {'id': id, 'body': ' '.join(rng.choice(words) for _ in range(rng.randint(3, 20))),
+                   'timestamp': EPOCH + timedelta(seconds=id * 7), 'user_id': user_id, 'language': 'en'}
+
+
+def message_rows(start, stop, number_of_users, messages_per_user, seed=0):
+    """
+    Yields messages sent by users with ids in [start, stop).
+    @param start: Integer
+    @param stop: Integer
+    @param number_of_users: Integer
+    @param messages_per_user: Integer
+    @param seed: Integer
+    @return: Generator of dictionaries
+    """
+    rng = _rng(seed, 'message', start)
+    for sender_id in range(start, stop):
+        for i in range(messages_per_user):
+            id = (sender_id - 1) * messages_per_user + i + 1
+            yield {'id': id, 'sender_id': sender_id, 'receiver_id': _popular_user(rng, number_of_users),
+                   'body': f'Message {i} from user{sender_id}', 'timestamp': EPOCH + timedelta(seconds=id * 11)}
+
+
+def notification_rows(start, stop, seed=0):
+    """
+    Yields one unread message count notification for every user with an id in [start, stop).
+    @param start: Integer
+    @param stop: Integer
+    @param seed: Integer
+    @return: Generator of dictionaries
+    """
+    rng = _rng(seed, 'notification', start)
+    now = time()
+    for user_id in range(start, stop):
+        yield {'id': user_id, 'name': 'unread_message_count', 'user_id': user_id, 'timestamp': now,
+               'payload_json': json.dumps(rng.randint(0, 20))}
+
+
+def insert_rows(connection, table, rows, chunk_size=10000):
+    """
+    Inserts rows with executemany in chunks of chunk_size.
+    @param connection: Sqlalchemy connection
+    @param table: Sqlalchemy table
+    @param rows: Iterable of dictionaries
+    @param chunk_size: Integer
+    @return: Integer
+    """
+    count = 0
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            connection.execute(table.insert(), chunk)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        connection.execute(table.insert(), chunk)
+        count += len(chunk)
+    return count
+
+
+def copy_rows(engine, table, rows):
+    """
+    Streams rows into a Postgres table with COPY, the fastest bulk load path Postgres offers.
+    @param engine: Sqlalchemy engine
+    @param table: Sqlalchemy table
+    @param rows: Iterable of dictionaries
+    @return: Integer
+    """
+    columns = [column.name for column in table.columns]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow([row.get(column) for column in columns])
+        count += 1
+    buffer.seek(0)
+    preparer = engine.dialect.identifier_preparer
+    statement = f'COPY {preparer.format_table(table)} ({", ".join(map(preparer.quote, columns))}) ' \
+                f'FROM STDIN WITH (FORMAT csv)'
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.copy_expert(statement, buffer)
+        connection.commit()
+    finally:
+        connection.close()
+    return count
+
+
+TABLES = {
+    'user': User.__table__,
+    'followers': followers,
+    'post': Post.__table__,
+    'message': Message.__table__,
+    'notification': Notification.__table__,
+}
+
+
+def _rows(table, start, stop, options):
+    if table == 'user':
+        return user_rows(start, stop, options['password_hash'])
+    if table == 'followers':
+        return follow_rows(start, stop, options['users'], options['mean_follows'], options['seed'])
+    if table == 'post':
+        return post_rows(start, stop, options['posts_per_user'], options['seed'])
+    if table == 'message':
+        return message_rows(start, stop, options['users'], options['messages_per_user'], options['seed'])
+    return notification_rows(start, stop, options['seed'])
+
+
+def _seed_chunk(engine, table, start, stop, options):
+    rows = _rows(table, start, stop, options)
+    if engine.dialect.name == 'postgresql':
+        return copy_rows(engine, TABLES[table], rows)
+    with engine.begin() as connection:
+        return insert_rows(connection, TABLES[table], rows)
+
+
+_worker_engines = {}
+
+
+def _seed_chunk_in_worker(job):
+    url, table, start, stop, options = job
+    if url not in _worker_engines:
+        _worker_engines[url] = create_engine(url)
+    return table, _seed_chunk(_worker_engines[url], table, start, stop, options)
+
+
+def _reset_sequences(engine):
+    with engine.begin() as connection:
+        for table in TABLES.values():
+            if 'id' in table.columns:
+                connection.execute(select(func.setval(
+                    func.pg_get_serial_sequence(engine.dialect.identifier_preparer.format_table(table), 'id'),
+                    select(func.coalesce(func.max(table.c.id), 0) + 1).scalar_subquery(), False)))
+
+
+def seed_graph(engine, users, mean_follows=20, posts_per_user=10, messages_per_user=2, seed=0, workers=1,
+               chunk_size=1000, progress=None):
+    """
+    Seeds a complete social graph with bulk Core inserts, or COPY on Postgres, bypassing the ORM and its search hooks.
+    Users are split into chunks of chunk_size and every chunk is generated and written by one of the worker processes.
+    Users are written before the tables referencing them. SQLite allows a single writer so it always uses one worker.
+    The conversation summaries are rebuilt from the messages at the end.
+    @param engine: Sqlalchemy engine
+    @param users: Integer
+    @param mean_follows: Integer
+    @param posts_per_user: Integer
+    @param messages_per_user: Integer
+    @param seed: Integer
+    @param workers: Integer
+    @param chunk_size: Integer
+    @param progress: Callable receiving the table name and the number of rows just written
+    @return: Dictionary of table name to inserted row count
+    """
+    options = {'password_hash': generate_password_hash(SEED_PASSWORD), 'users': users, 'mean_follows': mean_follows,
+               'posts_per_user': posts_per_user, 'messages_per_user': messages_per_user, 'seed': seed}
+    counts = dict.fromkeys([*TABLES, 'conversation'], 0)
+    phases = (['user'], [table for table in TABLES if table != 'user'])
+    chunks = [(start, min(start + chunk_size, users + 1)) for start in range(1, users + 1, chunk_size)]
+    if engine.dialect.name == 'sqlite':
+        workers = 1
+
+    def record(table, count):
+        counts[table] += count
+        if progress:
+            progress(table, count)
+
+    if workers <= 1:
+        for tables in phases:
+            for table in tables:
+                for start, stop in chunks:
+                    record(table, _seed_chunk(engine, table, start, stop, options))
+    else:
+        url = engine.url.render_as_string(hide_password=False)
+        with ProcessPoolExecutor(workers) as executor:
+            for tables in phases:
+                jobs = [(url, table, start, stop, options) for table in tables for start, stop in chunks]
+                for table, count in executor.map(_seed_chunk_in_worker, jobs):
+                    record(table, count)
+    with engine.begin() as connection:
+        record('conversation', Conversation.rebuild(connection))
+    if engine.dialect.name == 'postgresql':
+        _reset_sequences(engine)
+    return counts
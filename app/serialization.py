@@ -0,0 +1,117 @@
+""" JSON encoding for jsonify, tojson and flask.json, backed by orjson when it is installed. """
+import re
+import secrets
+from datetime import date, datetime
+
+from flask.json import JSONDecoder as BaseJSONDecoder, JSONEncoder as BaseJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+PROVIDERS = ('orjson', 'json')
+
+
+class RawJSON:
+    """ Text that is already JSON, embedded in the output as is instead of being decoded and encoded again. """
+    __slots__ = ('text',)
+
+    def __init__(self, text):
+        self.text = text
+
+
+class JSONEncoder(BaseJSONEncoder):
+    """
+    Writes datetimes as ISO 8601, naive ones being UTC with a Z suffix, and RawJSON values verbatim. Each RawJSON is
+    encoded as a placeholder string carrying a random token, replaced by its text once the document is done.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._raw = None
+        self._token = None
+
+    def default(self, o):
+        if isinstance(o, datetime):
+            if o.tzinfo is not None and o.utcoffset():
+                return o.isoformat()
+            return o.replace(tzinfo=None).isoformat() + 'Z'
+        if isinstance(o, date):
+            return o.isoformat()
+        if isinstance(o, RawJSON):
+            if self._raw is None:
+                self._raw, self._token = [], secrets.token_hex(8)
+            self._raw.append(o.text)
+            return f'{self._token}:{len(self._raw) - 1}'
+        return super().default(o)
+
+    def encode(self, o):
+        self._raw = None
+        text = self._encode(o)
+        if self._raw is not None:
+            text = re.sub(f'"{self._token}:(\\d+)"', lambda match: self._raw[int(match.group(1))], text)
+        return text
+
+    def _encode(self, o):
+        return super().encode(o)
+
+
+class FastJSONEncoder(JSONEncoder):
+    """
+    Encodes with orjson using the sort_keys and indent arguments flask passes. orjson writes datetimes itself, in the
+    same format as JSONEncoder.default, and its output is always UTF-8 rather than ASCII escaped. Documents it refuses,
+    such as integers wider than 64 bits or non string keys, go through the standard library encoder instead.
+    """
+
+    def _encode(self, o):
+        option = orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if self.indent:
+            option |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(o, default=self.default, option=option).decode('utf-8')
+        except orjson.JSONEncodeError:
+            return super()._encode(o)
+
+
+class FastJSONDecoder(BaseJSONDecoder):
+    """
+    Decodes with orjson unless hooks were asked for, like the object_hook of the session serializer, which only the
+    standard library decoder supports.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._hooked = any(kwargs.get(hook) for hook in (
+            'object_hook', 'object_pairs_hook', 'parse_float', 'parse_int', 'parse_constant'))
+
+    def decode(self, s, _w=None):
+        if self._hooked:
+            return super().decode(s)
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError:
+            return super().decode(s)
+
+
+class JSONProvider:
+    """
+    Installs the encoder and decoder named by JSON_PROVIDER, falling back to the standard library when orjson is
+    not installed.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    @staticmethod
+    def init_app(app):
+        provider = app.config['JSON_PROVIDER']
+        if provider not in PROVIDERS:
+            raise ValueError(f'JSON_PROVIDER must be one of {", ".join(PROVIDERS)}, not {provider!r}')
+        if provider == 'orjson' and orjson is not None:
+            app.json_encoder, app.json_decoder = FastJSONEncoder, FastJSONDecoder
+        else:
+            app.json_encoder, app.json_decoder = JSONEncoder, BaseJSONDecoder
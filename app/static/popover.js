@@ -1,4 +1,35 @@
+// Popups are fetched for every author on the page in one batch request and kept for POPUP_TTL milliseconds, so
+// hovering the same author again, here or on the next page, does not hit the server.
+const POPUP_TTL = 60 * 1000
+const POPUP_STORAGE_KEY = 'popups'
+
+let popups = JSON.parse(sessionStorage.getItem(POPUP_STORAGE_KEY) || '{}')
+let pendingPopups = null
+
+function freshPopup(username) {
+    let popup = popups[username]
+    return popup && popup.expires > Date.now() ? popup.html : null
+}
+
+function fetchPopups(usernames) {
+    let stale = usernames.filter((username) => freshPopup(username) === null)
+    if (stale.length === 0) {
+        return Promise.resolve()
+    }
+    let query = new URLSearchParams(stale.map((username) => ['username', username]))
+    return fetch('/popups?' + query)
+        .then((response) => response.json())
+        .then((data) => {
+            let expires = Date.now() + POPUP_TTL
+            Object.entries(data).forEach(([username, html]) => {
+                popups[username] = {html: html, expires: expires}
+            })
+            sessionStorage.setItem(POPUP_STORAGE_KEY, JSON.stringify(popups))
+        })
+}
+
 let elements = Array.from(document.querySelectorAll('[data-username]'))
+let usernames = Array.from(new Set(elements.map((element) => element.getAttribute('data-username'))))
 elements.forEach((element) => {
     let username = element.getAttribute('data-username')
     tippy(element, {
@@ -9,10 +40,14 @@ elements.forEach((element) => {
         allowHTML: true,
         delay: [800, 200],
         onShow(instance) {
-            fetch('/profile/' + username + '/popup')
-                .then((response) => response.text())
-                .then((html) => {
-                    instance.setContent(html)
+            if (freshPopup(username) === null && pendingPopups === null) {
+                pendingPopups = fetchPopups(usernames).finally(() => {
+                    pendingPopups = null
+                })
+            }
+            Promise.resolve(pendingPopups)
+                .then(() => {
+                    instance.setContent(freshPopup(username) || '')
                     flask_moment_render_all();
                 })
                 .catch((error) => {
@@ -20,4 +55,4 @@ elements.forEach((element) => {
                 });
         }
     })
-})
\ No newline at end of file
+})
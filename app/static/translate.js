@@ -23,7 +23,11 @@ function translate(destId, sourceId, destLang, sourceLang) {
             return Promise.reject(response)
         }
     }).then((data) => {
-        destField.innerHTML = data['text'].toString()
+        if (data['translated'] === false) {
+            destField.innerHTML = '<small class="text-muted">Translation is unavailable at the moment.</small>'
+        } else {
+            destField.innerHTML = data['text'].toString()
+        }
     }).catch((error) => {
         destField.innerHTML = '<small class="text-danger"> Something went wrong: ' + error.statusText + '</small>'
     });
@@ -1,17 +1,56 @@
-import json
 import sys
+from functools import wraps
 
-from flask import render_template
+from flask import current_app, g, has_app_context, json, render_template
 from rq import get_current_job
 
-from app import create_app, db
+from app import create_app, db, metrics
 from app.email import send_email
 from app.models import Post, Task, User
+from app.recommendations import refresh_suggestions
+from app.tracing import continue_trace
 
-app = create_app()
-app.app_context().push()
+_worker_app = None
 
 
+def _get_worker_app():
+    """
+    Returns the app jobs run in when the worker has none, created by the first job rather than at import.
+    @return: Flask app
+    """
+    global _worker_app
+    if _worker_app is None:
+        _worker_app = create_app()
+    return _worker_app
+
+
+def _timed_job(func):
+    """
+    Runs the job inside an app context, continuing the trace it was enqueued in, records its duration per task name,
+    names the job as the origin of its slow queries and flushes the metrics shard before the work horse exits.
+    @param func: Function
+    @return: Function
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        if not has_app_context():
+            with _get_worker_app().app_context():
+                return wrapper(*args, **kwargs)
+        job = get_current_job()
+        outer_job_name = g.get('job_name')
+        g.job_name = func.__name__
+        try:
+            with continue_trace(f'job {func.__name__}', job.meta if job else {},
+                                current_app.config['TRACE_SAMPLE_RATE'], **{'rq.job_id': job.id if job else ''}), \
+                    metrics.timed('rq_job_duration_seconds', task=func.__name__):
+                return func(*args, **kwargs)
+        finally:
+            g.job_name = outer_job_name
+            metrics.flush()
+    return wrapper
+
+
+@_timed_job
 def export_posts(user_id):
     try:
         user = User.query.get(user_id)
@@ -20,22 +59,31 @@ def export_posts(user_id):
         i = 0
         total_posts = user.posts.count()
         for post in user.posts.order_by(Post.timestamp.asc()):
-            data.append({'body': post.body, 'timestamp': post.timestamp.isoformat() + 'Z'})
+            data.append({'body': post.body, 'timestamp': post.timestamp})
             i += 1
             _set_task_progress(100 * i // total_posts)
-            send_email('[Easyblogbd] Your blog posts',
-                       sender=app.config['ADMINS'][0], recipients=[user.email],
-                       text_body=render_template('email/export_posts.txt', user=user),
-                       html_body=render_template('email/export_posts.html', user=user),
-                       attachments=[
-                           ('posts.json', 'application/json', json.dumps({'posts': data}, indent=4).encode('utf-8'))],
-                       sync=True)
+        send_email('[Easyblogbd] Your blog posts',
+                   sender=current_app.config['ADMINS'][0], recipients=[user.email],
+                   text_body=render_template('email/export_posts.txt', user=user),
+                   html_body=render_template('email/export_posts.html', user=user),
+                   attachments=[
+                       ('posts.json', 'application/json', json.dumps({'posts': data}, indent=4).encode('utf-8'))],
+                   sync=True)
     except:
-        app.logger.error('Unhandled exception', exc_info=sys.exc_info())
+        current_app.logger.error('Unhandled exception', exc_info=sys.exc_info())
     finally:
         _set_task_progress(100)
 
 
+@_timed_job
+def compute_suggestions():
+    try:
+        count = refresh_suggestions(db.engine, current_app.config['SUGGESTIONS_PER_USER'])
+        current_app.logger.info('Computed %d who-to-follow suggestions', count)
+    except:
+        current_app.logger.error('Unhandled exception', exc_info=sys.exc_info())
+
+
 def _set_task_progress(progress):
     job = get_current_job()
     if job:
@@ -0,0 +1,243 @@
+""" Process-sharded metrics collection rendered in the Prometheus text format. """
+import atexit
+import json
+import os
+import threading
+from contextlib import contextmanager
+from time import perf_counter, time
+
+from flask import current_app, g, has_app_context, request
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, **extra):
+    pairs = list(labels) + list(extra.items())
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class Metrics:
+    """
+    Counters, histograms and gauges kept in memory per process.
+    When METRICS_DIR is set every process periodically writes its values to its own shard file in that directory and
+    a scrape merges all the shards, so no lock is ever shared between gunicorn workers or RQ work horses.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._gauge_callbacks = [self._pool_gauges]
+        self._directory = None
+        self._flush_interval = 5
+        self._last_flush = 0.0
+        self._flush_registered = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._directory = app.config.get('METRICS_DIR')
+        self._flush_interval = app.config.get('METRICS_FLUSH_INTERVAL', 5)
+        if self._directory:
+            os.makedirs(self._directory, exist_ok=True)
+            if not self._flush_registered:
+                atexit.register(self.flush)
+                self._flush_registered = True
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+
+    def inc(self, name, value=1, **labels):
+        """
+        Increments a counter.
+        @param name: String
+        @param value: Float
+        @param labels: Label values
+        @return: None
+        """
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+        self._maybe_flush()
+
+    def observe(self, name, value, **labels):
+        """
+        Records an observation into a histogram.
+        @param name: String
+        @param value: Float
+        @param labels: Label values
+        @return: None
+        """
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * len(DEFAULT_BUCKETS) + [0.0, 0]
+            for i, bound in enumerate(DEFAULT_BUCKETS):
+                if value <= bound:
+                    histogram[i] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+        self._maybe_flush()
+
+    @contextmanager
+    def timed(self, name, **labels):
+        """
+        Observes the duration of the with block in seconds.
+        @param name: String
+        @param labels: Label values
+        @return: None
+        """
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, perf_counter() - start, **labels)
+
+    def _snapshot(self):
+        with self._lock:
+            counters = [[name, list(labels), value] for (name, labels), value in self._counters.items()]
+            histograms = [[name, list(labels), list(values)] for (name, labels), values in self._histograms.items()]
+        gauges = []
+        for callback in self._gauge_callbacks:
+            try:
+                gauges.extend([name, sorted(labels.items()), value] for name, labels, value in callback())
+            except Exception:
+                continue
+        return {'pid': os.getpid(), 'counters': counters, 'histograms': histograms, 'gauges': gauges}
+
+    def _maybe_flush(self):
+        if self._directory and time() - self._last_flush > self._flush_interval:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes this process's shard atomically into METRICS_DIR.
+        @return: None
+        """
+        if not self._directory:
+            return
+        self._last_flush = time()
+        path = os.path.join(self._directory, f'metrics-{os.getpid()}.json')
+        temporary_path = f'{path}.tmp'
+        with open(temporary_path, 'w') as shard:
+            json.dump(self._snapshot(), shard)
+        os.replace(temporary_path, path)
+
+    def _shards(self):
+        own = self._snapshot()
+        if not self._directory:
+            return [own]
+        shards = [own]
+        for filename in os.listdir(self._directory):
+            if not filename.startswith('metrics-') or not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self._directory, filename)) as shard_file:
+                    shard = json.load(shard_file)
+            except (OSError, ValueError):
+                continue
+            if shard['pid'] == own['pid']:
+                continue
+            if not _process_alive(shard['pid']):
+                shard['gauges'] = []
+            shards.append(shard)
+        return shards
+
+    def render(self, extra_gauges=()):
+        """
+        Merges every shard and renders them in the Prometheus text exposition format.
+        @param extra_gauges: Iterable of (name, labels, value) tuples sampled by the scraping process
+        @return: String
+        """
+        counters, histograms, gauges = {}, {}, {}
+        for shard in self._shards():
+            for name, labels, value in shard['counters']:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in shard['histograms']:
+                key = (name, tuple(map(tuple, labels)))
+                merged = histograms.setdefault(key, [0] * len(values))
+                histograms[key] = [total + value for total, value in zip(merged, values)]
+            for name, labels, value in shard['gauges']:
+                key = (name, tuple(map(tuple, labels)))
+                gauges[key] = gauges.get(key, 0) + value
+        for name, labels, value in extra_gauges:
+            gauges[(name, _labels_key(labels))] = value
+
+        lines = []
+        for kind, samples in (('counter', counters), ('gauge', gauges)):
+            for name in sorted({name for name, _ in samples}):
+                lines.append(f'# TYPE {name} {kind}')
+                for (sample_name, labels), value in sorted(samples.items()):
+                    if sample_name == name:
+                        lines.append(f'{name}{_format_labels(labels)} {value}')
+        for name in sorted({name for name, _ in histograms}):
+            lines.append(f'# TYPE {name} histogram')
+            for (sample_name, labels), values in sorted(histograms.items()):
+                if sample_name != name:
+                    continue
+                for bound, count in zip(DEFAULT_BUCKETS, values):
+                    lines.append(f'{name}_bucket{_format_labels(labels, le=bound)} {count}')
+                lines.append(f'{name}_bucket{_format_labels(labels, le="+Inf")} {values[-1]}')
+                lines.append(f'{name}_sum{_format_labels(labels)} {values[-2]}')
+                lines.append(f'{name}_count{_format_labels(labels)} {values[-1]}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _pool_gauges():
+        if not has_app_context() or 'sqlalchemy' not in current_app.extensions:
+            return []
+        pool = current_app.extensions['sqlalchemy'].db.get_engine().pool
+        if not hasattr(pool, 'checkedout'):
+            return []
+        return [('sqlalchemy_pool_checked_out', {}, pool.checkedout()),
+                ('sqlalchemy_pool_overflow', {}, max(pool.overflow(), 0)),
+                ('sqlalchemy_pool_size', {}, pool.size())]
+
+    @staticmethod
+    def _start_request():
+        g.metrics_request_start = perf_counter()
+
+    def _finish_request(self, response):
+        start = g.pop('metrics_request_start', None)
+        if start is None or request.endpoint == 'monitoring.metrics_endpoint':
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        self.observe('http_request_duration_seconds', perf_counter() - start, endpoint=endpoint,
+                     method=request.method)
+        self.inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def instrument_redis(client, registry):
+    """
+    Times every command sent through the given Redis client.
+    @param client: Redis
+    @param registry: Metrics
+    @return: Redis
+    """
+    execute_command = client.execute_command
+
+    def timed_execute_command(*args, **options):
+        with registry.timed('redis_command_duration_seconds', command=str(args[0]).split(' ')[0].upper()):
+            return execute_command(*args, **options)
+
+    client.execute_command = timed_execute_command
+    return client
@@ -0,0 +1,65 @@
+""" Persistent Jinja bytecode cache, filled ahead of time by `flask templates compile`. """
+import os
+import tempfile
+
+from jinja2 import FileSystemBytecodeCache
+
+
+class AtomicBytecodeCache(FileSystemBytecodeCache):
+    """
+    FileSystemBytecodeCache that every worker can share. Entries are written to a temporary file and renamed into
+    place so no worker reads a half written one, and an unreadable or unwritable cache only costs a compile.
+    """
+
+    def load_bytecode(self, bucket):
+        try:
+            super().load_bytecode(bucket)
+        except (OSError, EOFError, ValueError, TypeError):
+            bucket.reset()
+
+    def dump_bytecode(self, bucket):
+        try:
+            fd, path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                bucket.write_bytecode(f)
+            os.replace(path, self._get_cache_filename(bucket))
+        except OSError:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class TemplateCache:
+    """
+    Points the app's Jinja environment at the bytecode cache in TEMPLATE_CACHE_DIR. Templates found there are
+    unmarshalled instead of parsed and compiled, so new and recycled workers skip the compile on first use. Entries
+    are keyed on the template source, an edited template is compiled again.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    @staticmethod
+    def init_app(app):
+        directory = app.config['TEMPLATE_CACHE_DIR']
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            app.jinja_env.bytecode_cache = AtomicBytecodeCache(directory)
+
+    @staticmethod
+    def compile(app):
+        """
+        Loads every template of the app and its blueprints, writing their bytecode to the cache and keeping the
+        compiled templates in the environment's memory.
+        @param app: Flask app
+        @return: Integer, the number of templates
+        """
+        names = app.jinja_env.list_templates()
+        for name in names:
+            app.jinja_env.get_template(name)
+        return len(names)
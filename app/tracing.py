@@ -0,0 +1,443 @@
+""" Lightweight tracing of requests and RQ jobs, written to disk as OTLP JSON lines. """
+import glob
+import json
+import os
+import random
+import re
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import time, time_ns
+
+from flask import current_app, g, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# OTLP span kinds.
+INTERNAL, SERVER, CLIENT, PRODUCER, CONSUMER = 1, 2, 3, 4, 5
+STATUS_ERROR = 2
+SERVICE_NAME = 'easyblogbd'
+STATEMENT_LENGTH = 500
+TRACEPARENT = re.compile(r'^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current_span = ContextVar('current_span', default=None)
+
+
+def _new_id(bits):
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+
+class Trace:
+    """ The spans of one trace recorded by this process, written to the sink together when the local root ends. """
+    __slots__ = ('trace_id', 'sink', 'spans', 'finished')
+
+    def __init__(self, trace_id, sink):
+        self.trace_id = trace_id
+        self.sink = sink
+        self.spans = []
+        self.finished = False
+
+
+class Span:
+    """ One timed operation of a trace. """
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'start', 'end', 'attributes', 'error')
+
+    def __init__(self, trace, name, parent_id=None, kind=INTERNAL, attributes=None):
+        self.trace = trace
+        self.span_id = _new_id(64)
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def finish(self):
+        self.end = time_ns()
+        if self.trace.finished:
+            # Outlived its local root, a mail sent from a thread for instance.
+            self.trace.sink.write([self])
+        else:
+            self.trace.spans.append(self)
+
+    def to_otlp(self):
+        """
+        @return: Dictionary in the OTLP JSON span encoding
+        """
+        span = {
+            'traceId': self.trace.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': self.kind,
+            'startTimeUnixNano': str(self.start),
+            'endTimeUnixNano': str(self.end),
+            'attributes': [{'key': key, 'value': _otlp_value(value)} for key, value in self.attributes.items()],
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        if self.error:
+            span['status'] = {'code': STATUS_ERROR, 'message': self.error}
+        return span
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _plain_value(value):
+    if 'intValue' in value:
+        return int(value['intValue'])
+    return next(iter(value.values()))
+
+
+class JSONLinesSink:
+    """
+    Appends finished traces to traces-<pid>.jsonl in a directory, one OTLP ExportTraceServiceRequest per line, the
+    format an OpenTelemetry collector's otlpjsonfile receiver reads. Every process writes its own file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def write(self, spans):
+        """
+        @param spans: List of Span
+        @return: None
+        """
+        line = json.dumps({'resourceSpans': [{
+            'resource': {'attributes': [{'key': 'service.name', 'value': {'stringValue': SERVICE_NAME}}]},
+            'scopeSpans': [{'scope': {'name': __name__}, 'spans': [span.to_otlp() for span in spans]}],
+        }]}, separators=(',', ':'))
+        with self._lock, open(os.path.join(self.directory, f'traces-{os.getpid()}.jsonl'), 'a') as f:
+            f.write(line + '\n')
+
+
+def current_span():
+    return _current_span.get()
+
+
+def traceparent():
+    """
+    Returns the W3C traceparent of the current span, for a job or a service to continue the trace.
+    @return: String or None when nothing is traced
+    """
+    span = _current_span.get()
+    if span is None:
+        return None
+    return f'00-{span.trace.trace_id}-{span.span_id}-01'
+
+
+def parse_traceparent(value):
+    """
+    @param value: String or None
+    @return: Tuple of trace id and parent span id, or None when the value is not a valid sampled traceparent
+    """
+    match = TRACEPARENT.match((value or '').strip())
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == 'ff' or trace_id == '0' * 32 or parent_id == '0' * 16 or not int(flags, 16) & 1:
+        return None
+    return trace_id, parent_id
+
+
+def start_trace(sink, name, parent=None, sample_rate=1.0, kind=SERVER, trusted=False, **attributes):
+    """
+    Starts the local root span of a trace, continuing the trace of a traceparent when one is given. Traces are
+    sampled at sample_rate unless a trusted parent, like the enqueuer of a job, already sampled them, so clients
+    cannot force traces to disk by sending a sampled traceparent.
+    @param sink: JSONLinesSink
+    @param name: String
+    @param parent: String, traceparent
+    @param sample_rate: Float
+    @param kind: Integer
+    @param trusted: Boolean, whether the parent's sampling decision is kept
+    @param attributes: Span attributes
+    @return: Tuple of the span and the token resetting the current span, (None, None) when not sampled
+    """
+    context = parse_traceparent(parent)
+    if (context is None or not trusted) and random.random() >= sample_rate:
+        return None, None
+    trace_id, parent_id = context or (_new_id(128), None)
+    root = Span(Trace(trace_id, sink), name, parent_id, kind, attributes)
+    return root, _current_span.set(root)
+
+
+def end_trace(root, token, error=None):
+    """
+    Ends a local root span and writes its trace.
+    @param root: Span
+    @param token: Token returned by start_trace
+    @param error: String
+    @return: None
+    """
+    _current_span.reset(token)
+    root.error = root.error or error
+    root.finish()
+    root.trace.finished = True
+    root.trace.sink.write(root.trace.spans)
+
+
+def open_span(name, kind=INTERNAL, **attributes):
+    """
+    Starts a child of the current span and makes it current.
+    @param name: String
+    @param kind: Integer
+    @param attributes: Span attributes
+    @return: Tuple of the span and the token resetting the current span, (None, None) when nothing is traced
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return None, None
+    child = Span(parent.trace, name, parent.span_id, kind, attributes)
+    return child, _current_span.set(child)
+
+
+def close_span(child, token, error=None):
+    if child is None:
+        return
+    _current_span.reset(token)
+    child.error = error
+    child.finish()
+
+
+@contextmanager
+def span(name, kind=INTERNAL, **attributes):
+    """
+    Times the with block as a child of the current span. Costs one context variable lookup when nothing is traced.
+    @param name: String
+    @param kind: Integer
+    @param attributes: Span attributes
+    @return: Span or None
+    """
+    child, token = open_span(name, kind, **attributes)
+    if child is None:
+        yield None
+        return
+    try:
+        yield child
+    except BaseException as error:
+        close_span(child, token, repr(error))
+        raise
+    close_span(child, token)
+
+
+@contextmanager
+def continue_trace(name, meta, sample_rate=1.0, **attributes):
+    """
+    Runs an RQ job as the continuation of the trace its enqueuer stored in the job's meta, recording how long the job
+    waited in the queue. Jobs enqueued outside a trace start their own.
+    @param name: String
+    @param meta: Dictionary, the job's meta
+    @param sample_rate: Float
+    @param attributes: Span attributes
+    @return: Span or None
+    """
+    sink = current_app.extensions.get('tracing')
+    if sink is None:
+        yield None
+        return
+    if 'enqueued_at' in meta:
+        attributes['queue.wait_ms'] = round((time() - meta['enqueued_at']) * 1000, 3)
+    root, token = start_trace(sink, name, meta.get('traceparent'), sample_rate, CONSUMER, True, **attributes)
+    if root is None:
+        yield None
+        return
+    try:
+        yield root
+    except BaseException as error:
+        end_trace(root, token, repr(error))
+        raise
+    end_trace(root, token)
+
+
+def trace_redis(client):
+    """
+    Records a span for every command and pipeline sent through the given Redis client.
+    @param client: Redis
+    @return: Redis
+    """
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    def traced_execute_command(*args, **options):
+        with span(f'redis {str(args[0]).split(" ")[0].upper()}', CLIENT):
+            return execute_command(*args, **options)
+
+    def traced_pipeline(*args, **kwargs):
+        traced = pipeline(*args, **kwargs)
+        execute = traced.execute
+
+        def traced_execute(*execute_args, **execute_kwargs):
+            with span('redis pipeline', CLIENT, **{'redis.commands': len(traced.command_stack)}):
+                return execute(*execute_args, **execute_kwargs)
+
+        traced.execute = traced_execute
+        return traced
+
+    client.execute_command = traced_execute_command
+    client.pipeline = traced_pipeline
+    return client
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_span.get() is not None:
+        conn.info.setdefault('trace_spans', []).append(
+            open_span('db query', CLIENT, **{'db.statement': ' '.join(statement.split())[:STATEMENT_LENGTH]}))
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    spans = conn.info.get('trace_spans')
+    if spans:
+        close_span(*spans.pop())
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    spans = context.connection.info.get('trace_spans') if context.connection is not None else None
+    if spans:
+        close_span(*spans.pop(), error=repr(context.original_exception))
+
+
+class Tracer:
+    """
+    Traces every request into TRACE_DIR when it is set: a server span per request, sampled at TRACE_SAMPLE_RATE
+    unless the caller sent a sampled traceparent, with spans for SQL, template rendering and, where the code opens
+    them, Redis, Elasticsearch, mail, translation and job enqueueing. Jobs continue the trace of the request that
+    enqueued them through continue_trace.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        directory = app.config['TRACE_DIR']
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        app.extensions['tracing'] = JSONLinesSink(directory)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.teardown_request(self._teardown_request)
+        before_render_template.connect(self._start_render, app)
+        template_rendered.connect(self._finish_render, app)
+
+    @staticmethod
+    def _start_request():
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        g.trace = start_trace(current_app.extensions['tracing'], f'{request.method} {rule}',
+                              request.headers.get('traceparent'), current_app.config['TRACE_SAMPLE_RATE'],
+                              **{'http.method': request.method, 'http.route': rule,
+                                 'flask.endpoint': request.endpoint or ''})
+
+    @staticmethod
+    def _finish_request(response):
+        root = g.get('trace', (None, None))[0]
+        if root is not None:
+            root.attributes['http.status_code'] = response.status_code
+            if response.status_code >= 500:
+                root.error = response.status
+        return response
+
+    @staticmethod
+    def _teardown_request(exception=None):
+        root, token = g.pop('trace', (None, None))
+        if root is None:
+            return
+        for child, child_token in reversed(g.pop('trace_renders', [])):
+            close_span(child, child_token, 'not rendered')
+        end_trace(root, token, repr(exception) if exception is not None else None)
+
+    @staticmethod
+    def _start_render(sender, template, context, **extra):
+        child, token = open_span(f'render {template.name}')
+        if child is not None:
+            g.setdefault('trace_renders', []).append((child, token))
+
+    @staticmethod
+    def _finish_render(sender, template, context, **extra):
+        renders = g.get('trace_renders')
+        if renders:
+            close_span(*renders.pop())
+
+
+def read_traces(directory):
+    """
+    Loads the spans of every trace file in a directory.
+    @param directory: String
+    @return: Dictionary of trace id to a list of span dictionaries with plain attributes
+    """
+    traces = {}
+    for path in sorted(glob.glob(os.path.join(directory, 'traces-*.jsonl'))):
+        with open(path) as f:
+            for line in f:
+                try:
+                    batch = json.loads(line)
+                except ValueError:
+                    continue
+                for resource in batch['resourceSpans']:
+                    for scope in resource['scopeSpans']:
+                        for raw in scope['spans']:
+                            traces.setdefault(raw['traceId'], []).append({
+                                'id': raw['spanId'],
+                                'parent': raw.get('parentSpanId'),
+                                'name': raw['name'],
+                                'kind': raw.get('kind', INTERNAL),
+                                'start': int(raw['startTimeUnixNano']),
+                                'end': int(raw['endTimeUnixNano']),
+                                'error': raw.get('status', {}).get('message'),
+                                'attributes': {item['key']: _plain_value(item['value'])
+                                               for item in raw.get('attributes', ())},
+                            })
+    return traces
+
+
+def summarize(spans):
+    """
+    Summarizes one trace: its wall time, its root, the time waiting in the queue and the self time of its spans,
+    the duration not covered by their children, per kind of work (view, db, redis, render, mail, job...).
+    @param spans: List of span dictionaries from read_traces
+    @return: Dictionary
+    """
+    ids = {span['id'] for span in spans}
+    children = {}
+    for span in spans:
+        children.setdefault(span['parent'], []).append(span)
+    breakdown = {}
+    for span in spans:
+        covered = sum(child['end'] - child['start'] for child in children.get(span['id'], ()))
+        own = span['end'] - span['start'] - covered
+        work = 'view' if span['kind'] == SERVER else span['name'].split(' ')[0]
+        breakdown[work] = breakdown.get(work, 0) + max(own, 0) / 1e6
+    roots = [span for span in spans if span['parent'] not in ids]
+    root = min(roots or spans, key=lambda span: span['start'])
+    return {
+        'name': root['name'],
+        'duration_ms': (max(span['end'] for span in spans) - min(span['start'] for span in spans)) / 1e6,
+        'spans': len(spans),
+        'errors': sum(1 for span in spans if span['error']),
+        'queue_ms': sum(span['attributes'].get('queue.wait_ms', 0) for span in spans),
+        'breakdown_ms': dict(sorted(breakdown.items(), key=lambda item: item[1], reverse=True)),
+    }
+
+
+def slowest_traces(directory, limit=10):
+    """
+    @param directory: String
+    @param limit: Integer
+    @return: List of trace summaries, slowest first
+    """
+    summaries = [dict(summarize(spans), trace_id=trace_id) for trace_id, spans in read_traces(directory).items()]
+    return sorted(summaries, key=lambda summary: summary['duration_ms'], reverse=True)[:limit]
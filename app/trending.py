@@ -0,0 +1,166 @@
+""" Trending posts, authors and terms from time bucketed count-min sketches and heavy hitters kept in Redis. """
+import hashlib
+import re
+from time import time
+
+from flask import current_app
+from redis.exceptions import RedisError
+
+from app import db
+from app.models import Post, User
+
+# Window name to (bucket length in seconds, number of buckets).
+WINDOWS = {'hour': (300, 12), 'day': (3600, 24)}
+KINDS = ('post', 'author', 'term')
+STOP_WORDS = frozenset(
+    'about after again all also and any are because been before but can could did does for from had has have her '
+    'here him his how into its just like more most not now off only our out over she should some than that the '
+    'their them then there these they this too very was were what when where which who why will with would you '
+    'your'.split())
+TERM_PATTERN = re.compile(r'\w{3,}')
+
+
+def terms(text):
+    """
+    Returns the distinct lower cased words of a text worth trending, without stop words and numbers.
+    @param text: String
+    @return: List of strings
+    """
+    words = (word for word in TERM_PATTERN.findall(text.lower()) if word not in STOP_WORDS and not word.isdigit())
+    return list(dict.fromkeys(words))
+
+
+class Trending:
+    """
+    Every event adds to a count-min sketch per kind and time bucket, a fixed width x depth grid of counters stored as
+    one Redis hash, so memory does not grow with the number of distinct items. The estimate read back from the sketch
+    ranks the item in a sorted set holding that bucket's TRENDING_TOP_K heavy hitters. Buckets expire once they leave
+    the longest window. Reading a window merges the heavy hitters of its buckets and never touches the database.
+    """
+
+    @staticmethod
+    def enabled():
+        return current_app.config['TRENDING_ENABLED']
+
+    @staticmethod
+    def _sketch_key(kind, window, bucket):
+        return f'trending:{kind}:{window}:{bucket}:sketch'
+
+    @staticmethod
+    def _top_key(kind, window, bucket):
+        return f'trending:{kind}:{window}:{bucket}:top'
+
+    @staticmethod
+    def _cells(item, width, depth):
+        digest = hashlib.blake2b(str(item).encode('utf-8'), digest_size=4 * depth).digest()
+        return [f'{row}:{int.from_bytes(digest[4 * row:4 * row + 4], "big") % width}' for row in range(depth)]
+
+    def record(self, events, now=None):
+        """
+        Counts a batch of events in two pipelined round trips, one for the sketches and one for the heavy hitters.
+        @param events: List of (kind, item) tuples
+        @param now: Float, unix time of the events
+        @return: None
+        """
+        if not self.enabled() or not events:
+            return
+        config = current_app.config
+        width, depth, top_k = config['TRENDING_SKETCH_WIDTH'], config['TRENDING_SKETCH_DEPTH'], config['TRENDING_TOP_K']
+        now = time() if now is None else now
+        redis = current_app.redis
+        try:
+            pipeline = redis.pipeline(transaction=False)
+            counted = []
+            for window, (length, count) in WINDOWS.items():
+                bucket = int(now // length)
+                for kind, item in events:
+                    for cell in self._cells(item, width, depth):
+                        pipeline.hincrby(self._sketch_key(kind, window, bucket), cell, 1)
+                    counted.append((kind, window, bucket, length * (count + 1), item))
+            results = pipeline.execute()
+            pipeline = redis.pipeline(transaction=False)
+            buckets = {}
+            for i, (kind, window, bucket, ttl, item) in enumerate(counted):
+                pipeline.zadd(self._top_key(kind, window, bucket), {item: min(results[i * depth:(i + 1) * depth])})
+                buckets[kind, window, bucket] = ttl
+            for (kind, window, bucket), ttl in buckets.items():
+                pipeline.zremrangebyrank(self._top_key(kind, window, bucket), 0, -top_k - 1)
+                pipeline.expire(self._top_key(kind, window, bucket), ttl)
+                pipeline.expire(self._sketch_key(kind, window, bucket), ttl)
+            pipeline.execute()
+        except RedisError:
+            current_app.logger.warning('Could not record trending events', exc_info=True)
+
+    def record_post(self, post_id, author_id, body, now=None):
+        self.record([('post', post_id), ('author', author_id)] + [('term', term) for term in terms(body)], now)
+
+    def record_search(self, text, post_ids, now=None):
+        self.record([('term', term) for term in terms(text)] + [('post', post_id) for post_id in post_ids], now)
+
+    def top(self, kind, window, k=10, now=None):
+        """
+        Returns the k items with the most activity in the window, merging the heavy hitters of its buckets.
+        @param kind: String, one of KINDS
+        @param window: String, one of WINDOWS
+        @param k: Integer
+        @param now: Float
+        @return: List of (item, estimated count) tuples, top first
+        """
+        if not self.enabled():
+            return []
+        length, count = WINDOWS[window]
+        last = int((time() if now is None else now) // length)
+        top_k = current_app.config['TRENDING_TOP_K']
+        pipeline = current_app.redis.pipeline(transaction=False)
+        for bucket in range(last - count + 1, last + 1):
+            pipeline.zrevrange(self._top_key(kind, window, bucket), 0, top_k - 1, withscores=True)
+        try:
+            buckets = pipeline.execute()
+        except RedisError:
+            return []
+        totals = {}
+        for members in buckets:
+            for member, score in members:
+                member = member.decode('utf-8')
+                totals[member] = totals.get(member, 0) + int(score)
+        top = sorted(totals.items(), key=lambda item: (-item[1], item[0]))[:k]
+        return [(int(item) if kind != 'term' else item, score) for item, score in top]
+
+    def snapshot(self, window, k=10):
+        """
+        Returns the trending posts, authors and terms of a window, resolving ids with two primary key lookups.
+        @param window: String, one of WINDOWS
+        @param k: Integer
+        @return: Dictionary with posts, authors and terms lists of (item, estimated count) tuples
+        """
+        now = time()
+        snapshot = {'terms': self.top('term', window, k, now)}
+        for kind, model in (('post', Post), ('author', User)):
+            top = self.top(kind, window, k, now)
+            ids = [id for id, _ in top]
+            objects = {obj.id: obj for obj in model.query.filter(model.id.in_(ids))} if ids else {}
+            snapshot[kind + 's'] = [(objects[id], score) for id, score in top if id in objects]
+        return snapshot
+
+
+trending = Trending()
+
+
+def collect_new_posts(session, flush_context):
+    if trending.enabled():
+        session.info.setdefault('trending_posts', []).extend(
+            (obj.id, obj.user_id, obj.body) for obj in session.new if isinstance(obj, Post))
+
+
+def record_new_posts(session):
+    for post_id, author_id, body in session.info.pop('trending_posts', ()):
+        trending.record_post(post_id, author_id, body)
+
+
+def forget_new_posts(session):
+    session.info.pop('trending_posts', None)
+
+
+db.event.listen(db.session, 'after_flush', collect_new_posts)
+db.event.listen(db.session, 'after_commit', record_new_posts)
+db.event.listen(db.session, 'after_rollback', forget_new_posts)
@@ -0,0 +1,386 @@
+""" In-process stand-ins for the external services, so the whole app can run without a network. """
+import fnmatch
+import threading
+import unicodedata
+import uuid
+from collections import deque
+from time import time
+
+from flask_mail import Message
+from redis.exceptions import ResponseError
+
+
+class FakeRedis:
+    """ Thread-safe in-memory subset of the redis-py client covering the commands the app sends. """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._data = {}
+        self._expiry = {}
+
+    def _get(self, key, default=None):
+        if key in self._expiry and self._expiry[key] <= time():
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+        return self._data.get(key, default)
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+    def ping(self):
+        return True
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def mget(self, keys, *args):
+        with self._lock:
+            return [self._get(key) for key in (list(keys) + list(args) if args else keys)]
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._get(key) is not None:
+                return None
+            self._data[key] = self._encode(value)
+            self._expiry.pop(key, None)
+            if ex:
+                self._expiry[key] = time() + ex
+            return True
+
+    def setex(self, key, time_to_live, value):
+        return self.set(key, value, ex=time_to_live)
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            value = int(self._get(key, b'0')) + amount
+            self._data[key] = self._encode(value)
+            return value
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if self._get(key) is None:
+                return False
+            self._expiry[key] = time() + seconds
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                self._expiry.pop(key, None)
+                removed += self._data.pop(key, None) is not None
+            return removed
+
+    def exists(self, *keys):
+        with self._lock:
+            return sum(self._get(key) is not None for key in keys)
+
+    def keys(self, pattern='*'):
+        with self._lock:
+            return [key.encode('utf-8') if isinstance(key, str) else key for key in list(self._data)
+                    if self._get(key) is not None and fnmatch.fnmatchcase(str(key), pattern)]
+
+    def hget(self, key, field):
+        with self._lock:
+            return self._get(key, {}).get(self._encode(field))
+
+    def hgetall(self, key):
+        with self._lock:
+            return dict(self._get(key, {}))
+
+    def hset(self, key, field=None, value=None, mapping=None):
+        with self._lock:
+            hash_ = self._data.setdefault(key, {})
+            items = dict(mapping or {})
+            if field is not None:
+                items[field] = value
+            for name, item in items.items():
+                hash_[self._encode(name)] = self._encode(item)
+            return len(items)
+
+    def scan_iter(self, match='*', count=None):
+        return iter(self.keys(match))
+
+    def sadd(self, key, *members):
+        with self._lock:
+            set_ = self._data.setdefault(key, set())
+            before = len(set_)
+            set_.update(self._encode(member) for member in members)
+            return len(set_) - before
+
+    def srem(self, key, *members):
+        with self._lock:
+            set_ = self._get(key, set())
+            before = len(set_)
+            set_.difference_update(self._encode(member) for member in members)
+            return before - len(set_)
+
+    def sismember(self, key, member):
+        with self._lock:
+            return self._encode(member) in self._get(key, set())
+
+    def smismember(self, key, members, *args):
+        with self._lock:
+            set_ = self._get(key, set())
+            return [int(self._encode(member) in set_) for member in (list(members) + list(args) if args else members)]
+
+    def rpush(self, key, *values):
+        with self._lock:
+            list_ = self._data.setdefault(key, [])
+            list_.extend(self._encode(value) for value in values)
+            return len(list_)
+
+    def lrange(self, key, start, end):
+        with self._lock:
+            list_ = self._get(key, [])
+            return list_[start:len(list_) if end == -1 else end + 1]
+
+    def scard(self, key):
+        with self._lock:
+            return len(self._get(key, set()))
+
+    def smembers(self, key):
+        with self._lock:
+            return set(self._get(key, set()))
+
+    def hmget(self, key, keys, *args):
+        with self._lock:
+            hash_ = self._get(key, {})
+            return [hash_.get(self._encode(field)) for field in (list(keys) + list(args) if args else keys)]
+
+    def hincrby(self, key, field, amount=1):
+        with self._lock:
+            hash_ = self._data.setdefault(key, {})
+            value = int(hash_.get(self._encode(field), b'0')) + amount
+            hash_[self._encode(field)] = self._encode(value)
+            return value
+
+    def hdel(self, key, *fields):
+        with self._lock:
+            hash_ = self._get(key, {})
+            return sum(hash_.pop(self._encode(field), None) is not None for field in fields)
+
+    def hexists(self, key, field):
+        with self._lock:
+            return self._encode(field) in self._get(key, {})
+
+    def decr(self, key, amount=1):
+        return self.incr(key, -amount)
+
+    @staticmethod
+    def _range(items, start, end):
+        length = len(items)
+        start = max(start + length if start < 0 else start, 0)
+        end = end + length if end < 0 else end
+        return items[start:end + 1] if end >= 0 else []
+
+    def _sorted(self, key):
+        return sorted(self._get(key, {}).items(), key=lambda item: (item[1], item[0]))
+
+    def zadd(self, key, mapping):
+        with self._lock:
+            zset = self._data.setdefault(key, {})
+            added = 0
+            for member, score in mapping.items():
+                added += self._encode(member) not in zset
+                zset[self._encode(member)] = float(score)
+            return added
+
+    def zrem(self, key, *members):
+        with self._lock:
+            zset = self._get(key, {})
+            return sum(zset.pop(self._encode(member), None) is not None for member in members)
+
+    def zcard(self, key):
+        with self._lock:
+            return len(self._get(key, {}))
+
+    def zrange(self, key, start, end, withscores=False):
+        with self._lock:
+            items = self._range(self._sorted(key), start, end)
+            return items if withscores else [member for member, _ in items]
+
+    def zrevrange(self, key, start, end, withscores=False):
+        with self._lock:
+            items = self._range(self._sorted(key)[::-1], start, end)
+            return items if withscores else [member for member, _ in items]
+
+    def zremrangebyrank(self, key, start, end):
+        with self._lock:
+            zset = self._get(key, {})
+            members = [member for member, _ in self._range(self._sorted(key), start, end)]
+            for member in members:
+                del zset[member]
+            return len(members)
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+            self._expiry.clear()
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def transaction(self, func, *watches, **kwargs):
+        """ Runs func on a pipeline holding the lock throughout, so the watched keys can not change under it. """
+        with self._lock:
+            pipeline = self.pipeline()
+            pipeline.watch(*watches)
+            func(pipeline)
+            return pipeline.execute()
+
+    def register_script(self, script):
+        return FakeScript(self)
+
+
+class FakeScript:
+    """ Lua does not run in process, so calling a script fails the way a server refusing scripts would. """
+
+    def __init__(self, redis):
+        self.registered_client = redis
+
+    def __call__(self, keys=(), args=(), client=None):
+        raise ResponseError('FakeRedis does not run Lua scripts')
+
+
+class FakePipeline:
+    """
+    Buffers calls and replays them against the FakeRedis under one lock on execute. Between watch and multi calls run
+    at once, as on a redis-py pipeline watching keys.
+    """
+
+    def __init__(self, redis):
+        self._redis = redis
+        self._calls = []
+        self._watching = False
+
+    def watch(self, *keys):
+        self._watching = True
+
+    def multi(self):
+        self._watching = False
+
+    def __getattr__(self, name):
+        method = getattr(self._redis, name)
+        if self._watching:
+            return method
+
+        def buffered(*args, **kwargs):
+            self._calls.append((method, args, kwargs))
+            return self
+        return buffered
+
+    def execute(self):
+        with self._redis._lock:
+            results = [method(*args, **kwargs) for method, args, kwargs in self._calls]
+        self._calls = []
+        return results
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._calls = []
+
+
+class FakeJob:
+    def __init__(self, func_name, args, kwargs, id=None):
+        self.id = id or str(uuid.uuid4())
+        self.func_name = func_name
+        self.args = args
+        self.kwargs = kwargs
+        self.meta = {}
+
+    def get_id(self):
+        return self.id
+
+    def save_meta(self):
+        pass
+
+
+class FakeQueue:
+    """ RQ queue stand-in whose jobs run on a background thread inside the given app's context. """
+
+    name = 'easyblogbd-tasks'
+
+    def __init__(self, app, run_jobs=True):
+        self._app = app
+        self._jobs = deque()
+        self._condition = threading.Condition()
+        self.completed = []
+        if run_jobs:
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def enqueue(self, func_name, *args, job_id=None, meta=None, **kwargs):
+        job = FakeJob(func_name, args, kwargs, job_id)
+        job.meta.update(meta or {})
+        with self._condition:
+            self._jobs.append(job)
+            self._condition.notify()
+        return job
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._jobs:
+                    self._condition.wait()
+                job = self._jobs.popleft()
+            module_name, _, function_name = job.func_name.rpartition('.')
+            with self._app.app_context():
+                function = getattr(__import__(module_name, fromlist=[function_name]), function_name)
+                function(*job.args, **job.kwargs)
+            self.completed.append(job)
+
+
+class CapturingMail:
+    """ Mail extension stand-in keeping every message instead of sending it. """
+
+    def __init__(self):
+        self.outbox = []
+
+    def send(self, message):
+        self.outbox.append(message)
+
+    def send_message(self, *args, **kwargs):
+        self.send(Message(*args, **kwargs))
+
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class FakeTranslator:
+    """ Deterministic translator detecting Bengali script and tagging translated text with its target language. """
+
+    @staticmethod
+    def detect(text):
+        bengali = any(unicodedata.name(character, '').startswith('BENGALI') for character in text)
+        return _Result(lang='bn' if bengali else 'en', confidence=1.0)
+
+    @staticmethod
+    def translate(text, dest='en', src='auto'):
+        return _Result(text=f'[{dest}] {text}', src=src, dest=dest)
+
+
+def install_fakes(app, run_jobs=True):
+    """
+    Replaces every external client of the app with its in-process stand-in.
+    @param app: Flask app
+    @param run_jobs: Boolean, whether queued tasks run on a background worker thread
+    @return: Flask app
+    """
+    from app.search import LocalSearch
+    app.redis = FakeRedis()
+    app.task_queue = FakeQueue(app, run_jobs)
+    app.translator = FakeTranslator()
+    app.elasticsearch = LocalSearch()
+    app.extensions['mail'] = CapturingMail()
+    return app
@@ -0,0 +1,220 @@
+""" Concurrent load test of the full app with every external service replaced by an in-process fake.
+
+Boots create_app on a seeded SQLite file behind a threaded WSGI server and lets many simulated users browse, post,
+follow, message, poll notifications and call the API at the same time:
+    python -m benchmarks.load --clients 32 --duration 60 --output load.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+from collections import defaultdict
+from time import perf_counter
+
+import requests
+from werkzeug.serving import make_server
+
+from app import create_app, db
+from app.models import Post
+from app.seed import SEED_PASSWORD, seed_graph
+from benchmarks.fakes import install_fakes
+from benchmarks.run import BenchmarkConfig
+
+
+class LoadTestConfig(BenchmarkConfig):
+    MAIL_SUPPRESS_SEND = False
+
+
+class Client:
+    """ One simulated user with its own session, API token and random stream. """
+
+    def __init__(self, base_url, user_id, users, seed):
+        self.base_url = base_url
+        self.user_id = user_id
+        self.users = users
+        self.rng = random.Random(f'{seed}:{user_id}')
+        self.session = requests.Session()
+        self.since = 0
+        self.results = []
+        self.session.post(f'{base_url}/auth/login', data={'username': f'user{user_id}', 'password': SEED_PASSWORD})
+        token = self.session.post(f'{base_url}/api/tokens', auth=(f'user{user_id}', SEED_PASSWORD)).json()['token']
+        self.api_headers = {'Authorization': f'Bearer {token}'}
+
+    def other_user(self):
+        return self.rng.randint(1, self.users)
+
+    def request(self, name, method, path, **kwargs):
+        start = perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, allow_redirects=False, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 599
+        self.results.append((name, perf_counter() - start, status))
+        return response
+
+    def browse_index(self):
+        self.request('index', 'GET', f'/index?page={self.rng.randint(1, 3)}')
+
+    def browse_explore(self):
+        self.request('explore', 'GET', f'/explore?page={self.rng.randint(1, 5)}')
+
+    def browse_profile(self):
+        self.request('profile', 'GET', f'/profile/user{self.other_user()}')
+
+    def profile_popup(self):
+        self.request('profile_popup', 'GET', f'/profile/user{self.other_user()}/popup')
+
+    def post(self):
+        self.request('post', 'POST', '/index', data={'post': f'load test post {self.rng.random()}'})
+
+    def follow(self):
+        action = self.rng.choice(('follow', 'unfollow'))
+        self.request(action, 'POST', f'/{action}/user{self.other_user()}', data={})
+
+    def send_message(self):
+        self.request('send_message', 'POST', f'/send_message/user{self.other_user()}',
+                     data={'message': 'hello from the load test'})
+
+    def read_messages(self):
+        self.request('messages', 'GET', '/messages')
+
+    def poll_notifications(self):
+        response = self.request('notifications', 'GET', f'/notifications?since={self.since}')
+        if response is not None and response.ok and response.json():
+            self.since = response.json()[-1]['timestamp']
+
+    def search(self):
+        self.request('search', 'GET', '/search', params={'q': self.rng.choice(('python', 'tea rain', 'cricket'))})
+
+    def translate(self):
+        self.request('translate', 'POST', '/translate',
+                     json={'text': 'hello', 'dest_language': 'bn', 'source_language': 'en'})
+
+    def api_users(self):
+        self.request('api.get_users', 'GET', f'/api/users?page={self.rng.randint(1, 5)}', headers=self.api_headers)
+
+    def api_user(self):
+        self.request('api.get_user', 'GET', f'/api/users/{self.other_user()}', headers=self.api_headers)
+
+    def api_followers(self):
+        self.request('api.get_followers', 'GET', f'/api/users/{self.other_user()}/followers',
+                     headers=self.api_headers)
+
+    def export_posts(self):
+        self.request('export_posts', 'GET', '/export_posts')
+
+
+MIX = {
+    Client.poll_notifications: 30,
+    Client.browse_index: 15,
+    Client.browse_explore: 10,
+    Client.browse_profile: 10,
+    Client.profile_popup: 10,
+    Client.api_user: 4,
+    Client.api_users: 3,
+    Client.api_followers: 3,
+    Client.post: 4,
+    Client.follow: 3,
+    Client.search: 3,
+    Client.send_message: 2,
+    Client.read_messages: 1,
+    Client.translate: 1,
+    Client.export_posts: 1,
+}
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)]
+
+
+def report(results, elapsed):
+    """
+    Aggregates (endpoint, seconds, status) samples into throughput and latency percentiles per endpoint.
+    @param results: List of tuples
+    @param elapsed: Float
+    @return: Dictionary
+    """
+    by_endpoint = defaultdict(list)
+    errors = defaultdict(int)
+    for name, seconds, status in results:
+        by_endpoint[name].append(seconds)
+        errors[name] += status >= 500
+    endpoints = {}
+    for name, latencies in sorted(by_endpoint.items()):
+        latencies.sort()
+        endpoints[name] = {
+            'requests': len(latencies),
+            'errors': errors[name],
+            'throughput_rps': len(latencies) / elapsed,
+            'p50_ms': statistics.median(latencies) * 1000,
+            'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000,
+        }
+    return {'requests': len(results), 'elapsed_s': elapsed, 'throughput_rps': len(results) / elapsed,
+            'endpoints': endpoints}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clients', type=int, default=16, help='concurrent simulated users')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of traffic')
+    parser.add_argument('--users', type=int, default=500, help='seeded users, must be at least --clients')
+    parser.add_argument('--posts-per-user', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    database = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'load.db')
+    flask_app = install_fakes(create_app(type('Config', (LoadTestConfig,), {'SQLALCHEMY_DATABASE_URI': database})))
+    with flask_app.app_context():
+        db.create_all()
+        seed_graph(db.engine, max(args.users, args.clients), posts_per_user=args.posts_per_user, seed=args.seed)
+        Post.reindex()
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, flask_app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+
+    clients = [Client(base_url, user_id, args.users, args.seed) for user_id in range(1, args.clients + 1)]
+    actions, weights = list(MIX), list(MIX.values())
+    deadline = perf_counter() + args.duration
+
+    def drive(client):
+        while perf_counter() < deadline:
+            client.rng.choices(actions, weights)[0](client)
+
+    start = perf_counter()
+    threads = [threading.Thread(target=drive, args=(client,)) for client in clients]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+    server.shutdown()
+
+    results = report([result for client in clients for result in client.results], elapsed)
+    results['clients'] = args.clients
+    results['emails_captured'] = len(flask_app.extensions['mail'].outbox)
+    results['jobs_completed'] = len(flask_app.task_queue.completed)
+    for name, endpoint in results['endpoints'].items():
+        print(f'{name:20} {endpoint["requests"]:6d} req {endpoint["errors"]:4d} err  p50 {endpoint["p50_ms"]:8.1f}ms  '
+              f'p95 {endpoint["p95_ms"]:8.1f}ms  p99 {endpoint["p99_ms"]:8.1f}ms', file=sys.stderr)
+    print(f'total {results["requests"]} requests, {results["throughput_rps"]:.1f} req/s', file=sys.stderr)
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
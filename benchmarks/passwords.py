@@ -0,0 +1,84 @@
+""" Measures logins per second per core for password hash methods, verifying alone and through POST /api/tokens.
+
+    python -m benchmarks.passwords --methods pbkdf2:sha256:260000 pbkdf2:sha256:600000 --logins 50
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app import create_app, db
+from app.models import User
+from benchmarks.run import BenchmarkConfig
+
+PASSWORD = 'correct horse battery staple'
+
+
+def verify_rate(method, logins, threads):
+    """
+    @param method: String
+    @param logins: Integer, verifications per thread
+    @param threads: Integer
+    @return: Float, verifications per second per thread
+    """
+    password_hash = generate_password_hash(PASSWORD, method)
+
+    def verify(_):
+        for _ in range(logins):
+            check_password_hash(password_hash, PASSWORD)
+
+    start = perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(verify, range(threads)))
+    return logins * threads / (perf_counter() - start) / threads
+
+
+def login_rate(method, logins):
+    """
+    Logs in through the API with basic auth, the hash verified on the app's password pool.
+    @param method: String
+    @param logins: Integer
+    @return: Float, logins per second, one at a time
+    """
+    database = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'passwords.db')
+    app = create_app(type('Config', (BenchmarkConfig,), {
+        'PASSWORD_HASH_METHOD': method, 'RATE_LIMIT_ENABLED': False, 'SQLALCHEMY_DATABASE_URI': database}))
+    with app.app_context():
+        db.create_all()
+        user = User(username='bench', email='bench@example.com')
+        user.set_password(PASSWORD)
+        db.session.add(user)
+        db.session.commit()
+        client = app.test_client()
+        headers = {'Authorization': 'Basic ' + base64.b64encode(f'bench:{PASSWORD}'.encode()).decode()}
+        start = perf_counter()
+        for _ in range(logins):
+            assert client.post('/api/tokens', headers=headers).status_code == 200
+        return logins / (perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--methods', nargs='+', default=['pbkdf2:sha256:260000', BenchmarkConfig.PASSWORD_HASH_METHOD])
+    parser.add_argument('--logins', type=int, default=50)
+    parser.add_argument('--threads', type=int, default=os.cpu_count())
+    args = parser.parse_args(argv)
+
+    results = {method: {
+        'verify_per_core': verify_rate(method, args.logins, 1),
+        f'verify_per_core_{args.threads}_threads': verify_rate(method, args.logins, args.threads),
+        'api_logins_per_core': login_rate(method, args.logins),
+    } for method in args.methods}
+    print(json.dumps(results, indent=2))
+    for method, result in results.items():
+        print(f'{method:28} ' + '  '.join(f'{name} {value:8.1f}/s' for name, value in result.items()), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
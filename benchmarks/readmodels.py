@@ -0,0 +1,84 @@
+""" Loads and renders one big page of posts through the ORM and through the read models, comparing time and memory.
+
+    python -m benchmarks.readmodels --rows 10000 --iterations 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import tracemalloc
+from time import perf_counter
+
+from flask import g, render_template_string
+
+from app import create_app, db
+from app.models import Post
+from app.readmodels import latest_posts
+from app.seed import seed_graph
+from benchmarks.run import BenchmarkConfig
+
+PAGE = "{% for post in posts %}{% include '_post.html' %}{% endfor %}"
+
+
+def orm_page(rows):
+    return Post.query.options(db.joinedload(Post.author)).order_by(Post.id.desc()).limit(rows).all()
+
+
+def row_page(rows):
+    return latest_posts(rows)
+
+
+def measure(load, rows, iterations):
+    """
+    @param load: Function returning the posts of the page
+    @param rows: Integer
+    @param iterations: Integer
+    @return: Dictionary with the median load and render times and the peak memory of one load
+    """
+    load_times, render_times = [], []
+    for _ in range(iterations):
+        db.session.expunge_all()
+        start = perf_counter()
+        posts = load(rows)
+        load_times.append(perf_counter() - start)
+        start = perf_counter()
+        render_template_string(PAGE, posts=posts)
+        render_times.append(perf_counter() - start)
+    db.session.expunge_all()
+    tracemalloc.start()
+    posts = load(rows)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'rows': len(posts),
+        'load_ms': statistics.median(load_times) * 1000,
+        'render_ms': statistics.median(render_times) * 1000,
+        'peak_kib': peak / 1024,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--iterations', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    database = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'readmodels.db')
+    app = create_app(type('Config', (BenchmarkConfig,), {'SQLALCHEMY_DATABASE_URI': database}))
+    with app.test_request_context():
+        g.locale = 'en'
+        db.create_all()
+        seed_graph(db.engine, args.rows // 10 + 1, 10, 10, 0, args.seed)
+        results = {name: measure(load, args.rows, args.iterations)
+                   for name, load in (('orm', orm_page), ('read_model', row_page))}
+    print(json.dumps(results, indent=2))
+    for metric in ('load_ms', 'render_ms', 'peak_kib'):
+        print(f'{metric:10} orm {results["orm"][metric]:10.1f}  read model {results["read_model"][metric]:10.1f}  '
+              f'{results["orm"][metric] / results["read_model"][metric]:5.1f}x', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+""" Reproducible benchmarks for the hot read paths.
+
+Seed a scratch database and time every scenario:
+    python -m benchmarks.run --users 2000 --output baseline.json
+Fail when a scenario's median regressed more than 15% against a previous run:
+    python -m benchmarks.run --users 2000 --compare baseline.json --threshold 0.15
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+from time import perf_counter
+
+from app import create_app, db, tasks
+from app.models import Post, User
+from app.seed import seed_graph
+from config import Config
+
+SCENARIOS = {}
+
+
+class BenchmarkConfig(Config):
+    ELASTICSEARCH_URL = None
+    MAIL_SUPPRESS_SEND = True
+    SEARCH_BACKEND = 'local'
+    SQL_PROFILING = False
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+class Bench:
+    """ Shared state handed to every scenario. """
+
+    def __init__(self, app, users):
+        self.app = app
+        self.users = users
+        self.per_page = app.config['POSTS_PER_PAGE']
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['_user_id'] = '1'
+            session['_fresh'] = True
+        self._next_user = 0
+
+    def next_user_id(self):
+        """
+        Cycles through the 50 most followed users so repeated iterations do not hit the same rows.
+        @return: Integer
+        """
+        self._next_user = self._next_user % min(self.users, 50) + 1
+        return self._next_user
+
+    def get(self, url):
+        response = self.client.get(url)
+        assert response.status_code == 200, f'{url} returned {response.status_code}'
+        return response
+
+
+@scenario('followed_posts')
+def followed_posts(bench):
+    User.query.get(bench.next_user_id()).followed_posts().paginate(1, bench.per_page, False)
+
+
+@scenario('explore_first_page')
+def explore_first_page(bench):
+    bench.get('/explore')
+
+
+@scenario('explore_deep_page')
+def explore_deep_page(bench):
+    bench.get(f'/explore?page={max(Post.query.count() // bench.per_page // 2, 1)}')
+
+
+@scenario('profile_page')
+def profile_page(bench):
+    bench.get(f'/profile/user{bench.next_user_id()}?page=2')
+
+
+@scenario('to_collection_dict')
+def to_collection_dict(bench):
+    with bench.app.test_request_context():
+        User.to_collection_dict(User.query, 1, 100, 'api.get_users')
+
+
+@scenario('post_search')
+def post_search(bench):
+    posts, _ = Post.search('python tea river', 1, bench.per_page)
+    posts.all()
+
+
+@scenario('export_posts')
+def export_posts(bench):
+    tasks.export_posts(bench.next_user_id())
+
+
+@scenario('notification_polling')
+def notification_polling(bench):
+    bench.get('/notifications?since=0')
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'iterations': len(timings),
+        'min_ms': timings[0] * 1000,
+        'median_ms': statistics.median(timings) * 1000,
+        'mean_ms': statistics.fmean(timings) * 1000,
+        'p95_ms': timings[min(int(len(timings) * 0.95), len(timings) - 1)] * 1000,
+    }
+
+
+def run(bench, names, iterations, warmup):
+    results = {}
+    for name in names:
+        for _ in range(warmup):
+            SCENARIOS[name](bench)
+        timings = []
+        for _ in range(iterations):
+            start = perf_counter()
+            SCENARIOS[name](bench)
+            timings.append(perf_counter() - start)
+        db.session.remove()
+        results[name] = summarize(timings)
+        print(f'{name:24} median {results[name]["median_ms"]:9.3f}ms  p95 {results[name]["p95_ms"]:9.3f}ms',
+              file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns the scenarios whose median got slower than the baseline by more than threshold.
+    @param results: Dictionary
+    @param baseline: Dictionary
+    @param threshold: Float
+    @return: List of (name, baseline_ms, current_ms) tuples
+    """
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline['scenarios'].get(name)
+        if previous and current['median_ms'] > previous['median_ms'] * (1 + threshold):
+            regressions.append((name, previous['median_ms'], current['median_ms']))
+    return regressions
+
+
+def prepare_database(args):
+    db.create_all()
+    if args.reseed:
+        db.drop_all()
+        db.create_all()
+    if User.query.first() is None:
+        start = perf_counter()
+        counts = seed_graph(db.engine, args.users, args.mean_follows, args.posts_per_user, args.messages_per_user,
+                            args.seed)
+        print(f'seeded {counts} in {perf_counter() - start:.1f}s', file=sys.stderr)
+    Post.reindex()
+    return User.query.count()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', help='database URL, defaults to a fresh SQLite file')
+    parser.add_argument('--reseed', action='store_true', help='drop and reseed an existing database')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--mean-follows', type=int, default=20)
+    parser.add_argument('--posts-per-user', type=int, default=10)
+    parser.add_argument('--messages-per-user', type=int, default=2)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help='run only these scenarios')
+    parser.add_argument('--output', help='write the JSON results to this file instead of stdout')
+    parser.add_argument('--compare', help='baseline JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='allowed median slowdown, 0.1 means 10%%')
+    args = parser.parse_args(argv)
+
+    database = args.database or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'benchmark.db')
+    app = create_app(type('Config', (BenchmarkConfig,), {'SQLALCHEMY_DATABASE_URI': database}))
+    with app.app_context():
+        users = prepare_database(args)
+        results = {
+            'meta': {
+                'database': db.engine.url.get_backend_name(),
+                'users': users,
+                'posts': Post.query.count(),
+                'seed': args.seed,
+                'python': platform.python_version(),
+                'iterations': args.iterations,
+            },
+            'scenarios': run(Bench(app, users), args.scenario or list(SCENARIOS), args.iterations, args.warmup),
+        }
+
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.threshold)
+        for name, previous, current in regressions:
+            print(f'REGRESSION {name}: {previous:.3f}ms -> {current:.3f}ms', file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
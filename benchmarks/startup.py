@@ -0,0 +1,60 @@
+""" Cold start benchmark of create_app, with an audit of the heavy modules it imports.
+
+Every run starts a fresh interpreter, so import time is included:
+    python -m benchmarks.startup --runs 10 --budget 1500
+Exits with status 1 when the median start goes over the budget or a heavy module is imported while starting.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Modules that only the code paths talking to their service need. Starting the app must not import them.
+HEAVY_MODULES = ('elasticsearch', 'googletrans', 'rq')
+
+PROBE = """
+import json, sys
+from time import perf_counter
+start = perf_counter()
+from app import create_app
+from config import {config}
+app = create_app({config})
+elapsed = perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'heavy': sorted(set(sys.argv[1:]) & set(sys.modules))}}))
+"""
+
+
+def measure(config='Config'):
+    """
+    Starts the app in a new interpreter.
+    @param config: String, name of the config class in config.py
+    @return: Dictionary with the seconds create_app took including imports and the heavy modules it loaded
+    """
+    output = subprocess.run([sys.executable, '-c', PROBE.format(config=config), *HEAVY_MODULES],
+                            check=True, capture_output=True, text=True, cwd=ROOT).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--budget', type=float, default=1500, help='allowed median start in milliseconds')
+    parser.add_argument('--config', default='Config', help='config class to start the app with')
+    args = parser.parse_args(argv)
+
+    runs = [measure(args.config) for _ in range(args.runs)]
+    median_ms = statistics.median(run['seconds'] for run in runs) * 1000
+    heavy = sorted({module for run in runs for module in run['heavy']})
+    print(json.dumps({'median_ms': median_ms, 'budget_ms': args.budget, 'heavy_modules': heavy}, indent=2))
+    if heavy:
+        print(f'heavy modules imported at startup: {", ".join(heavy)}', file=sys.stderr)
+    if median_ms > args.budget:
+        print(f'median start {median_ms:.0f}ms is over the {args.budget:.0f}ms budget', file=sys.stderr)
+    return 1 if heavy or median_ms > args.budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,4 +9,6 @@ while true; do
     sleep 5
 done
 flask translate compile
+flask templates compile
+flask assets build
 exec gunicorn -b :5000 --access-logfile - --error-logfile - easyblogbd:app
\ No newline at end of file
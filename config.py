@@ -11,26 +11,103 @@ load_dotenv(os.path.join(basedir, '.env'))
 class Config:
     """ Config class """
     ADMINS = ['towfiqahmed046@gmail.com']
+    CIRCUIT_BREAKER_SHARED = os.environ.get('CIRCUIT_BREAKER_SHARED') is not None
+    CIRCUIT_BREAKERS = {
+        'elasticsearch': {'failures': 5, 'reset_timeout': 30},
+        'redis': {'failures': 3, 'reset_timeout': 10},
+        'translator': {'failures': 3, 'reset_timeout': 60}
+    }
+    COMPRESS_BROTLI_QUALITY = int(os.environ.get('COMPRESS_BROTLI_QUALITY') or 4)
+    COMPRESS_ENABLED = os.environ.get('COMPRESS_DISABLED') is None
+    COMPRESS_LEVEL = int(os.environ.get('COMPRESS_LEVEL') or 6)
+    COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE') or 500)
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
     ELASTICSEARCH_NAME = os.environ.get('ELASTICSEARCH_NAME')
     ELASTICSEARCH_PASS = os.environ.get('ELASTICSEARCH_PASS')
+    ELASTICSEARCH_TIMEOUT = float(os.environ.get('ELASTICSEARCH_TIMEOUT') or 2)
+    EXPLORE_FEED_SIZE = int(os.environ.get('EXPLORE_FEED_SIZE') or 500)
+    FOLLOW_GRAPH_CACHE_ENABLED = os.environ.get('FOLLOW_GRAPH_CACHE_DISABLED') is None
+    FRAGMENT_CACHE_ENABLED = os.environ.get('FRAGMENT_CACHE_DISABLED') is None
+    FRAGMENT_CACHE_SIZE = int(os.environ.get('FRAGMENT_CACHE_SIZE') or 5000)
+    FRAGMENT_CACHE_TTL = int(os.environ.get('FRAGMENT_CACHE_TTL') or 86400)
+    JSON_PROVIDER = os.environ.get('JSON_PROVIDER') or 'orjson'
     LANGUAGES = ['bn', 'en']
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_SUPPRESS_SEND = os.environ.get('MAIL_SUPPRESS_SEND') is not None
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
+    METRICS_ALLOWED_NETWORKS = [
+        network for network in (os.environ.get('METRICS_ALLOWED_NETWORKS') or '127.0.0.1/32,::1/128').split(',') if network]
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = int(os.environ.get('METRICS_FLUSH_INTERVAL') or 5)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256:600000'
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE') or 16)
+    PASSWORD_HASH_SALT_LENGTH = int(os.environ.get('PASSWORD_HASH_SALT_LENGTH') or 16)
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 0)
+    POPUP_MAX_AGE = int(os.environ.get('POPUP_MAX_AGE') or 60)
     POSTS_PER_PAGE = 25
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_DISABLED') is None
+    RATE_LIMIT_LOCAL_BUCKETS = int(os.environ.get('RATE_LIMIT_LOCAL_BUCKETS') or 10000)
+    RATE_LIMITS = {
+        'api.create_user': '5/hour',
+        'api.get_token': '10/minute',
+        'auth.login': '20/minute',
+        'auth.register': '10/hour',
+        'main.export_posts': '3/hour',
+        'main.search': '30/minute',
+        'main.translate_text': '20/minute'
+    }
+    RATE_LIMITS_PER_ADDRESS = {
+        'api.get_token': '30/minute',
+        'auth.login': '60/minute'
+    }
+    REPLICA_LAG_CHECK_INTERVAL = int(os.environ.get('REPLICA_LAG_CHECK_INTERVAL') or 5)
+    REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG') or 5)
+    REPLICA_READ_YOUR_WRITES_WINDOW = int(os.environ.get('REPLICA_READ_YOUR_WRITES_WINDOW') or 10)
+    REPLICA_STRATEGY = os.environ.get('REPLICA_STRATEGY') or 'round_robin'
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT') or 1)
     REDIS_URL = os.environ.get('REDIS_URL') or 'redis://'
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND')
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'my-secret-key'
     MAIL_SENDGRID_API_KEY = os.environ.get('MAIL_SENDGRID_API_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', '').replace(
         'postgres://', 'postgresql://') or 'sqlite:///' + os.path.join(basedir, 'app.db')
+    SQLALCHEMY_REPLICA_URIS = [
+        uri.replace('postgres://', 'postgresql://') for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if uri]
+    SLOW_QUERY_DIR = os.environ.get('SLOW_QUERY_DIR')
+    SLOW_QUERY_EXPLAIN = os.environ.get('SLOW_QUERY_EXPLAIN_DISABLED') is None
+    SLOW_QUERY_REDACTED_COLUMNS = ('body', 'email', 'last_snippet', 'password_hash', 'token')
+    SLOW_QUERY_THRESHOLD_MS = float(os.environ['SLOW_QUERY_THRESHOLD_MS']) if os.environ.get(
+        'SLOW_QUERY_THRESHOLD_MS') else None
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQL_PROFILING = os.environ.get('SQL_PROFILING') is not None
+    SQL_PROFILING_REPEAT_THRESHOLD = int(os.environ.get('SQL_PROFILING_REPEAT_THRESHOLD') or 3)
+    SQL_PROFILING_SLOWEST = int(os.environ.get('SQL_PROFILING_SLOWEST') or 5)
+    SUGGESTIONS_PER_USER = int(os.environ.get('SUGGESTIONS_PER_USER') or 20)
+    SUGGESTIONS_SHOWN = int(os.environ.get('SUGGESTIONS_SHOWN') or 5)
+    TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR') or os.path.join(basedir, '.template_cache')
+    TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP') is not None
+    TRACE_DIR = os.environ.get('TRACE_DIR')
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE') or 1)
+    TRANSLATOR_TIMEOUT = float(os.environ.get('TRANSLATOR_TIMEOUT') or 3)
+    TRENDING_ENABLED = os.environ.get('TRENDING_DISABLED') is None
+    TRENDING_SKETCH_DEPTH = int(os.environ.get('TRENDING_SKETCH_DEPTH') or 4)
+    TRENDING_SKETCH_WIDTH = int(os.environ.get('TRENDING_SKETCH_WIDTH') or 2048)
+    TRENDING_TOP_K = int(os.environ.get('TRENDING_TOP_K') or 50)
 
 
 class TestConfig(Config):
     """ Config class for testing """
+    EXPLORE_FEED_SIZE = 0
+    FOLLOW_GRAPH_CACHE_ENABLED = False
+    FRAGMENT_CACHE_ENABLED = False
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    RATE_LIMIT_ENABLED = False
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    TEMPLATE_CACHE_DIR = None
     TESTING = True
+    TRENDING_ENABLED = False
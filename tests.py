@@ -1,10 +1,38 @@
+import base64
+import gzip
+import json
+import re
+import shutil
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
+import flask
 import pytest
-
-from app import db, create_app
-from app.models import User, Post
-from config import TestConfig
+from elastic_transport import ConnectionTimeout
+from redis.exceptions import ResponseError
+from werkzeug.security import generate_password_hash
+
+from app import cli, db, create_app, follow_graph, limiter, password_hasher, slow_query_log, tracer
+from app.clients import LazyClient
+from app.feed import explore_feed
+from app.models import Conversation, Message, Task, User, Post, followers
+from app.passwords import needs_rehash
+from app.profiling import fingerprint, profile_queries, read_slow_queries, summarize_slow_queries
+from app.ratelimit import parse_limit, take_token
+from app.readmodels import PostRow, inbox, timeline, user_rows
+from app.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from app.recommendations import build_csr, in_degrees, suggest
+from app.search import LocalSearch
+from app.serialization import FastJSONEncoder, RawJSON
+from app.seed import seed_graph
+from app.tasks import export_posts
+from app.telemetry import Metrics
+from app.tracing import parse_traceparent, read_traces
+from app.trending import trending
+from benchmarks.fakes import FakeScript, install_fakes
+from benchmarks.run import compare
+from benchmarks.startup import measure
+from config import Config, TestConfig
 
 
 def create_user(username='test-user', email='test@mail.com'):
@@ -20,6 +48,30 @@ def users_added_to_db():
     return joshim, shabana
 
 
+def social_graph_added_to_db(number_of_users=5, posts_per_user=5):
+    users = [create_user(f'user{i}', f'user{i}@mail.com') for i in range(number_of_users)]
+    db.session.add_all(users)
+    db.session.commit()
+    for user in users[1:]:
+        users[0].follow(user)
+    for user in users:
+        db.session.add_all([Post(body=f'post {i} from {user.username}', author=user) for i in range(posts_per_user)])
+    db.session.commit()
+    return users
+
+
+def log_in(client, user):
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user.id)
+        session['_fresh'] = True
+
+
+def token_header(user):
+    token = user.get_token()
+    db.session.commit()
+    return {'Authorization': f'Bearer {token}'}
+
+
 @pytest.fixture
 def app():
     app = create_app(TestConfig)
@@ -33,6 +85,42 @@ def app():
     app_context.pop()
 
 
+@pytest.fixture
+def replicated_app(tmp_path):
+    app = create_app(type('ReplicaConfig', (TestConfig,), {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / "primary.db"}',
+        'SQLALCHEMY_REPLICA_URIS': [f'sqlite:///{tmp_path / "replica.db"}'],
+        'WTF_CSRF_ENABLED': False}))
+    with app.app_context():
+        db.create_all()
+        replica = db.get_engine(app, bind='replica_0')
+        db.Model.metadata.create_all(replica)
+        for engine, about_me in ((db.engine, 'primary'), (replica, 'replica')):
+            with engine.begin() as connection:
+                connection.execute(User.__table__.insert(), [
+                    {'id': 1, 'username': 'joshim', 'email': 'joshim@mail.com', 'about_me': about_me},
+                    {'id': 2, 'username': 'shabana', 'email': 'shabana@mail.com', 'about_me': about_me}])
+        yield app
+        db.session.remove()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def max_queries():
+    @contextmanager
+    def assert_max_queries(limit):
+        with profile_queries() as profile:
+            yield profile
+        statements = '\n'.join(statement for statement, _ in profile.statements)
+        assert profile.count <= limit, f'{profile.count} queries executed, expected at most {limit}:\n{statements}'
+
+    return assert_max_queries
+
+
 def test_check_password_hash_with_wrong_password():
     user = create_user()
     password = 'pass'
@@ -153,3 +241,751 @@ def test_verify_reset_password_token(app):
 def test_verify_reset_password_token_returns_none(app):
     joshim, _ = users_added_to_db()
     assert joshim.verify_reset_password_token('wrong-token') is None
+
+
+def test_index_query_count(client, max_queries):
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    with max_queries(6):
+        assert client.get('/index').status_code == 200
+
+
+def test_explore_query_count(client, max_queries):
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    with max_queries(6):
+        assert client.get('/explore').status_code == 200
+
+
+def test_profile_query_count(client, max_queries):
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    with max_queries(9):
+        assert client.get('/profile/user1').status_code == 200
+
+
+def test_messages_query_count(client, max_queries):
+    users = social_graph_added_to_db()
+    for user in users[1:]:
+        user.send_message(users[0], f'hi from {user.username}')
+    db.session.commit()
+    log_in(client, users[0])
+    with max_queries(8):
+        page = client.get('/messages').get_data(as_text=True)
+    assert 'hi from user4' in page and 'data-username="user4"' in page
+
+
+def test_conversations_summarize_messages_and_page_by_keyset(app, client):
+    users = social_graph_added_to_db()
+    app.config['POSTS_PER_PAGE'] = 2
+    for i in range(3):
+        users[1].send_message(users[0], f'ping {i}')
+        users[0].send_message(users[1], f'pong {i}')
+    users[2].send_message(users[0], 'x' * 150)
+    users[0].send_message(users[0], 'note to self')
+    db.session.commit()
+    conversation = Conversation.between(users[0].id, users[1].id)
+    assert (conversation.last_snippet, conversation.unread_for(users[0].id), conversation.unread_for(users[1].id)) == (
+        'pong 2', 3, 3)
+    rows, cursor = inbox(users[0].id, 2)
+    assert [row.other.username for row in rows] == ['user0', 'user2'] and rows[1].last_snippet == 'x' * 100
+    rows, cursor = inbox(users[0].id, 2, cursor)
+    assert [(row.other.username, row.unread) for row in rows] == [('user1', 3)] and cursor is None
+    log_in(client, users[0])
+    page = client.get('/messages/user1').get_data(as_text=True)
+    assert 'pong 2' in page and 'ping 2' in page and 'pong 1' not in page
+    next_page = re.search(r'href="(/messages/user1\?before=\d+)"', page).group(1)
+    assert 'pong 1' in client.get(next_page).get_data(as_text=True)
+    db.session.refresh(conversation)
+    assert (conversation.unread_for(users[0].id), conversation.unread_for(users[1].id)) == (0, 3)
+
+
+def test_read_models_match_the_orm(app):
+    users = social_graph_added_to_db()
+    page = timeline(users[0].id, 1, 10)
+    assert [post.id for post in page.items] == [post.id for post in users[0].followed_posts().limit(10)]
+    assert page.total == 25 and page.pages == 3
+    assert all(type(post) is PostRow and post.author.username == f'user{post.user_id - 1}' for post in page.items)
+    assert page.items[0].author is next(post.author for post in page.items[1:] if post.user_id == page.items[0].user_id)
+    with app.test_request_context():
+        assert [row.to_dict() for row in user_rows([users[1].id, users[0].id])] == [
+            users[1].to_dict(), users[0].to_dict()]
+
+
+def test_api_get_user_query_count(client, max_queries):
+    users = social_graph_added_to_db()
+    headers = token_header(users[0])
+    with max_queries(5):
+        assert client.get(f'/api/users/{users[1].id}', headers=headers).status_code == 200
+
+
+def test_api_get_users_query_count(client, max_queries):
+    users = social_graph_added_to_db()
+    headers = token_header(users[0])
+    with max_queries(7):
+        assert client.get('/api/users', headers=headers).status_code == 200
+
+
+def test_api_get_followed_query_count(client, max_queries):
+    users = social_graph_added_to_db()
+    headers = token_header(users[0])
+    with max_queries(7):
+        assert client.get(f'/api/users/{users[0].id}/followed', headers=headers).status_code == 200
+
+
+def test_api_get_followers_query_count(client, max_queries):
+    users = social_graph_added_to_db()
+    headers = token_header(users[0])
+    with max_queries(8):
+        assert client.get(f'/api/users/{users[1].id}/followers', headers=headers).status_code == 200
+
+
+def test_profiling_flags_repeated_statements(app):
+    social_graph_added_to_db()
+    with profile_queries() as profile:
+        for post in Post.query.all():
+            post.author.username
+    assert profile.count == 6
+    assert len(profile.repeated(threshold=5)) == 1
+
+
+def test_server_timing_header_when_profiling_enabled():
+    app = create_app(type('ProfilingConfig', (TestConfig,), {'SQL_PROFILING': True}))
+    with app.app_context():
+        db.create_all()
+        users = social_graph_added_to_db()
+        client = app.test_client()
+        log_in(client, users[0])
+        response = client.get('/explore')
+        db.session.remove()
+        db.drop_all()
+    assert response.status_code == 200
+    assert response.headers['Server-Timing'].startswith('db;desc="')
+
+
+def test_metrics_endpoint_reports_request_latency(client):
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    client.get('/explore')
+    body = client.get('/metrics').get_data(as_text=True)
+    assert 'http_requests_total{endpoint="main.explore",method="GET",status="200"}' in body
+    assert 'http_request_duration_seconds_bucket{endpoint="main.explore",method="GET",le="+Inf"}' in body
+    outside = {'REMOTE_ADDR': '203.0.113.7'}
+    assert client.get('/metrics', environ_base=outside).status_code == 403
+    assert client.get('/metrics', headers={'X-Forwarded-For': '203.0.113.7'}).status_code == 403
+    client.application.config['METRICS_TOKEN'] = 'scraper'
+    assert client.get('/metrics', environ_base=outside, headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert client.get('/metrics', environ_base=outside, headers={'Authorization': 'Bearer scraper'}).status_code == 200
+
+
+def test_metrics_merges_process_shards(tmp_path):
+    registry = Metrics()
+    registry._directory = str(tmp_path)
+    registry.inc('jobs_total', task='export_posts')
+    registry.observe('rq_job_duration_seconds', 0.2, task='export_posts')
+    other_worker = {'pid': 2 ** 22 + 1, 'counters': [['jobs_total', [['task', 'export_posts']], 2]],
+                    'histograms': [], 'gauges': [['sqlalchemy_pool_checked_out', [], 3]]}
+    (tmp_path / 'metrics-other.json').write_text(json.dumps(other_worker))
+    body = registry.render()
+    assert 'jobs_total{task="export_posts"} 3' in body
+    assert 'rq_job_duration_seconds_bucket{task="export_posts",le="0.25"} 1' in body
+    assert 'sqlalchemy_pool_checked_out' not in body
+
+
+def test_local_search_ranks_by_term_frequency():
+    search = LocalSearch()
+    search.index(index='post', id=1, body={'body': 'tea and more tea'})
+    search.index(index='post', id=2, body={'body': 'tea in dhaka'})
+    search.index(index='post', id=3, body={'body': 'rain'})
+    search.delete(index='post', id=3)
+    result = search.search(index='post', body={'query': {'multi_match': {'query': 'Tea rain'}}, 'from': 0, 'size': 5})
+    assert [hit['_id'] for hit in result['hits']['hits']] == ['1', '2']
+    assert result['hits']['total']['value'] == 2
+
+
+def test_seed_graph_is_reproducible(app):
+    counts = seed_graph(db.engine, users=20, mean_follows=4, posts_per_user=3, messages_per_user=1, seed=7)
+    assert counts['user'] == 20 and counts['post'] == 60 and counts['message'] == 20
+    assert counts['conversation'] and not Message.query.filter_by(conversation_id=None).count()
+    edges = db.session.execute(followers.select()).fetchall()
+    assert len(edges) == counts['followers']
+    db.drop_all()
+    db.create_all()
+    assert seed_graph(db.engine, users=20, mean_follows=4, posts_per_user=3, messages_per_user=1, seed=7) == counts
+
+
+def test_benchmark_compare_flags_regressions():
+    baseline = {'scenarios': {'explore_first_page': {'median_ms': 10.0}, 'followed_posts': {'median_ms': 10.0}}}
+    results = {'scenarios': {'explore_first_page': {'median_ms': 12.5}, 'followed_posts': {'median_ms': 10.5}}}
+    assert compare(results, baseline, threshold=0.1) == [('explore_first_page', 10.0, 12.5)]
+
+
+def test_seed_command_bulk_inserts_and_indexes(app):
+    app.elasticsearch = LocalSearch()
+    cli.register(app)
+    result = app.test_cli_runner().invoke(args=['seed', '--users', '30', '--posts-per-user', '4', '--index'])
+    assert result.exit_code == 0, result.output
+    assert User.query.count() == 30 and Post.query.count() == 120
+    assert 'Indexed 120 posts.' in result.output
+    result = app.test_cli_runner().invoke(args=['seed', '--users', '30'])
+    assert result.exit_code != 0
+
+
+def test_fakes_stand_in_for_external_services(client, app):
+    install_fakes(app, run_jobs=False)
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    response = client.post('/translate', json={'text': 'hello', 'dest_language': 'bn', 'source_language': 'en'})
+    assert response.get_json() == {'text': '[bn] hello', 'translated': True}
+    for _ in range(5):
+        assert client.post('/translate', json={'text': 'hello', 'dest_language': 'bn'}).status_code == 400
+    assert app.extensions['circuit_breakers']['translator'].state == CLOSED
+    users[0].launch_task('export_posts', 'Exporting posts...')
+    assert len(app.task_queue) == 1
+    assert app.redis.get('missing') is None
+
+
+def test_circuit_breaker_opens_half_opens_and_closes(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('app.resilience.time', lambda: now[0])
+    registry = Metrics()
+    breaker = CircuitBreaker('translator', failures=2, reset_timeout=30, exceptions=(TimeoutError,),
+                             registry=registry)
+    for _ in range(2):
+        with pytest.raises(TimeoutError), breaker.guard():
+            raise TimeoutError
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError), breaker.guard():
+        pytest.fail('an open circuit must not call the dependency')
+    now[0] += 30
+    assert breaker.state == HALF_OPEN and breaker.allow() and not breaker.allow()
+    breaker.record_success()
+    with breaker.guard():
+        pass
+    assert breaker.state == CLOSED
+    body = registry.render()
+    assert 'circuit_breaker_trips_total{dependency="translator"} 1' in body
+    assert 'circuit_breaker_short_circuits_total{dependency="translator"} 1' in body
+
+
+def test_search_falls_back_when_elasticsearch_times_out(app, client):
+    class TimingOut:
+        calls = 0
+
+        def search(self, **kwargs):
+            TimingOut.calls += 1
+            raise ConnectionTimeout('timed out')
+
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    app.elasticsearch = TimingOut()
+    for _ in range(app.config['CIRCUIT_BREAKERS']['elasticsearch']['failures'] + 2):
+        page = client.get('/search?q=cricket')
+        assert page.status_code == 200 and 'Search is unavailable' in page.get_data(as_text=True)
+    assert TimingOut.calls == app.config['CIRCUIT_BREAKERS']['elasticsearch']['failures']
+
+
+def test_tasks_stay_pending_while_redis_is_down(app, client):
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    page = client.get('/export_posts', follow_redirects=True).get_data(as_text=True)
+    assert 'as soon as the task queue is reachable' in page
+    task = users[0].get_task_in_progress('export_posts')
+    assert not task.queued and task.get_progress() == 0
+    install_fakes(app, run_jobs=False)
+    cli.register(app)
+    result = app.test_cli_runner().invoke(args=['tasks', 'requeue'])
+    assert 'Enqueued 1 pending tasks.' in result.output
+    assert Task.query.get(app.task_queue._jobs[0].id).queued
+
+
+def test_traces_follow_an_export_from_the_request_into_its_job(app, client, tmp_path, monkeypatch):
+    app.config['TRACE_DIR'] = str(tmp_path)
+    tracer.init_app(app)
+    install_fakes(app, run_jobs=False)
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    client.get('/export_posts')
+    job = app.task_queue._jobs[0]
+    monkeypatch.setattr('app.tasks.get_current_job', lambda: job)
+    export_posts(users[0].id)
+    [spans] = read_traces(str(tmp_path)).values()
+    by_name = {span['name']: span for span in spans}
+    assert by_name['job export_posts']['parent'] == by_name['rq enqueue export_posts']['id']
+    assert by_name['rq enqueue export_posts']['parent'] == by_name['GET /export_posts']['id']
+    assert 'mail send' in by_name and 'db query' in by_name
+    [attachment] = app.extensions['mail'].outbox[-1].attachments
+    assert attachment.filename == 'posts.json' and attachment.content_type == 'application/json'
+    assert len(json.loads(attachment.data)['posts']) == 5
+    cli.register(app)
+    output = app.test_cli_runner().invoke(args=['traces', 'slowest']).output
+    assert 'GET /export_posts' in output and 'queued' in output and 'db ' in output
+
+
+def test_slow_queries_are_explained_and_grouped_by_fingerprint(app, client, tmp_path):
+    assert fingerprint("SELECT * FROM post WHERE id IN (1, 2, 3) AND body = 'it''s'") == \
+        fingerprint('SELECT * FROM post WHERE id IN (?) AND body = ?')
+    app.config.update(SLOW_QUERY_THRESHOLD_MS=0, SLOW_QUERY_DIR=str(tmp_path))
+    slow_query_log.init_app(app)
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    client.get('/profile/user1')
+    client.get('/profile/user2')
+    cli.register(app)
+    output = app.test_cli_runner().invoke(args=['queries', 'slowest', '--limit', '100']).output
+    assert 'view:main.profile' in output and '| SEARCH' in output
+    summaries = summarize_slow_queries(read_slow_queries(str(tmp_path)), 100)
+    [profile_lookup] = [summary for summary in summaries if summary['origins']['view:main.profile']
+                        and 'WHERE user.username = ?' in summary['statement']]
+    assert profile_lookup['count'] == 2 and profile_lookup['plan']
+    User.check_token('a-secret-token')
+    users[0].set_password('a-secret-password')
+    db.session.commit()
+    logged = ''.join(path.read_text() for path in tmp_path.iterdir())
+    assert 'a-secret-token' not in logged and 'user0@mail.com' not in logged and 'pbkdf2:' not in logged
+    assert '<redacted str of length 14>' in logged
+
+
+def test_inbound_traceparents_are_validated_and_sampled_locally(app, client, tmp_path):
+    trace_id, span_id = '4bf92f3577b34da6a3ce929d0e0e4736', '00f067aa0ba902b7'
+    assert parse_traceparent(f'00-{trace_id}-{span_id}-01') == (trace_id, span_id)
+    for value in (f'00-{trace_id}-{span_id}-zz', f'00-{"x" * 32}-{span_id}-01', f'00-{"0" * 32}-{span_id}-01',
+                  f'00-{trace_id}-{"0" * 16}-01', f'00-{trace_id}-{span_id}-00', 'garbage'):
+        assert parse_traceparent(value) is None
+    app.config.update(TRACE_DIR=str(tmp_path), TRACE_SAMPLE_RATE=0)
+    tracer.init_app(app)
+    assert client.get('/auth/login', headers={'traceparent': f'00-{trace_id}-{span_id}-zz'}).status_code == 200
+    assert client.get('/auth/login', headers={'traceparent': f'00-{trace_id}-{span_id}-01'}).status_code == 200
+    assert read_traces(str(tmp_path)) == {}
+
+
+def test_read_only_views_read_from_replica(replicated_app):
+    client = replicated_app.test_client()
+    log_in(client, User.query.get(1))
+    assert 'replica' in client.get('/profile/shabana').get_data(as_text=True)
+    assert client.get('/api/users/2', headers=token_header(User.query.get(1))).get_json()['about_me'] == 'replica'
+    assert 'primary' in client.get('/edit_profile').get_data(as_text=True)
+
+
+def test_reads_stick_to_primary_after_a_write(replicated_app):
+    client = replicated_app.test_client()
+    log_in(client, User.query.get(1))
+    client.post('/follow/shabana')
+    assert 'primary' in client.get('/profile/shabana').get_data(as_text=True)
+
+
+def test_explore_returns_304_until_a_new_post(client, max_queries):
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    etag = client.get('/explore').headers['ETag']
+    with max_queries(4):
+        assert client.get('/explore', headers={'If-None-Match': etag}).status_code == 304
+    db.session.add(Post(body='fresh', author=users[1]))
+    db.session.commit()
+    response = client.get('/explore', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    users[2].username = 'renamed'
+    db.session.commit()
+    assert client.get('/explore', headers={'If-None-Match': response.headers['ETag']}).status_code == 200
+
+
+def test_profile_etag_changes_after_follow(client):
+    users = social_graph_added_to_db()
+    log_in(client, users[1])
+    etag = client.get('/profile/user2').headers['ETag']
+    assert client.get('/profile/user2', headers={'If-None-Match': etag}).status_code == 304
+    version = users[2].version
+    users[3].follow(users[2])
+    db.session.commit()
+    assert users[2].version == version + 1
+    assert client.get('/profile/user2', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_api_user_conditional_get(client):
+    users = social_graph_added_to_db()
+    headers = token_header(users[0])
+    etag = client.get(f'/api/users/{users[1].id}', headers=headers).headers['ETag']
+    headers['If-None-Match'] = etag
+    assert client.get(f'/api/users/{users[1].id}', headers=headers).status_code == 304
+    users[1].about_me = 'changed'
+    db.session.commit()
+    assert client.get(f'/api/users/{users[1].id}', headers=headers).status_code == 200
+
+
+def test_profile_popup_fragment_is_cached_until_the_user_changes(client, app):
+    install_fakes(app, run_jobs=False)
+    app.config['FRAGMENT_CACHE_ENABLED'] = True
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    client.get('/profile/user1/popup')
+    key = f'fragment:popup:{users[1].id}:{users[1].version}:en'
+    assert app.redis.get(key) is not None
+    with profile_queries() as profile:
+        response = client.get('/profile/user1/popup')
+    assert sum('count(' in statement.lower() for statement, _ in profile.statements) == 1
+    assert 'unfollow/user1' in response.get_data(as_text=True)
+    users[3].follow(users[1])
+    db.session.commit()
+    assert app.redis.get(key) is None
+    assert '2 followers' in client.get('/profile/user1/popup').get_data(as_text=True)
+
+
+def test_post_card_fragment_follows_author_changes(client, app):
+    install_fakes(app, run_jobs=False)
+    app.config['FRAGMENT_CACHE_ENABLED'] = True
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    assert 'data-username="user1"' in client.get('/explore').get_data(as_text=True)
+    post = users[1].posts.first()
+    key = f'fragment:post:{post.id}:{users[1].profile_version}:en'
+    assert app.redis.get(key) is not None
+    db.session.add(Post(body='another', author=users[1]))
+    users[3].follow(users[1])
+    db.session.commit()
+    assert app.redis.get(key) is not None
+    users[1].username = 'renamed'
+    db.session.commit()
+    assert app.redis.get(key) is None
+    page = client.get('/explore').get_data(as_text=True)
+    assert 'renamed' in page
+    assert 'data-username="user1"' not in page
+
+
+def test_profile_popups_batch(client, max_queries):
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    with max_queries(7):
+        response = client.get('/popups?username=user1&username=user2&username=missing')
+    popups = response.get_json()
+    assert sorted(popups) == ['user1', 'user2']
+    assert 'unfollow/user1' in popups['user1'] and '1 follower' in popups['user1']
+    assert response.headers['Cache-Control'] == 'private, max-age=60'
+    headers = {'If-None-Match': response.headers['ETag']}
+    assert client.get('/popups?username=user1&username=user2&username=missing', headers=headers).status_code == 304
+
+
+@pytest.fixture
+def feed_app(app):
+    install_fakes(app, run_jobs=False)
+    app.config['EXPLORE_FEED_SIZE'] = 10
+    app.config['POSTS_PER_PAGE'] = 5
+    return app
+
+
+def test_explore_first_pages_come_from_the_feed_buffer(feed_app, client, max_queries):
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    assert explore_feed.rebuild()
+    db.session.add(Post(body='newest post', author=users[2]))
+    db.session.commit()
+    assert explore_feed.stamp()[:2] == Post.feed_stamp()[:2]
+    with max_queries(5):
+        page = client.get('/explore').get_data(as_text=True)
+    assert page.index('newest post') < page.index('post 4 from user4')
+    assert 'before=' in page
+    assert feed_app.redis.zcard('explore:ids') == 10
+    etag = client.get('/explore').headers['ETag']
+    assert client.get('/explore', headers={'If-None-Match': etag}).status_code == 304
+    users[2].username = 'renamed'
+    db.session.commit()
+    response = client.get('/explore', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and 'renamed' in response.get_data(as_text=True)
+
+
+def test_explore_deep_pages_use_keyset_sql(feed_app, client):
+    users = social_graph_added_to_db()
+    log_in(client, users[0])
+    explore_feed.rebuild()
+    oldest_buffered = int(feed_app.redis.zrange('explore:ids', 0, 0)[0])
+    page = client.get(f'/explore?page=3&before={oldest_buffered}').get_data(as_text=True)
+    assert f'post{oldest_buffered - 1}"' in page
+    db.session.delete(Post.query.get(oldest_buffered + 1))
+    db.session.commit()
+    assert feed_app.redis.zcard('explore:ids') == 9
+    assert explore_feed.stamp()[:2] == Post.feed_stamp()[:2]
+
+
+def test_follow_graph_cache(app, client, max_queries):
+    install_fakes(app, run_jobs=False)
+    app.config['FOLLOW_GRAPH_CACHE_ENABLED'] = True
+    users = social_graph_added_to_db()
+    cli.register(app)
+    assert app.test_cli_runner().invoke(args=['graph', 'rebuild']).output == 'Cached 4 follow edges.\n'
+    users = User.query.order_by(User.id).all()
+    with max_queries(0):
+        assert users[0].is_following(users[1])
+        assert not users[1].is_following(users[0])
+        assert users[0].followed_among(users) == {user.id for user in users[1:]}
+        assert User.follow_counts(users[:2]) == {users[0].id: (0, 4), users[1].id: (1, 0)}
+    users[0].unfollow(users[1])
+    assert not users[0].is_following(users[1])
+    assert app.redis.sismember(f'follows:{users[0].id}:followed', users[1].id)
+    db.session.commit()
+    assert not app.redis.sismember(f'follows:{users[0].id}:followed', users[1].id)
+    users[1].follow(users[0])
+    db.session.rollback()
+    assert not app.redis.sismember(f'follows:{users[1].id}:followed', users[0].id)
+
+
+def test_follow_graph_rebuild_keeps_changes_committed_during_the_copy(app, monkeypatch):
+    install_fakes(app, run_jobs=False)
+    app.config['FOLLOW_GRAPH_CACHE_ENABLED'] = True
+    users = social_graph_added_to_db()
+    snapshot = db.session.query(followers.c.follower_id, followers.c.followed_id).order_by(
+        followers.c.followed_id.desc()).all()
+
+    def edges():
+        users[0].unfollow(users[1])
+        db.session.commit()
+        yield from snapshot
+
+    assert follow_graph.rebuild(edges()) == 4
+    assert not app.redis.sismember(f'follows:{users[0].id}:followed', users[1].id)
+    assert follow_graph.followed_among(users[0].id, [user.id for user in users]) == {user.id for user in users[2:]}
+
+    def unknown_command(*args):
+        raise ResponseError("ERR unknown command 'SMISMEMBER'")
+
+    monkeypatch.setattr(app.redis, 'smismember', unknown_command)
+    assert follow_graph.followed_among(users[0].id, [user.id for user in users]) == {user.id for user in users[2:]}
+
+
+def test_suggest_ranks_friends_of_friends_before_popular_users():
+    edges = [(1, 2), (1, 3), (2, 4), (3, 4), (3, 5), (6, 5), (7, 5)]
+    indptr, indices = build_csr(edges, 8)
+    assert list(indices[indptr[3]:indptr[4]]) == [4, 5]
+    degrees = in_degrees(indices, 8)
+    assert [id for id, _ in suggest(indptr, indices, degrees, 1, 3, popular=[5, 4, 2])] == [4, 5]
+    assert [id for id, _ in suggest(indptr, indices, degrees, 4, 2, popular=[5, 4, 2])] == [5, 2]
+
+
+def test_suggestions_are_served_with_one_query(app, client, max_queries):
+    users = social_graph_added_to_db()
+    users[1].follow(users[2])
+    users[3].follow(users[1])
+    db.session.commit()
+    cli.register(app)
+    assert app.test_cli_runner().invoke(args=['suggestions', 'compute']).exit_code == 0
+    user = User.query.filter_by(username='user3').first()
+    with max_queries(1):
+        assert [suggested.username for suggested, _ in user.suggested_users(5)][:1] == ['user2']
+    headers = token_header(user)
+    items = client.get(f'/api/users/{user.id}/suggestions', headers=headers).get_json()['items']
+    assert items[0]['username'] == 'user2'
+    assert client.get(f'/api/users/{user.id - 1}/suggestions', headers=headers).status_code == 403
+
+
+def test_trending_counts_new_posts_and_searches(app, client):
+    install_fakes(app, run_jobs=False)
+    app.config['TRENDING_ENABLED'] = True
+    users = social_graph_added_to_db(posts_per_user=0)
+    for i in range(3):
+        db.session.add(Post(body=f'monsoon rain {i}', author=users[1]))
+    db.session.add(Post(body='cricket', author=users[2]))
+    db.session.commit()
+    assert trending.top('term', 'hour', 2) == [('monsoon', 3), ('rain', 3)]
+    assert trending.top('author', 'day', 1) == [(users[1].id, 3)]
+    log_in(client, users[0])
+    client.get('/search?q=cricket cricket')
+    client.get('/search?q=cricket')
+    assert trending.top('term', 'hour', 1) == [('cricket', 3)]
+    data = client.get('/api/trending?window=day&limit=2', headers=token_header(users[0])).get_json()
+    assert [author['username'] for author in data['authors']] == ['user1', 'user2']
+    assert data['terms'][0] == {'term': 'cricket', 'score': 3}
+    assert 'monsoon' in client.get('/trending').get_data(as_text=True)
+    assert client.get('/api/trending?window=week', headers=token_header(users[0])).status_code == 400
+
+
+def test_trending_buckets_expire_out_of_the_window(app):
+    install_fakes(app, run_jobs=False)
+    app.config['TRENDING_ENABLED'] = True
+    now = 1_700_000_000
+    trending.record([('term', 'old')], now=now - 2 * 3600)
+    trending.record([('term', 'new')], now=now)
+    assert trending.top('term', 'hour', now=now) == [('new', 1)]
+    assert sorted(trending.top('term', 'day', now=now)) == [('new', 1), ('old', 1)]
+
+
+def test_large_responses_are_gzipped(client):
+    users = social_graph_added_to_db(number_of_users=10)
+    log_in(client, users[0])
+    response = client.get('/explore', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert 'post 0 from user9' in gzip.decompress(response.get_data()).decode('utf-8')
+    assert 'Content-Encoding' not in client.get('/explore').headers
+
+
+def test_small_responses_are_not_compressed(client):
+    users = users_added_to_db()
+    response = client.get(f'/api/users/{users[0].id}', headers={**token_header(users[0]), 'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json()['username'] == 'joshim'
+
+
+def test_api_collections_are_streamed(client):
+    users = social_graph_added_to_db()
+    headers = {**token_header(users[0]), 'Accept-Encoding': 'gzip'}
+    response = client.get('/api/users?per_page=2&page=2', headers=headers)
+    assert response.is_streamed
+    assert response.headers['Content-Encoding'] == 'gzip'
+    data = json.loads(gzip.decompress(response.get_data()))
+    assert [user['username'] for user in data['items']] == ['user2', 'user3']
+    assert data['_meta'] == {'page': 2, 'per_page': 2, 'total_pages': 3, 'total_items': 5}
+    assert data['_links']['next'].endswith('/api/users?page=3&per_page=2')
+
+
+@pytest.mark.parametrize('provider', ['orjson', 'json'])
+def test_json_providers_write_the_same_documents(provider):
+    app = create_app(type('JSONConfig', (TestConfig,), {'JSON_PROVIDER': provider}))
+    assert (app.json_encoder is FastJSONEncoder) == (provider == 'orjson')
+    with app.test_request_context():
+        response = flask.jsonify({'when': datetime(2022, 5, 1, 12, 30, 15, 250), 'raw': RawJSON('{"progress": 40}'),
+                                  'big': 2 ** 70, 'name': 'joshim'})
+        assert response.get_data(as_text=True) == (
+            '{"big":1180591620717411303424,"name":"joshim","raw":{"progress": 40},'
+            '"when":"2022-05-01T12:30:15.000250Z"}\n')
+        assert flask.json.loads(b'{"a": [1, 2.5]}') == {'a': [1, 2.5]}
+
+
+def test_notifications_pass_payloads_through(client):
+    users = users_added_to_db()
+    users[0].add_notification('task_progress', {'task_id': 'abc', 'progress': 40})
+    db.session.commit()
+    log_in(client, users[0])
+    data = client.get('/notifications').get_json()
+    assert [(notification['name'], notification['data']) for notification in data] == [
+        ('task_progress', {'progress': 40, 'task_id': 'abc'})]
+
+
+def test_token_bucket_refills_at_the_limit_rate():
+    capacity, rate = parse_limit('2/minute')
+    allowed, wait, tokens = take_token(None, 0, 100, capacity, rate)
+    assert allowed and tokens == 1
+    allowed, wait, tokens = take_token(tokens, 100, 100, capacity, rate)
+    assert allowed and tokens == 0
+    allowed, wait, tokens = take_token(tokens, 100, 110, capacity, rate)
+    assert not allowed and wait == pytest.approx(20)
+    assert take_token(tokens, 110, 130, capacity, rate)[0]
+    with pytest.raises(ValueError):
+        parse_limit('2/fortnight')
+
+
+def test_rate_limited_endpoints_return_429_with_retry_after():
+    app = create_app(type('RateLimitConfig', (TestConfig,), {
+        'RATE_LIMIT_ENABLED': True,
+        'RATE_LIMITS': {'api.create_user': '1/hour', 'api.get_token': '2/minute', 'auth.login': '1/minute',
+                        'main.search': '1/hour'},
+        'RATE_LIMITS_PER_ADDRESS': {'auth.login': '3/minute'},
+        'WTF_CSRF_ENABLED': False}))
+    install_fakes(app, run_jobs=False)
+    with app.app_context():
+        db.create_all()
+        joshim, shabana = users_added_to_db()
+        joshim.set_password('secret')
+        shabana.set_password('secret')
+        db.session.commit()
+        client = app.test_client()
+        auth = {'Authorization': 'Basic ' + base64.b64encode(b'joshim:secret').decode()}
+        assert [client.post('/api/tokens', headers=auth).status_code for _ in range(3)] == [200, 200, 429]
+        response = client.post('/api/tokens', headers=auth)
+        assert response.get_json()['error'] == 'Too Many Requests'
+        assert 1 <= int(response.headers['Retry-After']) <= 30
+        assert client.post('/api/tokens', headers=auth, environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 200
+        made_up = [{'Authorization': f'Bearer made-up-{i}'} for i in range(2)]
+        assert [client.post('/api/users', headers=headers, json={}).status_code for headers in made_up][1] == 429
+        logins = [client.post('/auth/login', data={'username': 'joshim', 'password': 'wrong'}) for _ in range(2)]
+        assert [response.status_code for response in logins] == [302, 429]
+        rotated = [client.post('/auth/login', data={'username': username, 'password': 'wrong'})
+                   for username in ('shabana', 'user3')]
+        assert [response.status_code for response in rotated] == [302, 429]
+        assert client.post('/auth/login', data={'username': 'user3', 'password': 'wrong'},
+                           environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 302
+        assert {'api.get_token', 'auth.login', 'auth.register'} <= set(Config.RATE_LIMITS)
+        other = {'Authorization': 'Basic ' + base64.b64encode(b'shabana:wrong').decode()}
+        assert client.post('/api/tokens', headers=other).status_code == 401
+        log_in(client, shabana)
+        assert client.get('/search?q=cricket').status_code != 429
+        response = client.get('/search?q=cricket')
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) > 3000
+        db.session.remove()
+        db.drop_all()
+
+
+def test_rate_limit_script_is_registered_once_per_client(app):
+    install_fakes(app, run_jobs=False)
+    fake = app.redis
+    registered = []
+    fake.register_script = lambda script: registered.append(script) or FakeScript(fake)
+    app.redis = LazyClient(lambda: fake)
+    with app.test_request_context():
+        assert [limiter.hit('ratelimit:test', 2, 1, now=100)[0] for _ in range(3)] == [True, True, False]
+    assert len(registered) == 1
+
+
+def test_app_starts_without_importing_heavy_clients():
+    assert measure('TestConfig')['heavy'] == []
+
+
+def test_lazy_client_is_created_once_on_first_use():
+    created = []
+    client = LazyClient(lambda: created.append(1) or {'a': 1})
+    assert not client.loaded and client
+    assert client.get('a') == 1 and len(client) == 1
+    assert client.loaded and created == [1]
+
+
+def test_templates_compile_into_a_shared_bytecode_cache(tmp_path):
+    config = type('TemplateCacheConfig', (TestConfig,), {'TEMPLATE_CACHE_DIR': str(tmp_path)})
+    app = create_app(config)
+    cli.register(app)
+    result = app.test_cli_runner().invoke(args=['templates', 'compile'])
+    assert result.exit_code == 0 and 'templates' in result.output
+    assert len(list(tmp_path.glob('__jinja2_*.cache'))) == len(app.jinja_env.list_templates())
+
+    def compile_again(*args, **kwargs):
+        raise AssertionError('template compiled although its bytecode is cached')
+
+    worker = create_app(config)
+    worker.jinja_env.compile = compile_again
+    assert worker.jinja_env.get_template('_post.html')
+
+
+def test_assets_build_serves_fingerprinted_bundles(app, client, tmp_path):
+    shutil.copytree(app.static_folder, tmp_path / 'static')
+    app.static_folder = str(tmp_path / 'static')
+    log_in(client, users_added_to_db()[0])
+    page = client.get('/explore').get_data(as_text=True)
+    assert '/static/popover.js' in page and 'https://unpkg.com/@popperjs/core' in page
+
+    cli.register(app)
+    result = app.test_cli_runner().invoke(args=['assets', 'build'])
+    assert result.exit_code == 0
+    manifest = json.loads((tmp_path / 'static' / 'dist' / 'manifest.json').read_text())
+    assert list(manifest) == ['app.js']
+    assert re.fullmatch(r'dist/app\.[0-9a-f]{12}\.js', manifest['app.js'])
+    page = client.get('/explore').get_data(as_text=True)
+    assert f'/static/{manifest["app.js"]}' in page and '/static/popover.js' not in page
+
+    response = client.get(f'/static/{manifest["app.js"]}')
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+    body = response.get_data(as_text=True)
+    assert 'function translate(' in body and 'function fetchPopups(' in body and '\n    ' not in body
+    response.close()
+
+
+def test_login_upgrades_old_password_hashes_and_caps_concurrent_hashing(client):
+    joshim, _ = users_added_to_db()
+    joshim.password_hash = generate_password_hash('secret', 'pbkdf2:sha1:500')
+    db.session.commit()
+    auth = {'Authorization': 'Basic ' + base64.b64encode(b'joshim:secret').decode()}
+    assert client.post('/api/tokens', headers=auth).status_code == 200
+    assert User.query.get(joshim.id).password_hash.startswith('pbkdf2:sha256:1000$')
+    assert not needs_rehash(User.query.get(joshim.id).password_hash, 'pbkdf2:sha256:1000')
+    with password_hasher.hold_slots() as taken:
+        response = client.post('/api/tokens', headers=auth)
+    assert taken > 0
+    assert response.status_code == 429 and response.headers['Retry-After'] == '1'
+    assert client.post('/api/tokens', headers=auth).status_code == 200